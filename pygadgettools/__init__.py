@@ -1,10 +1,25 @@
 from physics.fields import \
      angular_momentum, specific_angular_momentum, \
+     net_angular_momentum, inertia_tensor, \
      mean_molecular_weight, temperature
      
+from physics.thermodynamics import thermodynamics, gas_temperature
+from physics.gravity import GravityTree
+from physics import registry
 from units import convert
-from names.filename import get_full_path
-from geometry.coordinates import change_coordinates
+from units.system import UnitSystem, ScaledArray
+from names.filename import get_full_path, get_snapshot_files
+from readers.snapfile import open_snapshot
+from readers.snapshot import Snapshot
+from geometry.coordinates import change_coordinates, change_phase_space
 from geometry import create_grid
+from geometry.deposit import deposit
+from geometry import sph
+from geometry import rotation
+from filter.index import SpatialIndex
 import filter.spatial #not perfect because np and other functions are also accessible, but whatever...
 import analysis.profile as profile
+import analysis.center as center
+from analysis.cumulative import CumulativeProfile, cumulative_profile
+from analysis.histogram import histogram, HistogramAccumulator
+import analysis.executor as executor
@@ -0,0 +1,190 @@
+###NAME: accumulators.py
+###PURPOSE: binned profiles built chunk by chunk, which can be merged across chunks, files or processes
+
+import numpy as np
+from analysis.reduction import bin_index, reduce_indexed, STATISTICS
+from geometry.create_grid import Bins
+from units.system import unscale
+
+
+
+def _edges(bins):
+    """Bin limits of a bin specification (geometry.create_grid.Bins) or of an array"""
+    return bins.edges if isinstance(bins,Bins) else np.asarray(bins)
+
+
+
+class BinnedAccumulator(object):
+    """Accumulate binned reductions (count, sum, mean, var, min, max, weighted_mean) of q(x) one chunk of particles at a time.
+
+    Partial accumulators built on different chunks, files or processes are combined with merge(). The variance is merged with the pairwise formula of Chan et al., which does not lose precision like <q^2>-<q>^2.
+
+    Parameters:
+    ----------
+
+    bins : float array or geometry.create_grid.Bins
+        bin limits
+
+    statistics : list of string
+        reductions to compute. Currently available : ("count", "sum", "mean", "var", "min", "max", "weighted_mean")
+
+
+    Example:
+    -------
+
+    >>> acc=BinnedAccumulator(bins,statistics=("mean","var"))
+    >>> for start,stop,pos in snap.iter_chunks("POS","gas"):
+    ...     acc.add(pos[:,2],snap.read("RHO","gas",start,stop))
+    >>> acc.result()["mean"]
+
+    """
+
+    def __init__(self,bins,statistics=("count",)):
+        for s in statistics:
+            if s not in STATISTICS:
+                raise KeyError(s+" must be ["+", ".join(STATISTICS)+"]")
+
+        self.bins=bins if isinstance(bins,Bins) else np.asarray(bins)
+        self.nbins=len(self.bins)-1
+        self.statistics=tuple(statistics)
+
+        self.count=np.zeros(self.nbins,dtype='int64')
+        self.sum=np.zeros(self.nbins)
+        self.mean=np.zeros(self.nbins)
+        self.m2=np.zeros(self.nbins) #sum of squared deviations to the mean
+        self.sum_weights=np.zeros(self.nbins)
+        self.sum_weighted=np.zeros(self.nbins)
+        self.min=np.empty(self.nbins)
+        self.min.fill(np.nan)
+        self.max=np.empty(self.nbins)
+        self.max.fill(np.nan)
+
+
+    def add(self,x,q=None,weights=None):
+        """Add a chunk of particles
+
+        Parameters:
+        ----------
+
+        x : float array or units.system.ScaledArray
+            position
+
+        q : float array or units.system.ScaledArray
+            quantity to be reduced. Must be the same dimension than x. The scale of a ScaledArray is applied to the reductions of the chunk.
+
+        weights : float array
+            weight of each particle, only used for "weighted_mean".
+
+        """
+
+        return self.add_indexed(bin_index(x,self.bins),q,weights)
+
+
+    def add_indexed(self,idx,q=None,weights=None):
+        """Add a chunk of particles already assigned to a bin (see reduction.bin_index)
+        """
+
+        if self._needs("weighted_mean") and weights is None:
+            raise ValueError("weights are needed for weighted_mean")
+        needed=["count"]
+        if self._needs("sum"):
+            needed+=["sum"]
+        if self._needs("mean","var"):
+            needed+=["mean","var"]
+        needed+=[s for s in ("min","max") if s in self.statistics]
+        chunk=reduce_indexed(idx,self.nbins,q=q,weights=weights,statistics=needed)
+
+        if self._needs("weighted_mean"):
+            ##lazy scales (units.system.ScaledArray) applied to the sums of the chunk
+            weights,wscale=unscale(weights)
+            q,qscale=unscale(q)
+            chunk["sum_weights"]=np.bincount(idx,weights=weights,minlength=self.nbins+1)[:self.nbins]*wscale
+            chunk["sum_weighted"]=np.bincount(idx,weights=weights*q,minlength=self.nbins+1)[:self.nbins]*(wscale*qscale)
+        self._combine(chunk)
+        return self
+
+
+    def merge(self,other):
+        """Combine with another accumulator (same bins and statistics) built on other particles
+        """
+
+        if not self._same_bins(other):
+            raise ValueError("Cannot merge accumulators with different bins.")
+        if set(self.statistics) != set(other.statistics): #the partial sums of the missing statistics are not accumulated
+            raise ValueError("Cannot merge accumulators with different statistics.")
+
+        with np.errstate(invalid='ignore',divide='ignore'):
+            chunk={"count":other.count,
+                   "sum":other.sum,
+                   "mean":other.mean,
+                   "var":other.m2/other.count,
+                   "sum_weights":other.sum_weights,
+                   "sum_weighted":other.sum_weighted,
+                   "min":other.min,
+                   "max":other.max}
+        self._combine(chunk)
+        return self
+
+
+    def _same_bins(self,other):
+        return type(self) == type(other) and np.array_equal(_edges(self.bins),_edges(other.bins))
+
+
+    def _needs(self,*statistics):
+        return any(s in self.statistics for s in statistics)
+
+
+    def _combine(self,chunk):
+        """Merge partial results (count, mean, var...) of a set of particles into the accumulator
+        """
+
+        n_b=chunk["count"]
+        filled=n_b > 0
+        n_a=self.count[filled]
+        n_b=n_b[filled]
+        n=n_a+n_b
+
+        if self._needs("sum"):
+            self.sum[filled]+=chunk["sum"][filled]
+
+        if self._needs("mean","var"):
+            mean_b=chunk["mean"][filled]
+            delta=mean_b-self.mean[filled]
+            self.mean[filled]+=delta*n_b/n
+            if self._needs("var"):
+                self.m2[filled]+=chunk["var"][filled]*n_b + delta*delta*n_a*n_b/n
+
+        if self._needs("weighted_mean"):
+            self.sum_weights[filled]+=chunk["sum_weights"][filled]
+            self.sum_weighted[filled]+=chunk["sum_weighted"][filled]
+
+        if self._needs("min"):
+            self.min=np.fmin(self.min,chunk["min"])
+        if self._needs("max"):
+            self.max=np.fmax(self.max,chunk["max"])
+
+        self.count[filled]=n
+
+
+    def result(self):
+        """Return a dictionary with the requested statistics. Empty bins are NaN (0 for count and sum).
+        """
+
+        output={}
+        empty=self.count == 0
+        with np.errstate(invalid='ignore',divide='ignore'):
+            for s in self.statistics:
+                if s == "count":
+                    output[s]=self.count.copy()
+                elif s == "sum":
+                    output[s]=self.sum.copy()
+                elif s == "mean":
+                    output[s]=np.where(empty,np.nan,self.mean)
+                elif s == "var":
+                    output[s]=self.m2/self.count
+                elif s == "weighted_mean":
+                    output[s]=self.sum_weighted/self.sum_weights
+                elif s in ("min","max"):
+                    output[s]=getattr(self,s).copy()
+
+        return output
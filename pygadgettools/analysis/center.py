@@ -0,0 +1,171 @@
+###NAME: center.py
+###PURPOSE: find the center of a halo or a galaxy (shrinking sphere, density peak)
+
+import numpy as np
+from geometry.deposit import deposit
+from geometry.periodic import recenter, wrap
+
+
+
+def _center_of_mass(pos,mass,center,boxsize=None):
+    """Return the center of mass of pos, computed relative to center (nearest periodic image if boxsize is given)
+    """
+
+    d=recenter(pos,center,boxsize=boxsize)
+    total=np.sum(mass)
+    return center+np.array([np.sum(d[:,i]*mass) for i in range(3)])/total
+
+
+
+def _inside(pos,center,radius,boxsize=None):
+    """Return a filter (boolean) of the particles of pos within radius of center"""
+
+    d=recenter(pos,center,boxsize=boxsize)
+    d*=d
+    return np.sum(d,axis=1) <= radius**2
+
+
+
+def shrinking_sphere(pos,mass=None,center=None,radius=None,shrink=0.9,min_particles=100,
+                     max_iterations=200,index=None,boxsize=None):
+    """Find the center with the shrinking sphere method (Power et al. 2003)
+
+    The center of mass of the particles inside a sphere is computed, then the sphere is moved to this center and its radius is reduced by the factor shrink, until it contains less than min_particles. Only the first sphere is selected in the whole snapshot (with the spatial index if given) : each iteration then works on the particles of the previous sphere.
+
+    Parameters:
+    ----------
+
+    pos : float array [N,3]
+        cartesian coordinates
+
+    mass : float array [N]
+        masses. Default is the same mass for all particles.
+
+    center : list or float array (3)
+        center of the first sphere. Default is the center of mass of all the particles (not meaningful in a periodic box).
+
+    radius : float
+        radius of the first sphere. Default is the distance to the furthest particle.
+
+    shrink : float
+        factor applied to the radius at each iteration
+
+    min_particles : integer
+        the iterations stop when the sphere contains less particles
+
+    max_iterations : integer
+        maximal number of iterations
+
+    index : filter.index.SpatialIndex
+        spatial index built on pos, used to select the first sphere
+
+    boxsize : float
+        size of the periodic box. Default is the boxsize of the index, if given.
+
+
+    Example:
+    -------
+
+    >>> center=shrinking_sphere(pos_dm,mass_dm,center=guess,radius=100.)
+
+    """
+
+    if index is not None and boxsize is None:
+        boxsize=index.boxsize
+    if mass is None:
+        mass=np.ones(len(pos))
+
+    if center is None:
+        center=np.array([np.sum(pos[:,i]*mass) for i in range(3)])/np.sum(mass)
+    center=np.asarray(center,dtype='float64')
+
+    ##first sphere
+    if radius is None:
+        d=recenter(pos,center,boxsize=boxsize)
+        d*=d
+        radius=np.sqrt(np.max(np.sum(d,axis=1)))
+        sub_pos=np.asarray(pos)
+        sub_mass=np.asarray(mass)
+    else:
+        if index is not None:
+            ind=index.sphere(center,radius)
+        else:
+            ind=np.flatnonzero(_inside(pos,center,radius,boxsize))
+        sub_pos=pos[ind]
+        sub_mass=mass[ind]
+
+    for iteration in range(max_iterations):
+        if len(sub_pos) < min_particles:
+            break
+        center=_center_of_mass(sub_pos,sub_mass,center,boxsize)
+        radius*=shrink
+        inside=_inside(sub_pos,center,radius,boxsize)
+        sub_pos=sub_pos[inside]
+        sub_mass=sub_mass[inside]
+
+    if boxsize is not None:
+        center=wrap(center,boxsize)
+    return center
+
+
+
+def density_peak(pos,mass=None,ncells=64,refine=True,refine_cells=2.,min_particles=100,index=None,boxsize=None):
+    """Find the center at the peak of density
+
+    The particles are deposited (CIC) on a coarse grid, and the center of the densest cell is refined with a shrinking sphere on the particles near this cell only.
+
+    Parameters:
+    ----------
+
+    pos : float array [N,3]
+        cartesian coordinates. Can be a np.memmap : the coarse grid is built by chunks.
+
+    mass : float array [N]
+        masses. Default is the same mass for all particles.
+
+    ncells : integer
+        number of cells per dimension of the coarse grid
+
+    refine : boolean
+        if False, return the center of the densest cell
+
+    refine_cells : float
+        radius of the first sphere of the refinement, in number of cells
+
+    min_particles : integer
+        see shrinking_sphere
+
+    index : filter.index.SpatialIndex
+        spatial index built on pos, used to select the particles near the peak. If not given, the particles are scanned once.
+
+    boxsize : float
+        size of the periodic box. Default is the boxsize of the index, if given.
+
+
+    Example:
+    -------
+
+    >>> index=SpatialIndex(pos_gas,boxsize=header["BoxSize"])
+    >>> center=density_peak(pos_gas,mass_gas,index=index)
+
+    """
+
+    if index is not None and boxsize is None:
+        boxsize=index.boxsize
+
+    if boxsize is not None:
+        lower=np.zeros(3)
+        upper=np.ones(3)*boxsize
+    else:
+        lower=np.array([np.min(pos[:,i]) for i in range(3)],dtype='float64')
+        upper=np.array([np.max(pos[:,i]) for i in range(3)],dtype='float64')
+        upper+=1e-7*(upper-lower) #so that the last particle is inside the grid
+    grid=deposit(pos,ncells,lower=lower,upper=upper,weights=mass,kernel="cic",boxsize=boxsize)
+    cellsize=(upper-lower)/ncells
+    peak=np.array(np.unravel_index(np.argmax(grid),grid.shape))
+    center=lower+(peak+0.5)*cellsize
+
+    if not refine:
+        return center
+    return shrinking_sphere(pos,mass,center=center,radius=refine_cells*np.max(cellsize),
+                            min_particles=min_particles,index=index,boxsize=boxsize)
@@ -0,0 +1,164 @@
+###NAME: cumulative.py
+###PURPOSE: cumulative radial profiles (enclosed mass, circular velocity, potential, escape velocity) from a single sort of the radii
+
+import weakref
+import numpy as np
+from units.common import UnitGravity
+from geometry.coordinates import radius as distance
+
+
+_CACHE = weakref.WeakKeyDictionary() #cumulative profiles already built for each snapshot
+
+
+
+class CumulativeProfile(object):
+    """Cumulative profiles of a set of particles around a center, built from a single sort of the radii
+
+    Once built, any quantity at any radius only costs a searchsorted. The potential is the potential of the spherically averaged mass distribution : phi(r)=-G*(M(<r)/r + sum over the particles outside r of m/r_i).
+
+    Parameters:
+    ----------
+
+    r : float array
+        distance of each particle to the center
+
+    mass : float array
+        mass of each particle. Must be the same dimension than r.
+
+    G : float
+        gravitational constant. Default is in Gadget units (see units.common).
+
+
+    Example:
+    -------
+
+    >>> cp=CumulativeProfile(radius(pos,center),mass)
+    >>> cp.enclosed_mass(rvir)
+    >>> vc=cp.circular_velocity(np.logspace(-1,2,50))
+
+    """
+
+    def __init__(self,r,mass,G=UnitGravity):
+        self.G=G
+        order=np.argsort(r)
+        self.r=np.asarray(r,dtype='float64')[order]
+        m=np.asarray(mass,dtype='float64')[order]
+        self.cumulative_mass=np.cumsum(m)
+
+        ##sum of m/r of the particles from k to the end, for the potential
+        with np.errstate(divide='ignore',invalid='ignore'):
+            m_over_r=m/self.r
+        self.outer=np.zeros(len(m)+1)
+        self.outer[:-1]=np.cumsum(m_over_r[::-1])[::-1]
+
+
+    def _count(self,radius):
+        """Number of particles with r <= radius"""
+
+        return np.searchsorted(self.r,radius,side='right')
+
+
+    def enclosed_mass(self,radius):
+        """Return the mass inside radius M(<=radius)"""
+
+        n=self._count(radius)
+        return np.where(n > 0,self.cumulative_mass[np.maximum(n-1,0)],0.)
+
+
+    def circular_velocity(self,radius):
+        """Return the circular velocity sqrt(G M(<r) / r)"""
+
+        with np.errstate(divide='ignore',invalid='ignore'):
+            return np.sqrt(self.G*self.enclosed_mass(radius)/radius)
+
+
+    def potential(self,radius):
+        """Return the gravitational potential of the spherically averaged mass distribution (0 at infinity)"""
+
+        n=self._count(radius)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            inner=np.where(n > 0,self.cumulative_mass[np.maximum(n-1,0)],0.)/radius
+        return -self.G*(inner+self.outer[n])
+
+
+    def escape_velocity(self,radius):
+        """Return the escape velocity sqrt(-2 phi(r))"""
+
+        return np.sqrt(-2.*self.potential(radius))
+
+
+
+def cumulative_profile(snap,ptype,center=[0,0,0],boxsize=None,G=UnitGravity):
+    """Return the CumulativeProfile of a particle type around center, cached on the snapshot
+
+    The radii are read and sorted only the first time : the next calls with the same snapshot, type and center return the same object. The cache is released with the snapshot.
+
+    Parameters:
+    ----------
+
+    snap : snapshot
+        opened snapshot (see readers.snapfile.open_snapshot)
+
+    ptype : integer or string
+        particle type
+
+    center : list or float array (3)
+        center of the profile
+
+    boxsize : float
+        size of the periodic box. If given, the distance to the nearest periodic image of center is used.
+
+    G : float
+        gravitational constant. Default is in Gadget units.
+
+
+    Example:
+    -------
+
+    >>> snap=open_snapshot("snapshot_100")
+    >>> cumulative_profile(snap,"dm",center).enclosed_mass([10.,100.])
+    >>> cumulative_profile(snap,"dm",center).circular_velocity(radius) #no sort this time
+
+    """
+
+    key=(ptype,tuple(np.asarray(center,dtype='float64')),boxsize,G)
+    profiles=_CACHE.setdefault(snap,{})
+    if key not in profiles:
+        r=distance(snap.block("POS",ptype),center,boxsize=boxsize)
+        profiles[key]=CumulativeProfile(r,snap.block("MASS",ptype),G=G)
+    return profiles[key]
+
+
+
+def enclosed_mass_at(r,mass,radius):
+    """Return the mass inside a few radii M(<=radius), without sorting the particles
+
+    Each particle is assigned to the interval between two target radii (binary search among the targets), the intervals are summed and accumulated : the cost is N*log(len(radius)), cheaper than a sort when only a few radii are needed.
+
+    Parameters:
+    ----------
+
+    r : float array
+        distance of each particle to the center
+
+    mass : float array
+        mass of each particle
+
+    radius : float array
+        radii at which the enclosed mass is computed
+
+
+    Example:
+    -------
+
+    >>> m200,m500=enclosed_mass_at(r,mass,[r200,r500])
+
+    """
+
+    radius=np.asarray(radius,dtype='float64')
+    order=np.argsort(radius)
+    idx=np.searchsorted(radius[order],r,side='left') #first target radius >= r
+    shells=np.bincount(idx,weights=mass,minlength=len(radius)+1)[:len(radius)]
+    result=np.empty(len(radius))
+    result[order]=np.cumsum(shells)
+    return result
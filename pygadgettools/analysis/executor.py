@@ -0,0 +1,362 @@
+###NAME: executor.py
+###PURPOSE: out-of-core execution of a per-particle pipeline : the snapshot is streamed by chunks of bounded size, the next chunk being read in the background
+
+import numpy as np
+from multiprocessing.pool import ThreadPool
+from readers.common import CHUNK_BYTES, BLOCK_NAMES, _particle_type
+from physics.registry import FIELDS as REGISTRY
+from analysis.accumulators import BinnedAccumulator
+from analysis.histogram import HistogramAccumulator
+from geometry.deposit import deposit
+from geometry.create_grid import Bins
+
+try:
+    import h5py
+except ImportError: #h5py is only needed to write the catalogues
+    h5py = None
+
+
+
+## PIPELINE STEPS : function(chunk) -> chunk, where chunk is a dictionary of arrays with one row per particle
+
+class Filter(object):
+    """Keep only the particles of the chunk for which select(chunk) is True
+
+    Example:
+    -------
+
+    >>> Filter(lambda c: c["r"] < 100.)
+
+    """
+
+    def __init__(self,select):
+        self.select=select
+
+
+    def __call__(self,chunk):
+        mask=np.asarray(self.select(chunk),dtype=bool)
+        return dict((name,value[mask]) for name,value in chunk.items())
+
+
+
+class Compute(object):
+    """Add a column to the chunk : chunk[name]=function(chunk[inputs[0]],chunk[inputs[1]],...)
+
+    Example:
+    -------
+
+    >>> Compute("pos_cyl",lambda pos: change_coordinates(pos,"pos","cart","cyl"),"pos")
+
+    """
+
+    def __init__(self,name,function,*inputs):
+        self.name=name
+        self.function=function
+        self.inputs=inputs
+
+
+    def __call__(self,chunk):
+        chunk[self.name]=self.function(*[chunk[i] for i in self.inputs])
+        return chunk
+
+
+
+## SINKS : reductions fed chunk by chunk, with add(chunk) and result()
+
+class ProfileSink(object):
+    """Binned reductions of chunk[q] as function of chunk[x] (see analysis.accumulators.BinnedAccumulator)
+
+    Example:
+    -------
+
+    >>> ProfileSink("r","T",LogBins(0.1,100,50),statistics=("mean","var"))
+
+    """
+
+    def __init__(self,x,q,bins,statistics=("mean",),weights=None):
+        self.x=x
+        self.q=q
+        self.weights=weights
+        self.accumulator=BinnedAccumulator(bins,statistics)
+
+
+    def add(self,chunk):
+        self.accumulator.add(chunk[self.x],None if self.q is None else chunk[self.q],
+                             None if self.weights is None else chunk[self.weights])
+
+
+    def result(self):
+        return self.accumulator.result()
+
+
+
+class HistogramSink(object):
+    """Multidimensional binned reductions (see analysis.histogram.HistogramAccumulator)
+
+    Example:
+    -------
+
+    >>> HistogramSink(["number_density","T"],[LogBins(1e-6,1e4,100),LogBins(10,1e8,100)],"MASS",statistics=("sum",))
+
+    """
+
+    def __init__(self,coordinates,bins,q=None,statistics=("count",),weights=None):
+        self.coordinates=list(coordinates)
+        self.q=q
+        self.weights=weights
+        self.accumulator=HistogramAccumulator(bins,statistics)
+
+
+    def add(self,chunk):
+        self.accumulator.add([chunk[c] for c in self.coordinates],None if self.q is None else chunk[self.q],
+                             None if self.weights is None else chunk[self.weights])
+
+
+    def result(self):
+        return self.accumulator.result()
+
+
+
+class DepositSink(object):
+    """Deposit onto a regular grid (see geometry.deposit.deposit). The extent of the grid must be known in advance : lower and upper, boxsize or LinearBins.
+
+    Example:
+    -------
+
+    >>> DepositSink("POS",256,weights="MASS",boxsize=header["BoxSize"],kernel="tsc")
+
+    """
+
+    def __init__(self,pos,shape,weights=None,**kwargs):
+        bins=isinstance(shape,Bins) or (isinstance(shape,(list,tuple)) and isinstance(shape[0],Bins))
+        if kwargs.get("boxsize") is None and (kwargs.get("lower") is None or kwargs.get("upper") is None) and not bins:
+            raise ValueError("the extent of the grid (lower and upper, boxsize or LinearBins) is needed to deposit chunk by chunk")
+        self.pos=pos
+        self.shape=shape
+        self.weights=weights
+        self.kwargs=kwargs
+        self.grid=None
+
+
+    def add(self,chunk):
+        self.grid=deposit(chunk[self.pos],self.shape,weights=None if self.weights is None else chunk[self.weights],
+                          out=self.grid,**self.kwargs)
+
+
+    def result(self):
+        return self.grid
+
+
+
+class CatalogueWriter(object):
+    """Write the particles reaching the end of the pipeline to a HDF5 file, in the Gadget/GIZMO format (it can be opened again with open_snapshot)
+
+    The raw blocks (POS, VEL, MASS...) are written with their HDF5 names (Coordinates, Velocities, Masses...). The derived columns are written under their own names : 'pos' or 'T' are read back with snap.block("pos",ptype) or snap.block("T",ptype), not as POS or U.
+
+    Parameters:
+    ----------
+
+    filename : string
+        output HDF5 file
+
+    fields : list of string
+        columns to write
+
+    header : dictionary
+        header of the snapshot, copied with the number of particles written
+
+
+    Example:
+    -------
+
+    >>> CatalogueWriter("halo.hdf5",["POS","VEL","MASS","ID"],snap.header)
+
+    """
+
+    def __init__(self,filename,fields,header=None):
+        if h5py is None:
+            raise ImportError("h5py is required to write the catalogues.")
+        self.filename=filename
+        self.fields=list(fields)
+        self.header={} if header is None else dict(header)
+        self.ptype=0
+        self.count=0
+        self._file=None
+
+
+    def _open(self,chunk):
+        self._file=h5py.File(self.filename,'w')
+        group=self._file.create_group("PartType"+str(self.ptype))
+        for name in self.fields:
+            value=np.asarray(chunk[name])
+            group.create_dataset(BLOCK_NAMES.get(name,name),shape=(0,)+value.shape[1:],maxshape=(None,)+value.shape[1:],
+                                 dtype=value.dtype,chunks=True)
+
+
+    def add(self,chunk):
+        if self._file is None:
+            self._open(chunk)
+        n=len(chunk[self.fields[0]])
+        group=self._file["PartType"+str(self.ptype)]
+        for name in self.fields:
+            dataset=group[BLOCK_NAMES.get(name,name)]
+            dataset.resize(self.count+n,axis=0)
+            dataset[self.count:self.count+n]=chunk[name]
+        self.count+=n
+
+
+    def result(self):
+        """Write the header, close the file and return the number of particles written"""
+
+        if self._file is None:
+            self._file=h5py.File(self.filename,'w')
+        npart=np.zeros(6,dtype='int64')
+        npart[self.ptype]=self.count
+        header=self._file.require_group("Header")
+        for key,value in self.header.items():
+            header.attrs[key]=value
+        header.attrs["NumPart_ThisFile"]=npart
+        header.attrs["NumPart_Total"]=npart
+        header.attrs["NumFilesPerSnapshot"]=1
+        if "MASS" in self.fields: #the masses are read from the field, not from the header
+            header.attrs["MassTable"]=np.zeros(6)
+        self.close()
+        return self.count
+
+
+    def close(self):
+        """Close the file, also when the pipeline fails before result() (the catalogue is then incomplete)"""
+
+        if self._file is not None:
+            self._file.close()
+            self._file=None
+
+
+
+class ChunkedExecutor(object):
+    """Stream the particles of a snapshot through a pipeline and into reductions, by chunks of bounded size
+
+    For each chunk, the raw blocks needed by the requested fields are read, the derived fields are computed (see physics.registry), the pipeline steps (filters, transformations) are applied and the result is fed to every sink (profiles, histograms, deposits, catalogues). The next chunk is read on a background thread while the current one is processed, so the I/O overlaps with the computation. The memory used is a few chunks whatever the size of the snapshot.
+
+    Parameters:
+    ----------
+
+    snap : snapshot
+        opened snapshot (see readers.snapfile.open_snapshot), binary or HDF5, in one or several files
+
+    ptype : integer or string
+        particle type
+
+    fields : list of string
+        raw blocks ('POS','MASS'...) and derived fields ('r','T','v_r'...) put in each chunk
+
+    chunk_bytes : integer
+        size of the raw blocks read for a chunk, in bytes
+
+    prefetch : boolean
+        read the next chunk in the background
+
+    registry : physics.registry.FieldRegistry
+        registry of the derived fields
+
+    **parameters :
+        parameters of the derived fields (center, boxsize, Xh...)
+
+
+    Example:
+    -------
+
+    >>> executor=ChunkedExecutor(snap,"gas",["pos","r","T","MASS"],center=center)
+    >>> sinks={"T":ProfileSink("r","T",LogBins(0.1,1e3,50)),
+    ...        "map":DepositSink("pos",512,weights="MASS",lower=[-500]*3,upper=[500]*3),
+    ...        "hot":CatalogueWriter("hot.hdf5",["pos","MASS","T"])}
+    >>> results=executor.run(sinks,pipeline=[Filter(lambda c: c["T"] > 1e6)])
+    >>> results["T"]["mean"]
+
+    """
+
+    def __init__(self,snap,ptype,fields,chunk_bytes=CHUNK_BYTES,prefetch=True,registry=REGISTRY,**parameters):
+        self.snap=snap
+        self.ptype=_particle_type(ptype)
+        self.registry=registry
+        self.plan=registry.plan(fields,snap.blocks())
+        self.parameters=parameters
+        self.prefetch=prefetch
+        self.chunk_rows=self._chunk_rows(chunk_bytes)
+
+
+    def _chunk_rows(self,chunk_bytes):
+        """Number of particles per chunk, such that the raw blocks of a chunk take about chunk_bytes"""
+
+        row_bytes=0
+        for name in self.plan.blocks:
+            sample=np.asarray(self.snap.read(name,self.ptype,0,1))
+            row_bytes+=sample.dtype.itemsize*int(np.prod(sample.shape[1:]))
+        return max(chunk_bytes//max(row_bytes,1),1)
+
+
+    def _read(self,start):
+        """Read the raw blocks of the chunk starting at start (copied in memory, also for the memory maps)"""
+
+        stop=min(start+self.chunk_rows,self.snap.npart(self.ptype))
+        return dict((name,np.array(self.snap.read(name,self.ptype,start,stop))) for name in self.plan.blocks)
+
+
+    def chunks(self,pipeline=()):
+        """Iterate over the chunks after the pipeline. Yield a dictionary of arrays per chunk."""
+
+        n=self.snap.npart(self.ptype)
+        starts=range(0,n,self.chunk_rows)
+        pool=ThreadPool(1) if (self.prefetch and len(starts) > 1) else None
+        try:
+            pending=pool.apply_async(self._read,(starts[0],)) if pool is not None else None
+            for k,start in enumerate(starts):
+                if pool is None:
+                    raw=self._read(start)
+                else:
+                    raw=pending.get()
+                    if k+1 < len(starts):
+                        pending=pool.apply_async(self._read,(starts[k+1],))
+                chunk=self.registry.compute(raw,self.plan,**self.parameters)
+                del raw
+                for step in pipeline:
+                    chunk=step(chunk)
+                yield chunk
+        finally:
+            if pool is not None:
+                pool.close()
+
+
+    def run(self,sinks,pipeline=()):
+        """Stream the snapshot through the pipeline into the sinks
+
+        Parameters:
+        ----------
+
+        sinks : dictionary or list of sinks
+            objects with add(chunk) and result() (ProfileSink, HistogramSink, DepositSink, CatalogueWriter...)
+
+        pipeline : list of function
+            steps applied to each chunk in order, function(chunk) -> chunk (Filter, Compute...)
+
+
+        Returns the results of the sinks (dictionary or list, as sinks).
+        """
+
+        named=isinstance(sinks,dict)
+        items=list(sinks.items()) if named else list(enumerate(sinks))
+        for key,sink in items:
+            if isinstance(sink,CatalogueWriter):
+                sink.ptype=self.ptype
+
+        try:
+            for chunk in self.chunks(pipeline):
+                for key,sink in items:
+                    sink.add(chunk)
+            results=[(key,sink.result()) for key,sink in items]
+        finally: #the files of the sinks are not left open if a step or a sink fails
+            for key,sink in items:
+                if hasattr(sink,"close"):
+                    sink.close()
+
+        return dict(results) if named else [value for key,value in results]
@@ -0,0 +1,122 @@
+###NAME: histogram.py
+###PURPOSE: 2D and ND binned statistics (phase diagrams : rho-T, r-v_r, j-E...), built chunk by chunk
+
+import numpy as np
+from analysis.reduction import flat_bin_index, reduce_indexed
+from analysis.accumulators import BinnedAccumulator, _edges
+from geometry.create_grid import Bins
+
+
+
+def _bins(bins):
+    """Keep the bin specifications, convert the other bin limits to arrays"""
+
+    return bins if isinstance(bins,Bins) else np.asarray(bins)
+
+
+
+class HistogramAccumulator(BinnedAccumulator):
+    """Accumulate binned reductions of q on a multidimensional grid of bins, one chunk of particles at a time
+
+    The bins of all the axes are flattened into a single index, so that each chunk only costs one bin lookup per axis and a few np.bincount. The derived columns (eg.: temperature) can thus be computed chunk by chunk and discarded. Partial histograms are combined with merge().
+
+    Parameters:
+    ----------
+
+    bins : list of float array or geometry.create_grid.Bins
+        bin limits along each axis. LinearBins and LogBins avoid the binary search.
+
+    statistics : list of string
+        reductions to compute (see analysis.reduction.STATISTICS)
+
+
+    Example:
+    -------
+
+    >>> hist=HistogramAccumulator([LogBins(1e-6,1e2,99),LogBins(1e1,1e8,99)],statistics=("count","sum"))
+    >>> for start,stop,u in snap.iter_chunks("U","gas"):
+    ...     rho=snap.read("RHO","gas",start,stop)
+    ...     T=temperature(u,snap.read("NE","gas",start,stop))
+    ...     hist.add([rho,T],snap.read("MASS","gas",start,stop))
+    >>> mass_per_bin=hist.result()["sum"] #[99,99] array
+
+    """
+
+    def __init__(self,bins,statistics=("count",)):
+        edges=[_bins(b) for b in bins]
+        self.shape=tuple(len(b)-1 for b in edges)
+        BinnedAccumulator.__init__(self,np.arange(np.prod(self.shape)+1),statistics=statistics)
+        self.bins=edges
+
+
+    def add(self,coordinates,q=None,weights=None):
+        """Add a chunk of particles
+
+        Parameters:
+        ----------
+
+        coordinates : list of float array
+            position of the particles along each axis
+
+        q : float array
+            quantity to be reduced. Not needed for "count".
+
+        weights : float array
+            weight of each particle, only used for "weighted_mean".
+
+        """
+
+        return self.add_indexed(flat_bin_index(coordinates,self.bins),q,weights)
+
+
+    def _same_bins(self,other):
+        return type(self) == type(other) and len(self.bins) == len(other.bins) and \
+            all(np.array_equal(_edges(a),_edges(b)) for a,b in zip(self.bins,other.bins))
+
+
+    def result(self):
+        """Return a dictionary with the requested statistics, each with the shape of the grid of bins
+        """
+
+        output=BinnedAccumulator.result(self)
+        return dict((s,value.reshape(self.shape)) for s,value in output.items())
+
+
+
+def histogram(coordinates,bins,q=None,weights=None,statistics=("count",)):
+    """Compute several reductions of q on a multidimensional grid of bins in a single pass over the particles
+
+    Parameters:
+    ----------
+
+    coordinates : list of float array
+        position of the particles along each axis (eg.: [rho,T] or [r,vr])
+
+    bins : list of float array or geometry.create_grid.Bins
+        bin limits along each axis
+
+    q : float array
+        quantity to be reduced (eg.: mass). Not needed for "count".
+
+    weights : float array
+        weight of each particle, only used for "weighted_mean".
+
+    statistics : list of string
+        reductions to compute. Currently available : ("count", "sum", "mean", "var", "min", "max", "weighted_mean")
+
+
+    Returns a dictionary of arrays with the shape (len(bins[0])-1, len(bins[1])-1, ...).
+
+    Example:
+    -------
+
+    >>> h=histogram([r,vr],[np.linspace(0,100,50),np.linspace(-300,300,60)],mass,statistics=("sum",))
+    >>> plt.pcolormesh(r_bins,vr_bins,h["sum"].T)
+
+    """
+
+    edges=[_bins(b) for b in bins]
+    shape=tuple(len(b)-1 for b in edges)
+    idx=flat_bin_index(coordinates,edges)
+    output=reduce_indexed(idx,int(np.prod(shape)),q=q,weights=weights,statistics=statistics)
+    return dict((s,value.reshape(shape)) for s,value in output.items())
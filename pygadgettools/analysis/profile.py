@@ -3,9 +3,20 @@
 
 import numpy as np
 import geometry.create_grid as grid
+from geometry.coordinates import radius as distance
+from analysis.reduction import binned_statistics
 import pdb
 
 
+
+def _coradius(radius):
+    """Bin limits around radius, or the bin specification itself (geometry.create_grid.Bins)"""
+
+    if isinstance(radius,grid.Bins):
+        return radius
+    return grid.grid_around(radius)
+
+
 def mean(x,q,radius):
     """Compute the mean of the quantity q(x) as function of radius
 
@@ -18,30 +29,13 @@ def mean(x,q,radius):
     q : float array
         quantity to be averaged
         
-    radius : float array
-        location at which you want the mean.
+    radius : float array or geometry.create_grid.Bins
+        location at which you want the mean, or the bins.
 
     """
 
-    ##this is a very slow function. I optimized already a bit, but maybe we can do even better...
-    
-    nr=np.size(radius)
-    coradius=grid.grid_around(radius)
-    
-
-    #copy original values
-    xx=np.copy(x)
-    qq=np.copy(q)
-    meanq=np.zeros(nr)
-    for i in range(0,nr):
-        sublist=(xx>=coradius[i]) & (xx<coradius[i+1])
-        meanq[i]=np.mean(qq[sublist])
-
-        #remove from the list already used data (for speedup)
-        qq=qq[np.logical_not(sublist)] 
-        xx=xx[np.logical_not(sublist)]
-                         
-    return meanq
+    coradius=_coradius(radius)
+    return binned_statistics(x,coradius,q,statistics=("mean",))["mean"]
 
 
 
@@ -57,31 +51,13 @@ def min(x,q,radius):
     q : float array
         quantity to be averaged
         
-    radius : float array
-        location at which you want the mean.
+    radius : float array or geometry.create_grid.Bins
+        location at which you want the mean, or the bins.
     
     """
 
-    nr=np.size(radius)
-    coradius=grid.grid_around(radius)
-    
-
-    #copy original values
-    xx=np.copy(x)
-    qq=np.copy(q)
-    meanq=np.zeros(nr)
-    for i in range(0,nr):
-        sublist=(xx>=coradius[i]) & (xx<coradius[i+1])
-        if np.sum(sublist) == 0: #handle if sublist is empty
-            meanq[i]=float('NaN')
-        else:
-            meanq[i]=np.min(qq[sublist])
-
-        #remove from the list already used data (for speedup)
-        qq=qq[np.logical_not(sublist)] 
-        xx=xx[np.logical_not(sublist)]
-                         
-    return meanq
+    coradius=_coradius(radius)
+    return binned_statistics(x,coradius,q,statistics=("min",))["min"]
 
 
 def n_in_shell(x,bins):
@@ -93,21 +69,13 @@ def n_in_shell(x,bins):
     x : float array
         position
           
-    bins : float array
+    bins : float array or geometry.create_grid.Bins
         bin limits
 
     """
         
-    #copy original values
-    xx=np.copy(x)
-    nr=len(bins)-1 #number of intervals 
-    nshell=np.zeros(nr)
-    for i in range(0,nr):
-        sublist   = (xx>=bins[i]) & (xx<bins[i+1])
-        nshell[i] = np.count_nonzero(sublist)
-        xx        = xx[np.logical_not(sublist)] #remove from the list already used data (for speedup)
-
-    return nshell
+    count=binned_statistics(x,bins,statistics=("count",))["count"]
+    return count.astype('float64')
 
 
 def mass_per_shell(x,mass,bins):
@@ -122,22 +90,12 @@ def mass_per_shell(x,mass,bins):
     mass : float array
         mass of each particle. Must be the same dimension than x.
                   
-    bins : float array
+    bins : float array or geometry.create_grid.Bins
         bin limits
 
     """
 
-    xx=np.copy(x)
-    mm=np.copy(mass)
-    nr=len(bins)-1 #number of intervals 
-    mass_bin=np.zeros(nr) #mass in each bin
-    for i in range(0,nr):
-        sublist   = (xx>=bins[i]) & (xx<bins[i+1])
-        mass_bin[i] = np.sum(mm[sublist])
-        xx        = xx[np.logical_not(sublist)] #remove from the list already used data (for speedup)
-        mm        = mm[np.logical_not(sublist)] #remove from the list already used data (for speedup)
-
-    return mass_bin
+    return binned_statistics(x,bins,mass,statistics=("sum",))["sum"]
 
 
 def enclosed_mass(x,mass,bins):
@@ -152,12 +110,12 @@ def enclosed_mass(x,mass,bins):
     mass : float array
         mass of each particle. Must be the same dimension than x.
                   
-    bins : float array
+    bins : float array or geometry.create_grid.Bins
         bin limits
 
     """
 
-    mass_shell=massPerShell(x,mass,bins) #compute mass in each shell
+    mass_shell=mass_per_shell(x,mass,bins) #compute mass in each shell
     total_mass=np.cumsum(mass_shell,dtype='float64')
     return total_mass
 
@@ -175,12 +133,44 @@ def spherical_densityDM(r,mass,radius):
     mass : float array
         mass of each particle. Must be the same dimension than r.
                   
-    radius : float array
-        radius along which you want the density profile
+    radius : float array or geometry.create_grid.Bins
+        radius along which you want the density profile, or the bins
 
     """
     
-    coradius=grid.grid_around(radius)
+    coradius=_coradius(radius)
     mass_shell=mass_per_shell(r,mass,coradius) #mass per shell
     volume_shell=grid.sphericalvolume_per_shell(coradius) #volume per shell
     return mass_shell/volume_shell
+
+
+
+def radial(pos,q,radius,center=[0,0,0],boxsize=None,statistic="mean"):
+    """Compute a radial profile of q around center, from the cartesian positions
+
+    Parameters:
+    ----------
+
+    pos : float array [N,3]
+        cartesian coordinates
+
+    q : float array
+        quantity to be reduced. Must have the same number of particles than pos.
+
+    radius : float array or geometry.create_grid.Bins
+        radius at which you want the profile, or the bins
+
+    center : list or float array (3)
+        center of the profile
+
+    boxsize : float
+        size of the periodic box. If given, the distance to the nearest periodic image of center is used.
+
+    statistic : string
+        reduction in each shell (see analysis.reduction.STATISTICS)
+
+    """
+
+    r=distance(pos,center,boxsize=boxsize)
+    coradius=_coradius(radius)
+    return binned_statistics(r,coradius,q,statistics=(statistic,))[statistic]
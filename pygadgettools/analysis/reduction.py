@@ -0,0 +1,219 @@
+###NAME: reduction.py
+###PURPOSE: single-pass binned reductions (count, sum, mean, min, max...) used by the profiles
+
+import numpy as np
+from geometry.create_grid import Bins
+from units.system import unscale
+
+
+STATISTICS=["count","sum","mean","var","min","max","weighted_mean"] #list of authorized reductions
+
+
+
+def bin_index(x,bins):
+    """Return the bin index of each element of x, such that bins[i] <= x < bins[i+1]
+
+    Parameters:
+    ----------
+
+    x : float array or units.system.ScaledArray
+        position. With a ScaledArray, the bin limits are converted to the units of the array instead of the particles.
+
+    bins : float array or geometry.create_grid.Bins
+        bin limits (must be increasing), or a bin specification. LinearBins and LogBins compute the index arithmetically, without search.
+
+
+    COMMENTS : elements outside the bins (or NaN) get the index len(bins)-1, i.e. they all fall in one overflow bin which is discarded by the reductions.
+
+    Example:
+    -------
+
+    >>> bin_index(np.array([-1.,0.,0.5,1.,2.]),np.array([0.,1.,2.]))
+    array([2, 0, 0, 1, 2])
+
+    """
+
+    x,scale=unscale(x)
+    if isinstance(bins,Bins):
+        return bins.index(x if scale == 1. else np.multiply(x,scale))
+    if scale <= 0:
+        x=np.multiply(x,scale)
+    elif scale != 1.:
+        bins=np.asarray(bins)/scale
+
+    nbins=len(bins)-1
+    idx=np.searchsorted(bins,x,side='right')
+    idx-=1
+    idx[(idx<0) | (idx>=nbins)]=nbins #values before the first edge or after the last edge
+
+    return idx
+
+
+
+def flat_bin_index(coordinates,bins):
+    """Return the index of each element in a multidimensional grid of bins, flattened (C order)
+
+    Parameters:
+    ----------
+
+    coordinates : list of float array
+        position along each axis (eg.: [rho,T])
+
+    bins : list of float array or geometry.create_grid.Bins
+        bin limits along each axis
+
+
+    COMMENTS : elements outside the bins along any axis get the index prod(len(bins[i])-1), i.e. the overflow bin discarded by the reductions.
+
+    Example:
+    -------
+
+    >>> flat_bin_index([np.array([0.5,1.5,5.]),np.array([0.5,0.5,0.5])],[np.array([0.,1.,2.]),np.array([0.,1.])])
+    array([0, 1, 2])
+
+    """
+
+    shape=[len(b)-1 for b in bins]
+    nbins=int(np.prod(shape))
+    idx=np.zeros(len(coordinates[0]),dtype='int64')
+    overflow=np.zeros(len(idx),dtype=bool)
+    for x,b,n in zip(coordinates,bins,shape):
+        i=bin_index(x,b)
+        overflow|=i == n
+        idx*=n
+        idx+=i
+    idx[overflow]=nbins
+
+    return idx
+
+
+
+def _binned_sum(idx,nbins,weights):
+    """Sum of the weights in each bin, always in float64 (np.bincount gives integers for an empty idx)"""
+    return np.bincount(idx,weights=weights,minlength=nbins+1)[:nbins].astype('float64',copy=False)
+
+
+
+def reduce_indexed(idx,nbins,q=None,weights=None,statistics=("count",)):
+    """Compute all the requested reductions of q for particles already assigned to a bin
+
+    Parameters:
+    ----------
+
+    idx : integer array
+        bin index of each particle, as returned by bin_index. Values equal to nbins are ignored.
+
+    nbins : integer
+        number of bins
+
+    q : float array or units.system.ScaledArray
+        quantity to be reduced. Must be the same dimension than idx. Not needed for "count". The scale of a ScaledArray is applied to the reductions, not to the particles.
+
+    weights : float array or units.system.ScaledArray
+        weight of each particle, only used for "weighted_mean".
+
+    statistics : list of string
+        reductions to compute. Currently available : ("count", "sum", "mean", "var", "min", "max", "weighted_mean")
+
+
+    COMMENTS : empty bins are NaN for "mean", "var", "min", "max" and "weighted_mean", 0 for "count" and "sum". "var" is the population variance (normalized by the number of particles).
+    """
+
+    for s in statistics:
+        if s not in STATISTICS:
+            raise KeyError(s+" must be ["+", ".join(STATISTICS)+"]")
+    if "weighted_mean" in statistics and weights is None:
+        raise ValueError("weights are needed for weighted_mean")
+
+    q,scale=unscale(q)
+    if scale < 0 and (("min" in statistics) or ("max" in statistics)): #would exchange min and max
+        q,scale=np.multiply(q,scale),1.
+    weights,_=unscale(weights) #cancels out in the weighted mean
+
+    output={}
+    count=np.bincount(idx,minlength=nbins+1)[:nbins]
+    if "count" in statistics:
+        output["count"]=count
+
+    if ("sum" in statistics) or ("mean" in statistics) or ("var" in statistics):
+        total=_binned_sum(idx,nbins,q)
+        with np.errstate(invalid='ignore',divide='ignore'): #empty bins give NaN
+            mean=np.true_divide(total,count)
+        if "sum" in statistics:
+            output["sum"]=total
+        if "mean" in statistics:
+            output["mean"]=mean
+        if "var" in statistics:
+            ##second pass around the mean of each bin, more accurate than <q^2>-<q>^2
+            deviation=q-np.append(mean,0.)[idx]
+            deviation*=deviation
+            with np.errstate(invalid='ignore',divide='ignore'):
+                output["var"]=np.true_divide(_binned_sum(idx,nbins,deviation),count)
+
+    if "weighted_mean" in statistics:
+        total_weight=_binned_sum(idx,nbins,weights)
+        total=_binned_sum(idx,nbins,weights*q)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            output["weighted_mean"]=np.true_divide(total,total_weight)
+
+    if ("min" in statistics) or ("max" in statistics):
+        ##sort once by bin index, then reduce each contiguous segment
+        order=np.argsort(idx,kind='mergesort')
+        ninside=np.sum(count)
+        qsorted=q[order[:ninside]]
+        filled=count>0
+        start=np.cumsum(count)-count #first element of each bin in the sorted list
+        for s,ufunc in (("min",np.minimum),("max",np.maximum)):
+            if s in statistics:
+                result=np.empty(nbins)
+                result.fill(np.nan)
+                if ninside > 0:
+                    result[filled]=ufunc.reduceat(qsorted,start[filled])
+                output[s]=result
+
+    ##lazy scale of q, applied to the nbins results only
+    if scale != 1.:
+        for s in ("sum","mean","weighted_mean","min","max"):
+            if s in output:
+                output[s]*=scale
+        if "var" in output:
+            output["var"]*=scale*scale
+
+    return output
+
+
+
+def binned_statistics(x,bins,q=None,weights=None,statistics=("count",)):
+    """Compute several reductions of q(x) in each bin in a single pass over the particles
+
+    Parameters:
+    ----------
+
+    x : float array
+        position
+
+    bins : float array or geometry.create_grid.Bins
+        bin limits
+
+    q : float array
+        quantity to be reduced. Must be the same dimension than x.
+
+    weights : float array
+        weight of each particle, only used for "weighted_mean".
+
+    statistics : list of string
+        reductions to compute. Currently available : ("count", "sum", "mean", "var", "min", "max", "weighted_mean")
+
+
+    Example:
+    -------
+
+    >>> x=np.array([0.1,0.2,1.5])
+    >>> q=np.array([1.,3.,5.])
+    >>> binned_statistics(x,np.array([0.,1.,2.,3.]),q,statistics=("mean","min"))
+    {'min': array([  1.,   5.,  nan]), 'mean': array([  2.,   5.,  nan])}
+
+    """
+
+    idx=bin_index(x,bins)
+    return reduce_indexed(idx,len(bins)-1,q=q,weights=weights,statistics=statistics)
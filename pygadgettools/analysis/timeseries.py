@@ -0,0 +1,180 @@
+###NAME: timeseries.py
+###PURPOSE: compute the same profiles for many snapshots of a run, in parallel
+
+import os
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from names.filename import get_snapshot_files
+from readers.snapfile import open_snapshot
+from geometry.coordinates import radius
+from geometry.periodic import minimum_image
+from geometry.create_grid import Bins
+
+
+
+class ProfileSpec(object):
+    """Description of a profile to compute on each snapshot : profile(x,q,bins) where x is the radius or a coordinate of the particles and q a block.
+
+    Parameters:
+    ----------
+
+    name : string
+        name of the profile, used for the output file
+
+    profile : function
+        function with the signature profile(x,q,bins), such as profile.mean, profile.spherical_densityDM or profile.enclosed_mass
+
+    ptype : integer or string
+        particle type
+
+    block : string
+        block used as q (eg.: 'RHO', 'MASS')
+
+    bins : float array or geometry.create_grid.Bins
+        radius or bins passed to profile
+
+    center : list or float array (3)
+        center of the profile, in cartesian coordinates
+
+    coordinate : string or integer
+        x is either the distance to center ('r') or the cartesian coordinate 0, 1 or 2 (after subtracting center)
+
+    boxsize : float
+        size of the periodic box. If given, the nearest periodic image of center is used.
+
+
+    Example:
+    -------
+
+    >>> ProfileSpec("rhoDM",profile.spherical_densityDM,"dm","MASS",np.logspace(0,3,50))
+
+    """
+
+    def __init__(self,name,profile,ptype,block,bins,center=[0,0,0],coordinate="r",boxsize=None):
+        self.name=name
+        self.profile=profile
+        self.ptype=ptype
+        self.block=block
+        self.bins=bins if isinstance(bins,Bins) else np.asarray(bins)
+        self.center=np.asarray(center,dtype='float64')
+        self.coordinate=coordinate
+        self.boxsize=boxsize
+
+
+    def __call__(self,snap):
+        pos=snap.block("POS",self.ptype)
+        if self.coordinate == "r":
+            x=radius(pos,self.center,boxsize=self.boxsize)
+        else:
+            x=pos[:,self.coordinate]-self.center[self.coordinate]
+            if self.boxsize is not None:
+                minimum_image(x,self.boxsize,out=x)
+        q=np.asarray(snap.block(self.block,self.ptype))
+        return self.profile(x,q,self.bins)
+
+
+
+def _compute_profiles(job):
+    """Worker : open one snapshot and compute all the profiles
+    """
+
+    i,files,specs,kwargs=job
+    snap=open_snapshot(files,**kwargs)
+    try:
+        result=dict((spec.name,np.asarray(spec(snap),dtype='float64')) for spec in specs)
+        time=float(snap.header["Time"])
+    finally:
+        snap.close()
+    return i,time,result
+
+
+
+def profile_time_series(numbers,specs,output_dir,root="snapshot_",dir="./",ndigits=3,ext="",nprocs=None,**kwargs):
+    """Compute profiles for a range of snapshots in parallel, and save them as arrays [time,bin]
+
+    For each spec, the profiles are written in output_dir/<name>.npy as an array indexed by [snapshot,bin]. The snapshot numbers and times are written in numbers.npy and time.npy. Each snapshot is marked as done (done.npy) as soon as its profiles are written, so that an interrupted run can be resumed by calling the function again : snapshots already done are skipped.
+
+    Parameters:
+    ----------
+
+    numbers : list of integer
+        snapshot numbers (eg.: range(0,500))
+
+    specs : list of ProfileSpec
+        profiles to compute on each snapshot. Any picklable object with a name attribute, and returning a 1D array when called on an opened snapshot, can be used.
+
+    output_dir : string
+        directory where the arrays are saved
+
+    root, dir, ndigits, ext :
+        name of the snapshot files, see names.filename.get_snapshot_files
+
+    nprocs : integer
+        number of processes. Default is the number of cores.
+
+    **kwargs :
+        other arguments passed to open_snapshot
+
+
+    Example:
+    -------
+
+    >>> specs=[ProfileSpec("rhoDM",profile.spherical_densityDM,"dm","MASS",radius),
+    ...        ProfileSpec("rho",profile.mean,"gas","RHO",radius)]
+    >>> result=profile_time_series(range(500),specs,"profiles",dir="output",ext="hdf5")
+    >>> result["rhoDM"][100] #profile of the snapshot 100
+
+    """
+
+    numbers=np.asarray(numbers)
+    nsnap=len(numbers)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    def _path(name):
+        return os.path.join(output_dir,name+".npy")
+
+    ##resume a previous run if it was done on the same snapshots
+    done=np.zeros(nsnap,dtype=bool)
+    time=np.empty(nsnap)
+    time.fill(np.nan)
+    if os.path.isfile(_path("done")) and os.path.isfile(_path("numbers")) \
+       and np.array_equal(np.load(_path("numbers")),numbers) \
+       and all(os.path.isfile(_path(spec.name)) for spec in specs):
+        done=np.load(_path("done"))
+        time=np.load(_path("time"))
+    np.save(_path("numbers"),numbers)
+    np.save(_path("time"),time)
+    np.save(_path("done"),done)
+
+    outputs={}
+    for spec in specs:
+        if done.any():
+            outputs[spec.name]=np.lib.format.open_memmap(_path(spec.name),mode='r+')
+
+    jobs=[(i,get_snapshot_files(numbers[i],root=root,dir=dir,ndigits=ndigits,ext=ext),specs,kwargs)
+          for i in range(nsnap) if not done[i]]
+
+    if len(jobs) > 0:
+        nprocs=cpu_count() if nprocs is None else nprocs
+        pool=Pool(min(nprocs,len(jobs)))
+        try:
+            for i,t,result in pool.imap_unordered(_compute_profiles,jobs):
+                for name,profile in result.items():
+                    if name not in outputs: #first result gives the number of bins
+                        outputs[name]=np.lib.format.open_memmap(_path(name),mode='w+',dtype='float64',
+                                                                shape=(nsnap,len(profile)))
+                        outputs[name][:]=np.nan
+                    outputs[name][i]=profile
+                    outputs[name].flush()
+                time[i]=t
+                done[i]=True
+                np.save(_path("time"),time)
+                np.save(_path("done"),done)
+        except Exception: #do not wait for the queued snapshots : the profiles already done are saved
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+
+    return dict((name,np.load(_path(name),mmap_mode='r')) for name in outputs)
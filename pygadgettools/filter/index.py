@@ -0,0 +1,323 @@
+###NAME: index.py
+###PURPOSE: spatial index (regular grid of cells) to select particles without scanning the whole snapshot
+
+import numpy as np
+from geometry.periodic import minimum_image
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+
+PARTICLES_PER_CELL = 8   #average number of particles per cell
+MAX_CELLS_PER_DIM  = 512
+CENTERS_PER_BATCH  = 256 #number of centers processed together by spheres()
+
+
+
+class SpatialIndex(object):
+    """Regular grid of cells in which the particles are sorted, built once per snapshot and particle type.
+
+    A query (sphere, shell, box, cylinder) only visits the cells overlapping the bounding box of the region, then tests the exact shape on the particles of these cells. The cost is proportional to the number of particles near the region, not to the number of particles in the snapshot.
+
+    Parameters:
+    ----------
+
+    pos : float array [N,3]
+        cartesian coordinates. The array is kept by reference and not copied (it can be a np.memmap).
+
+    ncells : integer
+        number of cells per dimension. Default is such that there are about PARTICLES_PER_CELL particles per cell.
+
+    boxsize : float
+        size of the periodic box [0,boxsize). If given, the cells cover the whole box, the queries wrap around the boundaries and the distances are computed with the nearest periodic image.
+
+
+    Example:
+    -------
+
+    >>> index=SpatialIndex(pos)
+    >>> ind=index.sphere([0,0,0],1.) #index of the particles within 1 of the origin
+    >>> rho_in_sphere=rho[ind]
+
+    """
+
+    def __init__(self,pos,ncells=None,boxsize=None):
+        self.pos=pos
+        self.boxsize=boxsize
+        n=len(pos)
+        if ncells is None:
+            ncells=int(round((n/float(PARTICLES_PER_CELL))**(1./3.)))
+            ncells=min(max(ncells,1),MAX_CELLS_PER_DIM)
+        self.ncells=ncells
+
+        if boxsize is not None:
+            self.lower=np.zeros(3)
+            upper=np.array([boxsize,boxsize,boxsize],dtype='float64')
+        elif n > 0:
+            self.lower=np.array([np.min(pos[:,i]) for i in range(3)],dtype='float64')
+            upper=np.array([np.max(pos[:,i]) for i in range(3)],dtype='float64')
+        else:
+            self.lower=np.zeros(3)
+            upper=np.ones(3)
+        self.cellsize=(upper-self.lower)/ncells
+        self.cellsize[self.cellsize == 0]=1.
+
+        ##sort the particles by cell
+        key=np.zeros(n,dtype='int64')
+        for i in range(3):
+            key*=ncells
+            key+=self._cell(pos[:,i],i)
+        self.order=np.argsort(key,kind='mergesort')
+        counts=np.bincount(key,minlength=ncells**3)
+        self.start=np.zeros(ncells**3+1,dtype='int64') #first particle of each cell in order
+        np.cumsum(counts,out=self.start[1:])
+
+
+    def _cell(self,x,i):
+        """Cell coordinate along the axis i"""
+
+        c=np.floor((x-self.lower[i])/self.cellsize[i]).astype('int64')
+        if self.boxsize is not None:
+            return np.mod(c,self.ncells,out=c)
+        return np.clip(c,0,self.ncells-1,out=c)
+
+
+    def _cell_ranges(self,lower,upper):
+        """Return the ranges [lo,hi) in self.order of the particles in the cells overlapping each box [lower[k],upper[k]], and the box owning each range
+
+        Parameters:
+        ----------
+
+        lower, upper : float array [M,3]
+            corners of M boxes. With a periodic box, they may be outside [0,boxsize).
+
+        """
+
+        n=self.ncells
+        first=np.floor((lower-self.lower)/self.cellsize).astype('int64')
+        last=np.floor((upper-self.lower)/self.cellsize).astype('int64')
+        if self.boxsize is None:
+            outside=np.any(last < 0,axis=1) | np.any(first >= n,axis=1)
+            np.clip(first,0,n-1,out=first)
+            np.clip(last,0,n-1,out=last)
+            count=last-first+1
+            count[outside]=0
+        else: #no more than n cells per dimension, starting anywhere in the box
+            count=np.minimum(last-first+1,n)
+            np.mod(first,n,out=first)
+
+        ##cells along the last axis are contiguous : one range of particles per (box,ix,iy)
+        ny=count[:,1]
+        nrows=count[:,0]*ny
+        owner=np.repeat(np.arange(len(first)),nrows)
+        k=np.arange(len(owner))-np.repeat(np.cumsum(nrows)-nrows,nrows)
+        ix=(first[owner,0]+k//ny[owner])%n
+        iy=(first[owner,1]+k%ny[owner])%n
+        row=(ix*n+iy)*n
+        z0=first[owner,2]
+        z1=z0+count[owner,2]-1
+        lo=self.start[row+z0]
+        hi=self.start[row+np.minimum(z1,n-1)+1]
+
+        ##with a periodic box, the cells along z may continue at the beginning of the row
+        wrapped=z1 >= n
+        if np.any(wrapped):
+            row=row[wrapped]
+            owner=np.concatenate((owner,owner[wrapped]))
+            lo=np.concatenate((lo,self.start[row]))
+            hi=np.concatenate((hi,self.start[row+z1[wrapped]-n+1]))
+
+        return owner,lo,hi
+
+
+    def candidates(self,lower,upper):
+        """Return the index of the particles in the cells overlapping the box [lower,upper]
+        """
+
+        lower=np.asarray(lower,dtype='float64').reshape(1,3)
+        upper=np.asarray(upper,dtype='float64').reshape(1,3)
+        owner,lo,hi=self._cell_ranges(lower,upper)
+        return self.order[_concatenate_ranges(lo,hi)]
+
+
+    def _separation(self,pos,center,i):
+        """Separation to center along the axis i, with the nearest periodic image if needed"""
+
+        dx=pos[:,i]-center[i]
+        if self.boxsize is not None:
+            minimum_image(dx,self.boxsize,out=dx)
+        return dx
+
+
+    def _distance2(self,pos,center):
+        """Square of the distance to center, accumulated column by column"""
+
+        d2=np.zeros(len(pos))
+        for i in range(3):
+            d2+=self._separation(pos,center,i)**2
+        return d2
+
+
+    def _select(self,lower,upper,test):
+        """Return the sorted index of the particles in the box [lower,upper] for which test(pos) is True
+        """
+
+        ind=self.candidates(lower,upper)
+        ind.sort()
+        return ind[test(self.pos[ind])]
+
+
+    def sphere(self,center,rselect):
+        """Return the index of the particles inside the sphere(center,rselect)"""
+
+        center=np.asarray(center,dtype='float64')
+        return self._select(center-rselect,center+rselect,
+                            lambda p: self._distance2(p,center) <= rselect**2)
+
+
+    def spherical_shell(self,center,rmin,rmax):
+        """Return the index of the particles between the radii rmin and rmax around center"""
+
+        center=np.asarray(center,dtype='float64')
+        def test(p):
+            r2=self._distance2(p,center)
+            return (r2 >= rmin**2) & (r2 <= rmax**2)
+        return self._select(center-rmax,center+rmax,test)
+
+
+    def box(self,lower,upper):
+        """Return the index of the particles inside the box [lower,upper]"""
+
+        lower=np.asarray(lower,dtype='float64')
+        upper=np.asarray(upper,dtype='float64')
+        if self.boxsize is None:
+            return self._select(lower,upper,lambda p: np.all((p >= lower) & (p <= upper),axis=1))
+
+        middle=(lower+upper)/2.
+        def test(p):
+            inside=np.ones(len(p),dtype=bool)
+            for i in range(3):
+                inside&=np.abs(self._separation(p,middle,i)) <= upper[i]-middle[i]
+            return inside
+        return self._select(lower,upper,test)
+
+
+    def cylinder(self,center,rcyl,height,axis=2):
+        """Return the index of the particles inside the cylinder of radius rcyl and half height 'height' around center, along axis"""
+
+        center=np.asarray(center,dtype='float64')
+        extent=np.array([rcyl,rcyl,rcyl],dtype='float64')
+        extent[axis]=height
+        others=[i for i in range(3) if i != axis]
+        def test(p):
+            d2=np.zeros(len(p))
+            for i in others:
+                d2+=self._separation(p,center,i)**2
+            return (d2 <= rcyl**2) & (np.abs(self._separation(p,center,axis)) <= height)
+        return self._select(center-extent,center+extent,test)
+
+
+    def spheres(self,centers,radii,nthreads=None):
+        """Select the particles inside many spheres at once (eg.: all the haloes of a catalogue)
+
+        The centers are processed by batches : the cells of all the spheres of a batch are gathered and tested in a few vectorized operations, and the batches are distributed over a pool of threads.
+
+        Parameters:
+        ----------
+
+        centers : float array [M,3]
+            centers of the spheres
+
+        radii : float or float array [M]
+            radius of each sphere
+
+        nthreads : integer
+            number of threads. Default is the number of cores.
+
+
+        Returns (offsets,indices) : the particles inside the sphere i are indices[offsets[i]:offsets[i+1]], sorted.
+
+        Example:
+        -------
+
+        >>> offsets,indices=index.spheres(halo_center,halo_radius)
+        >>> mass_halo=np.add.reduceat(mass[indices],offsets[:-1]) #beware of empty haloes
+
+        """
+
+        centers=np.atleast_2d(np.asarray(centers,dtype='float64'))
+        radii=np.broadcast_to(np.asarray(radii,dtype='float64'),(len(centers),))
+        batches=[slice(i,min(i+CENTERS_PER_BATCH,len(centers))) for i in range(0,len(centers),CENTERS_PER_BATCH)]
+
+        def _batch(b):
+            return self._spheres_batch(centers[b],radii[b])
+
+        nthreads=cpu_count() if nthreads is None else nthreads
+        if nthreads > 1 and len(batches) > 1:
+            pool=ThreadPool(min(nthreads,len(batches)))
+            try:
+                results=pool.map(_batch,batches)
+            finally:
+                pool.close()
+        else:
+            results=[_batch(b) for b in batches]
+
+        offsets=np.zeros(len(centers)+1,dtype='int64')
+        if len(results) > 0:
+            np.cumsum(np.concatenate([counts for counts,ind in results]),out=offsets[1:])
+            indices=np.concatenate([ind for counts,ind in results])
+        else:
+            indices=np.zeros(0,dtype='int64')
+        return offsets,indices
+
+
+    def _spheres_batch(self,centers,radii):
+        """Return the number of particles in each sphere and their indices, grouped by sphere
+        """
+
+        m=len(centers)
+        owner,lo,hi=self._cell_ranges(centers-radii[:,None],centers+radii[:,None])
+
+        ##test all the candidates against the center of their sphere
+        owner=np.repeat(owner,hi-lo)
+        ind=self.order[_concatenate_ranges(lo,hi)]
+        d2=np.zeros(len(ind))
+        p=self.pos[ind]
+        for i in range(3):
+            dx=p[:,i]-centers[owner,i]
+            if self.boxsize is not None:
+                minimum_image(dx,self.boxsize,out=dx)
+            d2+=dx*dx
+        inside=d2 <= radii[owner]**2
+        ind=ind[inside]
+        owner=owner[inside]
+
+        sort=np.lexsort((ind,owner))
+        return np.bincount(owner,minlength=m),ind[sort]
+
+
+
+def _concatenate_ranges(lo,hi):
+    """Return the concatenation of arange(lo[i],hi[i]) for all i, without python loop
+
+    Example:
+    -------
+
+    >>> _concatenate_ranges(np.array([0,5]),np.array([2,8]))
+    array([0, 1, 5, 6, 7])
+
+    """
+
+    length=hi-lo
+    keep=length > 0
+    lo=lo[keep]
+    length=length[keep]
+    total=np.sum(length)
+    if total == 0:
+        return np.zeros(0,dtype='int64')
+
+    ##start from 1 everywhere, and jump at the beginning of each range
+    step=np.ones(total,dtype='int64')
+    first=np.cumsum(length)-length
+    step[0]=lo[0]
+    step[first[1:]]=lo[1:]-(lo[:-1]+length[:-1]-1)
+    return np.cumsum(step)
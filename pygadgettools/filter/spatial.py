@@ -1,11 +1,23 @@
 ###NAME: spatial.py
 ###PURPOSE: select particles with spatial filter
 
-from geometry.coordinates import change_coordinates
+import numpy as np
+from geometry.coordinates import radius
+from geometry.periodic import minimum_image, recenter
+from filter.index import SpatialIndex
 
 
 
-def sphere(pos,rselect,center=[0,0,0]):
+def _from_index(pos,ind):
+    """Convert an index of particles into a filter (boolean)"""
+
+    selection=np.zeros(len(pos),dtype=bool)
+    selection[ind]=True
+    return selection
+
+
+
+def sphere(pos,rselect,center=[0,0,0],index=None,boxsize=None):
     """ Return a filter (boolean) to select all particles inside the sphere(center,r)
 
     Parameters:
@@ -20,13 +32,22 @@ def sphere(pos,rselect,center=[0,0,0]):
     center : list or float array (3)
          center of sphere in cartesian coordinates and same units than pos
 
+    index : filter.index.SpatialIndex
+         spatial index built on pos. If given, only the particles near the sphere are tested.
+
+    boxsize : float
+         size of the periodic box. If given, distances use the nearest periodic image (ignored if index is given : the index has its own boxsize).
+
     """
 
-    r=change_coordinates(pos-center,"pos","cart","sph")[:,0]
+    if index is not None:
+        return _from_index(pos,index.sphere(center,rselect))
+
+    r=radius(pos,center,boxsize=boxsize)
     return r<=rselect
-    
 
-def spherical_shell(pos,rmin,rmax,center=[0,0,0]):
+
+def spherical_shell(pos,rmin,rmax,center=[0,0,0],index=None,boxsize=None):
     """Return a filter (boolean) to select all particles inside a spherical shell between rmin and rmax.
 
     Parameters:
@@ -43,9 +64,169 @@ def spherical_shell(pos,rmin,rmax,center=[0,0,0]):
 
     center : list or float array (3)
          center of sphere in cartesian coordinates and same units than pos
+
+    index : filter.index.SpatialIndex
+         spatial index built on pos. If given, only the particles near the shell are tested.
+
+    boxsize : float
+         size of the periodic box. If given, distances use the nearest periodic image (ignored if index is given : the index has its own boxsize).
     """
 
-    r=change_coordinates(pos-center,"pos","cart","sph")[:,0]
+    if index is not None:
+        return _from_index(pos,index.spherical_shell(center,rmin,rmax))
+
+    r=radius(pos,center,boxsize=boxsize)
     return ((r>=rmin) & (r<=rmax))
 
 
+def box(pos,lower,upper,index=None,boxsize=None):
+    """Return a filter (boolean) to select all particles inside the box [lower,upper]
+
+    Parameters:
+    ----------
+
+    pos : float array
+         cartesian coordinates
+
+    lower, upper : list or float array (3)
+         lower and upper corners of the box
+
+    index : filter.index.SpatialIndex
+         spatial index built on pos. If given, only the particles near the box are tested.
+
+    boxsize : float
+         size of the periodic box. If given, distances use the nearest periodic image (ignored if index is given : the index has its own boxsize).
+    """
+
+    if index is not None:
+        return _from_index(pos,index.box(lower,upper))
+
+    selection=np.ones(len(pos),dtype=bool)
+    for i in range(3):
+        if boxsize is None:
+            selection&=(pos[:,i]>=lower[i]) & (pos[:,i]<=upper[i])
+        else: #distance to the middle of the box, which may cross the boundary
+            middle=(lower[i]+upper[i])/2.
+            selection&=np.abs(minimum_image(pos[:,i]-middle,boxsize))<=upper[i]-middle
+    return selection
+
+
+def cylinder(pos,rcyl,height,center=[0,0,0],axis=2,index=None,boxsize=None):
+    """Return a filter (boolean) to select all particles inside a cylinder
+
+    Parameters:
+    ----------
+
+    pos : float array
+         cartesian coordinates
+
+    rcyl : float
+         radius of the cylinder
+
+    height : float
+         half height of the cylinder
+
+    center : list or float array (3)
+         center of the cylinder
+
+    axis : integer
+         axis of the cylinder (0, 1 or 2 for x, y or z)
+
+    index : filter.index.SpatialIndex
+         spatial index built on pos. If given, only the particles near the cylinder are tested.
+
+    boxsize : float
+         size of the periodic box. If given, distances use the nearest periodic image (ignored if index is given : the index has its own boxsize).
+    """
+
+    if index is not None:
+        return _from_index(pos,index.cylinder(center,rcyl,height,axis=axis))
+
+    def separation(i):
+        dx=pos[:,i]-center[i]
+        if boxsize is not None:
+            minimum_image(dx,boxsize,out=dx)
+        return dx
+
+    rho2=np.zeros(len(pos))
+    for i in range(3):
+        if i != axis:
+            rho2+=separation(i)**2
+    return (rho2<=rcyl**2) & (np.abs(separation(axis))<=height)
+
+
+def spheres(pos,centers,radii,index=None,nthreads=None,boxsize=None):
+    """Select the particles inside many spheres at once (eg.: all the haloes of a catalogue)
+
+    Parameters:
+    ----------
+
+    pos : float array
+         cartesian coordinates
+
+    centers : float array [M,3]
+         centers of the spheres
+
+    radii : float or float array [M]
+         radius of each sphere
+
+    index : filter.index.SpatialIndex
+         spatial index built on pos. If not given, it is built here : keep it if you select particles several times.
+
+    nthreads : integer
+         number of threads. Default is the number of cores.
+
+    boxsize : float
+         size of the periodic box, used if the index is built here.
+
+
+    Returns (offsets,indices) : the particles inside the sphere i are indices[offsets[i]:offsets[i+1]]. Unlike the other filters, an index and not a boolean filter is returned, since the spheres may overlap.
+    """
+
+    if index is None:
+        index=SpatialIndex(pos,boxsize=boxsize)
+    return index.spheres(centers,radii,nthreads=nthreads)
+
+
+
+def extract_sphere(pos,rselect,center=[0,0,0],index=None,boxsize=None):
+    """Return the particles inside the sphere(center,rselect) and their positions relative to center
+
+    Only the selected particles are copied and shifted, and their relative positions use the nearest periodic image if boxsize is given, so a halo crossing the boundary of the box comes out in one piece.
+
+    Parameters:
+    ----------
+
+    pos : float array
+         cartesian coordinates
+
+    rselect : float
+         radius of sphere in same units than pos
+
+    center : list or float array (3)
+         center of sphere
+
+    index : filter.index.SpatialIndex
+         spatial index built on pos
+
+    boxsize : float
+         size of the periodic box. If None and index is given, the boxsize of the index is used.
+
+
+    Returns (ind,pos_centered) : index of the selected particles, and their positions relative to center.
+
+    Example:
+    -------
+
+    >>> ind,pos_halo=extract_sphere(pos,rvir,center=halo_center,boxsize=header["BoxSize"])
+    >>> r=radius(pos_halo)
+
+    """
+
+    if index is not None:
+        ind=index.sphere(center,rselect)
+        boxsize=index.boxsize if boxsize is None else boxsize
+    else:
+        ind=np.flatnonzero(sphere(pos,rselect,center,boxsize=boxsize))
+
+    return ind,recenter(pos[ind],center,boxsize=boxsize)
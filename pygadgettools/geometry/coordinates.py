@@ -5,12 +5,17 @@
 import numpy as np
 import warnings
 import sys
+import math
 from internals.sanity_check import \
     _check_if_keyword_is_correct, _check_dimension
+from physics.fields import specific_angular_momentum
+from geometry.periodic import minimum_image
+from internals.parallel import jit, run_blocks
+from internals.dtypes import _float_dtype
 
 
 
-def change_coordinates(pos,variable_type,sys1,sys2,*args):
+def change_coordinates(pos,variable_type,sys1,sys2,*args,**kwargs):
     """Change the coordinates system of a variable
 
     Parameters:
@@ -31,6 +36,15 @@ def change_coordinates(pos,variable_type,sys1,sys2,*args):
     *args : float array [N,3]
         other variables useful for conversion. For example, if you want to convert velocity, you may provide it here as an additional argument.
 
+    out : float array [N,3]
+        keyword only. Array in which the result is written, it may be the variable being converted (in place conversion). If not given, a new array is allocated with the dtype of the inputs (float32 stays float32).
+
+    nthreads : integer
+        keyword only. Number of threads converting the blocks concurrently (None or 0 for all the cores). Default is 1.
+
+
+    COMMENTS : the conversion is done by blocks of BLOCK_ROWS particles, and each trigonometric term is computed once per particle, so the only large array created is the output. The conversions from cartesian coordinates use compiled kernels when numba is installed (see internals.parallel).
+
 
     Examples:
     --------
@@ -43,6 +57,8 @@ def change_coordinates(pos,variable_type,sys1,sys2,*args):
     >>> VEL=np.array([[1,1,1]])
     >>> change_coordinates(POS,"vel","cyl","cart",VEL)
     array([[-1., -1.,  1.]])
+
+    >>> change_coordinates(POS,"pos","cyl","cart",out=POS) #in place
     
     """
 
@@ -67,7 +83,7 @@ def change_coordinates(pos,variable_type,sys1,sys2,*args):
                  'sphcart':_position_spherical2cartesian,
                  'sphcyl':_position_spherical2cylindrical
                     }
-        output=options[case](pos)
+        output=options[case](pos,out=kwargs.get("out"),nthreads=kwargs.get("nthreads",1))
     elif variable_type == "vel":
         options={'cartcyl':_velocity_cartesian2cylindrical,
                  'cartsph':_velocity_cartesian2spherical,
@@ -76,7 +92,7 @@ def change_coordinates(pos,variable_type,sys1,sys2,*args):
                  'sphcart':_velocity_spherical2cartesian,
                  'sphcyl':_velocity_spherical2cylindrical
                     }
-        output=options[case](pos,*args)
+        output=options[case](pos,*args,out=kwargs.get("out"),nthreads=kwargs.get("nthreads",1))
     else: #should never go here if the sanity check above is properly done
         sys.exit()
     
@@ -84,163 +100,492 @@ def change_coordinates(pos,variable_type,sys1,sys2,*args):
 
 
 
+def change_phase_space(pos,vel,sys1,sys2,angular_momentum=False,out_pos=None,out_vel=None,nthreads=1):
+    """Change the coordinates system of positions and velocities together
+
+    The radii and trigonometric terms are computed once and used for both the position and the velocity (and the angular momentum), instead of being computed again by each call to change_coordinates.
+
+    Parameters:
+    ----------
+
+    pos : float array [N,3]
+        position of particles in sys1
+
+    vel : float array [N,3]
+        velocity of particles in sys1
+
+    sys1 : string
+        the initial coordinate system. Currently available : ('cart', 'cyl', 'sph') for (cartesian, cylindrical, spherical) respectively.
+
+    sys2 : string
+        the final coordinate system. Currently available : ('cart', 'cyl', 'sph'). sys2 must be different than sys1.
+
+    angular_momentum : boolean
+        if True, also return the specific angular momentum in sys2 (see physics.fields.specific_angular_momentum)
+
+    out_pos, out_vel : float array [N,3]
+        arrays in which the results are written. They may be pos and vel themselves (in place conversion). If not given, new arrays are allocated with the dtype of the inputs.
+
+    nthreads : integer
+        number of threads converting the blocks concurrently (None or 0 for all the cores)
+
+
+    Returns (pos,vel) or (pos,vel,j) in sys2.
+
+    Example:
+    -------
+
+    >>> pos_sph,vel_sph,j=change_phase_space(POS,VEL,"cart","sph",angular_momentum=True)
+
+    """
+
+    list_sys=["cart","cyl","sph"]
+    _check_if_keyword_is_correct(sys1,list_sys)
+    _check_if_keyword_is_correct(sys2,list_sys)
+    if sys1 == sys2:
+        raise KeyError("sys2 must be different than sys1")
+
+    j=None
+    if angular_momentum:
+        j=np.empty((len(pos),3),dtype=_float_dtype(pos,vel))
+
+    out_pos,out_vel=_convert(sys1,sys2,out_pos,out_vel,pos,vel,j=j,nthreads=nthreads)
+    if angular_momentum:
+        return out_pos,out_vel,j
+    return out_pos,out_vel
+
+
+
+def radius(pos,center=[0,0,0],boxsize=None):
+    """Return the distance of each particle to center
+
+    Parameters:
+    ----------
+
+    pos : float array [N,3]
+        cartesian coordinates
+
+    center : list or float array (3)
+        center in cartesian coordinates and same units than pos
+
+    boxsize : float
+        size of the periodic box. If given, the distance to the nearest periodic image of center is returned.
+
+
+    COMMENTS : the distance is accumulated column by column, so no [N,3] array pos-center is created.
+
+    Example:
+    -------
+
+    >>> radius(np.array([[3.,4.,1.]]),center=[0,0,1])
+    array([ 5.])
+
+    """
+
+    r2=np.zeros(len(pos),dtype=np.result_type(pos.dtype,np.float32))
+    for i in range(3):
+        dx=pos[:,i]-center[i]
+        if boxsize is not None:
+            minimum_image(dx,boxsize,out=dx)
+        dx*=dx
+        r2+=dx
+    return np.sqrt(r2,out=r2)
+
+
+
+
+
+
+
+
+
+
+## BLOCK PROCESSING
+BLOCK_ROWS = 65536 #number of particles converted at once. Temporaries are only allocated for one block.
+
+
+def _convert(sys1,sys2,out_pos,out_vel,pos,vel=None,j=None,nthreads=1):
+    """Convert positions (if out_pos is not False) and velocities (if vel is given) on successive blocks of rows, computing the terms of each block only once
+
+    Parameters:
+    ----------
+
+    sys1, sys2 : string
+        initial and final coordinate systems ('cart', 'cyl', 'sph')
+
+    out_pos, out_vel : float array [N,3]
+        output arrays. If None, a new array with the dtype of the inputs is allocated. They may be the inputs (in place conversion). Positions are not converted if out_pos is False.
+
+    pos : float array [N,3]
+        position in the initial coordinate system
+
+    vel : float array [N,3]
+        velocity in the initial coordinate system
+
+    j : float array [N,3]
+        if given, the specific angular momentum in the final coordinate system is written in it
+
+    nthreads : integer
+        number of threads converting the blocks concurrently, each block writing its own rows of the outputs
+
+    Returns out_pos alone if vel is None, (out_pos,out_vel) otherwise.
+    """
+
+    case=sys1+sys2
+    if sys1 == 'sph':
+        _check_theta(pos[:,1])
+
+    n=len(pos)
+    arrays=[pos] if vel is None else [pos,vel]
+    dtype=_float_dtype(*arrays)
+    convert_pos=out_pos is not False
+    if convert_pos:
+        out_pos=_output(out_pos,n,dtype)
+    if vel is not None:
+        out_vel=_output(out_vel,n,dtype)
+
+    ##compiled kernel (numba) : no temporary at all, if the arrays can be passed as they are
+    kernel=_KERNELS.get(case)
+    if kernel is not None and j is None and \
+       all(a.dtype == dtype and a.dtype.isnative for a in arrays+[o for o in (out_pos,out_vel) if o is not None and o is not False]):
+        def _block(start,stop):
+            p=pos[start:stop]
+            return kernel(p,p if vel is None else vel[start:stop],out_pos[start:stop] if convert_pos else p,
+                          p if vel is None else out_vel[start:stop],convert_pos,vel is not None)
+    else:
+        def _block(start,stop):
+            found_origin=False
+            p=pos[start:stop].astype(dtype,copy=False)
+            terms=_TERMS[case](p,velocity=vel is not None)
+            if vel is not None:
+                _VELOCITY[case](out_vel[start:stop],vel[start:stop].astype(dtype,copy=False),terms)
+                found_origin=sys2 == 'sph' and bool(np.any(terms[-1]))
+            if convert_pos:
+                _POSITION[case](out_pos[start:stop],p,terms)
+            if j is not None:
+                j[start:stop]=specific_angular_momentum(out_pos[start:stop],out_vel[start:stop],coordinates=sys2)
+            return found_origin
+
+    found_origin=any(run_blocks(_block,n,BLOCK_ROWS,nthreads))
+
+    if found_origin: #if some points are at the origin
+        warnings.warn("Spherical velocity is not defined at origin. Returning 0.")
+
+    if vel is None:
+        return out_pos
+    return out_pos,out_vel
+
+
+
+def _output(out,n,dtype):
+    """Allocate the output array if needed, or check its dimension
+    """
+
+    if out is None:
+        out=np.empty((n,3),dtype=dtype)
+    elif np.shape(out) != (n,3):
+        raise ValueError("out must have the dimension ("+str(n)+",3)")
+    return out
+
+
+def _check_theta(theta):
+    """Check that theta is in [0,pi] without creating temporary arrays
+    """
+
+    pi=theta.dtype.type(np.pi) if np.issubdtype(theta.dtype,np.floating) else np.pi #pi rounded to float32 is slightly above np.pi
+    if len(theta) > 0 and (np.max(theta)>pi or np.min(theta)<0): #sanity check. not necessary for phi.
+        raise ValueError("Theta beyond [0,pi]. Exiting.")
+
+
+def _cos_sin_phi(x,y,rho):
+    """Return cos(phi) and sin(phi) of cartesian positions from x/rho and y/rho, without any trigonometric function. On the z-axis (rho=0), phi=0.
+    """
+
+    with np.errstate(invalid='ignore',divide='ignore'):
+        cos_phi=x/rho
+        sin_phi=y/rho
+    axis=(rho == 0)
+    if np.any(axis):
+        cos_phi[axis]=1.
+        sin_phi[axis]=0.
+    return cos_phi,sin_phi
 
 
 
 
 
+## TERMS
+## Each conversion first computes the radii and trigonometric terms of a block of positions. The same terms are then used for the position and the velocity, so a joint conversion computes them only once. Terms only needed by the velocity are skipped if velocity is False.
 
+def _terms_cartesian2spherical(pos,velocity=True):
+    x=pos[:,0]
+    y=pos[:,1]
+    z=pos[:,2]
+
+    rho=np.hypot(x,y)
+    r=np.hypot(rho,z)
+    if not velocity: #the position only needs the radii
+        return rho,r,None,None,None,None,None
+    with np.errstate(invalid='ignore',divide='ignore'):
+        sin_theta=rho/r
+        cos_theta=z/r
+    cos_phi,sin_phi=_cos_sin_phi(x,y,rho)
+    origin=(r == 0)
+
+    return rho,r,sin_theta,cos_theta,cos_phi,sin_phi,origin
+
+
+def _terms_cartesian2cylindrical(pos,velocity=True):
+    x=pos[:,0]
+    y=pos[:,1]
+
+    rho=np.hypot(x,y)
+    if not velocity:
+        return rho,None,None
+    cos_theta,sin_theta=_cos_sin_phi(x,y,rho)
+
+    return rho,cos_theta,sin_theta
+
+
+def _terms_spherical2cartesian(pos,velocity=True):
+    theta=pos[:,1]
+    phi=pos[:,2]
+    return np.sin(theta),np.cos(theta),np.sin(phi),np.cos(phi)
+
+
+def _terms_spherical2cylindrical(pos,velocity=True):
+    theta=pos[:,1]
+    return np.sin(theta),np.cos(theta)
+
+
+def _terms_cylindrical2cartesian(pos,velocity=True):
+    theta=pos[:,1]
+    return np.cos(theta),np.sin(theta)
+
+
+def _terms_cylindrical2spherical(pos,velocity=True):
+    rho=pos[:,0]
+    z=pos[:,2]
+
+    r=np.hypot(rho,z)
+    if not velocity:
+        return r,None,None,None
+    with np.errstate(invalid='ignore',divide='ignore'):
+        sin_theta=rho/r
+        cos_theta=z/r
+    origin=(r == 0)
+
+    return r,sin_theta,cos_theta,origin
 
 
 
 
 
 ## POSITION
-def _position_cartesian2spherical(pos):
+def _write_position_cartesian2spherical(out,pos,terms):
+    rho,r,sin_theta,cos_theta,cos_phi,sin_phi,origin=terms
+
+    theta=np.arctan2(rho,pos[:,2]) #same as arccos(z/r), and 0 at r=0
+    phi=np.arctan2(pos[:,1],pos[:,0])
+
+    out[:,0]=r
+    out[:,1]=theta
+    out[:,2]=phi
+
+
+def _position_cartesian2spherical(pos,out=None,nthreads=1):
     """Convert POS cartesian into spherical coordinates
 
     Parameters:
     ----------
     pos : float array (N,3)
         position in cartesian coordinates in Gadget format
+
+    out : float array (N,3)
+        output array (may be pos itself). If None, a new array is allocated.
+
+    nthreads : integer
+        number of threads
     """
 
-    #save cartesian position of each particle
-    x=pos[:,0]
-    y=pos[:,1]
-    z=pos[:,2]
+    return _convert('cart','sph',out,None,pos,nthreads=nthreads)
 
-    r=np.sqrt(x**2+y**2+z**2) #radius position of each particle
 
-    #define theta and take care of r=0 case
-    theta=np.zeros(np.size(x))
-    ind_zero=(r == 0.) #is there any point where radius is 0 ?
-    theta= np.arccos(z/r)        
-    theta[ind_zero]=0.
 
-    phi=np.arctan2(y,x)
 
-    return np.dstack((r,theta,phi))[0]
+def _write_position_cartesian2cylindrical(out,pos,terms):
+    rho,cos_theta,sin_theta=terms
 
+    theta=np.arctan2(pos[:,1],pos[:,0])
 
+    out[:,0]=rho
+    out[:,1]=theta
+    out[:,2]=pos[:,2]
 
 
-def _position_cartesian2cylindrical(pos):
+def _position_cartesian2cylindrical(pos,out=None,nthreads=1):
     """Convert POS cartesian into cylindrical coordinates
 
     Parameters:
     ----------
     pos : float array (N,3)
         position in cartesian coordinates in Gadget format
+
+    out : float array (N,3)
+        output array (may be pos itself). If None, a new array is allocated.
+
+    nthreads : integer
+        number of threads
     """
 
-    
-    #save cartesian position of each particle
-    x=pos[:,0]
-    y=pos[:,1]
-    z=pos[:,2]
+    return _convert('cart','cyl',out,None,pos,nthreads=nthreads)
+
 
-    rho= np.sqrt(x**2+y**2)
-    theta=np.arctan2(y,x)
 
+def _write_position_spherical2cartesian(out,pos,terms):
+    sin_theta,cos_theta,sin_phi,cos_phi=terms
+    r=pos[:,0]
 
-    return np.dstack((rho,theta,z))[0]
+    r_sin_theta=r*sin_theta
+    z=r*cos_theta
+    x=r_sin_theta*cos_phi
+    y=r_sin_theta
+    y*=sin_phi
 
+    out[:,0]=x
+    out[:,1]=y
+    out[:,2]=z
 
 
-def _position_spherical2cartesian(pos):
+def _position_spherical2cartesian(pos,out=None,nthreads=1):
     """Convert POS spherical into cartesian coordinates
 
     Parameters:
     ----------
     pos : float array (N,3)
         position in spherical coordinates in Gadget format
+
+    out : float array (N,3)
+        output array (may be pos itself). If None, a new array is allocated.
+
+    nthreads : integer
+        number of threads
     """
-    
-    r=pos[:,0]
-    theta=pos[:,1]
-    phi=pos[:,2]
 
-    if any(theta>np.pi) or any(theta<0): #sanity check. not necessary for phi.
-        raise ValueError, "Theta beyond [0,pi]. Exiting."
+    return _convert('sph','cart',out,None,pos,nthreads=nthreads)
+
 
 
-    x=r*np.sin(theta)*np.cos(phi)
-    y=r*np.sin(theta)*np.sin(phi)
-    z=r*np.cos(theta)
+def _write_position_spherical2cylindrical(out,pos,terms):
+    sin_theta,cos_theta=terms
+    r=pos[:,0]
+
+    rho=r*sin_theta
+    z=r*cos_theta
 
-    return np.dstack((x,y,z))[0]
+    out[:,0]=rho
+    out[:,1]=pos[:,2] #theta cylindrical = phi spherical
+    out[:,2]=z
 
 
-def _position_spherical2cylindrical(pos):
+def _position_spherical2cylindrical(pos,out=None,nthreads=1):
     """Convert POS spherical into cylindrical coordinates
 
     Parameters:
     ----------
     pos : float array (N,3)
         position in spherical coordinates in Gadget format
+
+    out : float array (N,3)
+        output array (may be pos itself). If None, a new array is allocated.
+
+    nthreads : integer
+        number of threads
     """
-    
 
-    r=pos[:,0]
-    theta_spherical=pos[:,1]
-    phi_spherical=pos[:,2]
+    return _convert('sph','cyl',out,None,pos,nthreads=nthreads)
+
 
-    if any(theta_spherical>np.pi) or any(theta_spherical<0): #sanity check. not necessary for phi.
-        raise ValueError, "Theta beyond [0,pi]. Exiting."
 
-    rho=r*np.sin(theta_spherical)
-    theta_cylindrical=phi_spherical
-    z=r*np.cos(theta_spherical)
+def _write_position_cylindrical2cartesian(out,pos,terms):
+    cos_theta,sin_theta=terms
+    rho=pos[:,0]
+
+    x=rho*cos_theta
+    y=rho*sin_theta
 
-    return np.dstack((rho,theta_cylindrical,z))[0]
+    out[:,0]=x
+    out[:,1]=y
+    out[:,2]=pos[:,2]
 
 
-def _position_cylindrical2cartesian(pos):
+def _position_cylindrical2cartesian(pos,out=None,nthreads=1):
     """Convert POS cylindrical into cartesian coordinates
 
     Parameters:
     ----------
     pos : float array (N,3)
         position in cylindrical coordinates in Gadget format
+
+    out : float array (N,3)
+        output array (may be pos itself). If None, a new array is allocated.
+
+    nthreads : integer
+        number of threads
     """
-    
-    rho=pos[:,0]
-    theta=pos[:,1]
-    z=pos[:,2]
 
-    x=rho*np.cos(theta)
-    y=rho*np.sin(theta)
-    z=z
+    return _convert('cyl','cart',out,None,pos,nthreads=nthreads)
 
-    return np.dstack((x,y,z))[0]
 
 
-def _position_cylindrical2spherical(pos):
+def _write_position_cylindrical2spherical(out,pos,terms):
+    r,sin_theta,cos_theta,origin=terms
+
+    theta_spherical=np.arctan2(pos[:,0],pos[:,2])
+
+    out[:,0]=r
+    out[:,2]=pos[:,1] #phi = theta cylindrical
+    out[:,1]=theta_spherical
+
+
+def _position_cylindrical2spherical(pos,out=None,nthreads=1):
     """Convert POS cylindrical into spherical coordinates
 
     Parameters:
     ----------
     pos : float array (N,3)
         position in cylindrical coordinates in Gadget format
-    """
 
-    rho=pos[:,0]
-    theta_cylindrical=pos[:,1]
-    z=pos[:,2]
+    out : float array (N,3)
+        output array (may be pos itself). If None, a new array is allocated.
 
-    r=np.sqrt(rho**2+z**2)
-    theta_spherical=np.arctan2(rho,z)
-    phi=theta_cylindrical
+    nthreads : integer
+        number of threads
+    """
 
-    return np.dstack((r,theta_spherical,phi))[0]
+    return _convert('cyl','sph',out,None,pos,nthreads=nthreads)
 
 
 
 
 
 ## VELOCITY
-def _velocity_cartesian2cylindrical(pos,vel):
+def _write_velocity_cartesian2cylindrical(out,vel,terms):
+    rho,cos_theta,sin_theta=terms
+    vx=vel[:,0]
+    vy=vel[:,1]
+
+    vr=vx*cos_theta
+    vr+=vy*sin_theta
+    vtheta=vy*cos_theta
+    vtheta-=vx*sin_theta
+
+    out[:,0]=vr
+    out[:,1]=vtheta
+    out[:,2]=vel[:,2]
+
+
+def _velocity_cartesian2cylindrical(pos,vel,out=None,nthreads=1):
     """Convert velocity from cartesian to cylindrical coordinates
 
     Parameters:
@@ -250,32 +595,44 @@ def _velocity_cartesian2cylindrical(pos,vel):
 
     vel : float array (N,3)
         velocity in cartesian coordinates
+
+    out : float array (N,3)
+        output array (may be vel itself). If None, a new array is allocated.
+
+    nthreads : integer
+        number of threads
     """
-    
-    
-    
-    #save cartesian velocities
+
+    return _convert('cart','cyl',False,out,pos,vel,nthreads=nthreads)[1]
+
+
+
+
+def _write_velocity_cartesian2spherical(out,vel,terms):
+    rho,r,sin_theta,cos_theta,cos_phi,sin_phi,origin=terms
     vx=vel[:,0]
     vy=vel[:,1]
     vz=vel[:,2]
 
-    #convert to cylindrical coordinates
-    pos_cyl=_position_cartesian2cylindrical(pos) #cylindrical coordinates
-    theta=pos_cyl[:,1]
-
-    #compute cylindrical velocities
-    vr=vx*np.cos(theta) + vy*np.sin(theta)
-    vtheta=-vx*np.sin(theta) + vy*np.cos(theta)
-    vz=vz
-    
-
-    return np.dstack((vr,vtheta,vz))[0]
+    #horizontal velocity along the cylindrical radius
+    v_rho=vx*cos_phi
+    v_rho+=vy*sin_phi
 
+    vr=v_rho*sin_theta
+    vr+=vz*cos_theta
+    vtheta=v_rho*cos_theta
+    vtheta-=vz*sin_theta
+    vphi=vy*cos_phi
+    vphi-=vx*sin_phi
 
+    _zero_at_origin(origin,vr,vtheta,vphi)
 
+    out[:,0]=vr
+    out[:,1]=vtheta
+    out[:,2]=vphi
 
 
-def _velocity_cartesian2spherical(pos,vel):
+def _velocity_cartesian2spherical(pos,vel,out=None,nthreads=1):
     """Convert velocity from cartesian to spherical coordinates
 
     Parameters:
@@ -285,44 +642,35 @@ def _velocity_cartesian2spherical(pos,vel):
 
     vel : float array (N,3)
         velocity in cartesian coordinates
-    """
 
-    
-    #save cartesian position of each particle
-    x=pos[:,0]
-    y=pos[:,1]
-    z=pos[:,2]
-
-    #save cartesian velocities
-    vx=vel[:,0]
-    vy=vel[:,1]
-    vz=vel[:,2]
+    out : float array (N,3)
+        output array (may be vel itself). If None, a new array is allocated.
 
-    #convert to spherical coordinates
-    pos_sph=_position_cartesian2spherical(pos) #spherical coordinates
-    r=pos_sph[:,0]
-    theta=pos_sph[:,1]
-    phi=pos_sph[:,2]
+    nthreads : integer
+        number of threads
+    """
 
+    return _convert('cart','sph',False,out,pos,vel,nthreads=nthreads)[1]
 
-    #compute spherical velocities
-    vr = vx*np.sin(theta)*np.cos(phi) + vy*np.sin(theta)*np.sin(phi) + vz*np.cos(theta)
-    vtheta = vx*np.cos(theta)*np.cos(phi) + vy*np.cos(theta)*np.sin(phi) - vz*np.sin(theta)
-    vphi = -vx*np.sin(phi) + vy*np.cos(phi)
 
-    if np.sum(r==0)!=0: #if some points are at the origin
-        warnings.warn("Spherical velocity is not defined at origin. Returning 0.")
-        vr[r==0]=0
-        vtheta[r==0]=0
-        vphi[r==0]=0
 
 
-    return np.dstack((vr,vtheta,vphi))[0]
+def _write_velocity_cylindrical2cartesian(out,vel,terms):
+    cos_theta,sin_theta=terms
+    vr=vel[:,0]
+    vtheta=vel[:,1]
 
+    vx=vr*cos_theta
+    vx-=vtheta*sin_theta
+    vy=vr*sin_theta
+    vy+=vtheta*cos_theta
 
+    out[:,0]=vx
+    out[:,1]=vy
+    out[:,2]=vel[:,2]
 
 
-def _velocity_cylindrical2cartesian(pos,vel):
+def _velocity_cylindrical2cartesian(pos,vel,out=None,nthreads=1):
     """Convert velocity from cylindrical to cartesian coordinates
 
     Parameters:
@@ -332,29 +680,39 @@ def _velocity_cylindrical2cartesian(pos,vel):
 
     vel : float array (N,3)
         velocity in cylindrical coordinates
+
+    out : float array (N,3)
+        output array (may be vel itself). If None, a new array is allocated.
+
+    nthreads : integer
+        number of threads
     """
-    
-    
-    #save cartesian position of each particle
-    theta=pos[:,1]
 
-    #save cyindrical velocities
-    vr=vel[:,0]
-    vtheta=vel[:,1]
-    vz=vel[:,2]
+    return _convert('cyl','cart',False,out,pos,vel,nthreads=nthreads)[1]
+
+
 
-    #compute cartesian velocities
-    vx = vr*np.cos(theta) - vtheta*np.sin(theta)
-    vy = vr*np.sin(theta) + vtheta*np.cos(theta)
-    vz = vz
 
-    return np.dstack((vx,vy,vz))[0]
 
+def _write_velocity_cylindrical2spherical(out,vel,terms):
+    r,sin_theta,cos_theta,origin=terms
+    vrho=vel[:,0]
+    vz=vel[:,2]
+
+    vr=vrho*sin_theta
+    vr+=vz*cos_theta
+    vtheta=vrho*cos_theta
+    vtheta-=vz*sin_theta
+    vphi=vel[:,1].copy()
 
+    _zero_at_origin(origin,vr,vtheta,vphi)
 
+    out[:,0]=vr
+    out[:,1]=vtheta
+    out[:,2]=vphi
 
 
-def _velocity_cylindrical2spherical(pos,vel):
+def _velocity_cylindrical2spherical(pos,vel,out=None,nthreads=1):
     """Convert velocity from cylindrical to spherical coordinates
 
     Parameters:
@@ -364,18 +722,42 @@ def _velocity_cylindrical2spherical(pos,vel):
 
     vel : float array (N,3)
         velocity in cylindrical coordinates
+
+    out : float array (N,3)
+        output array (may be vel itself). If None, a new array is allocated.
+
+    nthreads : integer
+        number of threads
     """
-    
-    pos_cart=_position_cylindrical2cartesian(pos)
-    vel_cart=_velocity_cylindrical2cartesian(pos,vel)
-    vel_sph=_velocity_cartesian2spherical(pos_cart,vel_cart)
 
-    return vel_sph
+    return _convert('cyl','sph',False,out,pos,vel,nthreads=nthreads)[1]
 
 
 
 
-def _velocity_spherical2cartesian(pos,vel):
+def _write_velocity_spherical2cartesian(out,vel,terms):
+    sin_theta,cos_theta,sin_phi,cos_phi=terms
+    vr=vel[:,0]
+    vtheta=vel[:,1]
+    vphi=vel[:,2]
+
+    #horizontal velocity along the cylindrical radius
+    v_rho=vr*sin_theta
+    v_rho+=vtheta*cos_theta
+
+    vx=v_rho*cos_phi
+    vx-=vphi*sin_phi
+    vy=v_rho*sin_phi
+    vy+=vphi*cos_phi
+    vz=vr*cos_theta
+    vz-=vtheta*sin_theta
+
+    out[:,0]=vx
+    out[:,1]=vy
+    out[:,2]=vz
+
+
+def _velocity_spherical2cartesian(pos,vel,out=None,nthreads=1):
     """Convert velocity from spherical to cartesian coordinates
 
     Parameters:
@@ -385,30 +767,34 @@ def _velocity_spherical2cartesian(pos,vel):
 
     vel : float array (N,3)
         velocity in spherical coordinates
+
+    out : float array (N,3)
+        output array (may be vel itself). If None, a new array is allocated.
+
+    nthreads : integer
+        number of threads
     """
-    
-    #save cartesian position of each particle
-    r=pos[:,0]
-    theta=pos[:,1]
-    phi=pos[:,2]
 
+    return _convert('sph','cart',False,out,pos,vel,nthreads=nthreads)[1]
 
-    #save cyindrical velocities
-    vr=vel[:,0]
-    vtheta=vel[:,1]
-    vphi=vel[:,2]
 
 
-    #compute cartesian velocities
-    vx = vr*np.sin(theta)*np.cos(phi) + vtheta*np.cos(theta)*np.cos(phi) - vphi*np.sin(phi)
-    vy = vr*np.sin(theta)*np.sin(phi) + vtheta*np.cos(theta)*np.sin(phi) + vphi*np.cos(phi)
-    vz = vr*np.cos(theta) - vtheta*np.sin(theta)
+def _write_velocity_spherical2cylindrical(out,vel,terms):
+    sin_theta,cos_theta=terms
+    vr=vel[:,0]
+    vtheta=vel[:,1]
 
-    return np.dstack((vx,vy,vz))[0]
+    vrho=vr*sin_theta
+    vrho+=vtheta*cos_theta
+    vz=vr*cos_theta
+    vz-=vtheta*sin_theta
 
+    out[:,0]=vrho
+    out[:,1]=vel[:,2] #vtheta cylindrical = vphi spherical
+    out[:,2]=vz
 
 
-def _velocity_spherical2cylindrical(pos,vel):
+def _velocity_spherical2cylindrical(pos,vel,out=None,nthreads=1):
     """Convert velocity from spherical to cylindrical coordinates
 
     Parameters:
@@ -418,13 +804,117 @@ def _velocity_spherical2cylindrical(pos,vel):
 
     vel : float array (N,3)
         velocity in spherical coordinates
+
+    out : float array (N,3)
+        output array (may be vel itself). If None, a new array is allocated.
+
+    nthreads : integer
+        number of threads
     """
-    
-    pos_cart=_position_spherical2cartesian(pos)
-    vel_cart=_velocity_spherical2cartesian(pos,vel)
-    vel_cyl=_velocity_cartesian2cylindrical(pos_cart,vel_cart)
 
-    return vel_cyl
+    return _convert('sph','cyl',False,out,pos,vel,nthreads=nthreads)[1]
+
 
 
+def _zero_at_origin(origin,*velocities):
+    """Spherical velocity is not defined at origin : set it to 0
+    """
 
+    if np.any(origin):
+        for v in velocities:
+            v[origin]=0
+
+
+
+## COMPILED KERNELS
+## One loop over the particles of a block, converting the position and/or the velocity without any temporary array. They are only used when numba is installed (see internals.parallel.jit). The arrays not converted are replaced by pos, and ignored.
+
+def _loop_cartesian2spherical(pos,vel,out_pos,out_vel,convert_pos,convert_vel):
+    found_origin=False
+    for i in range(pos.shape[0]):
+        x=pos[i,0]
+        y=pos[i,1]
+        z=pos[i,2]
+        rho=math.hypot(x,y)
+        r=math.hypot(rho,z)
+        if convert_vel:
+            vx=vel[i,0]
+            vy=vel[i,1]
+            vz=vel[i,2]
+            if r == 0: #spherical velocity is not defined at origin
+                found_origin=True
+                vr=0.
+                vtheta=0.
+                vphi=0.
+            else:
+                cos_phi=1.
+                sin_phi=0.
+                if rho > 0:
+                    cos_phi=x/rho
+                    sin_phi=y/rho
+                v_rho=vx*cos_phi+vy*sin_phi
+                vr=(v_rho*rho+vz*z)/r
+                vtheta=(v_rho*z-vz*rho)/r
+                vphi=vy*cos_phi-vx*sin_phi
+            out_vel[i,0]=vr
+            out_vel[i,1]=vtheta
+            out_vel[i,2]=vphi
+        if convert_pos:
+            out_pos[i,0]=r
+            out_pos[i,1]=math.atan2(rho,z)
+            out_pos[i,2]=math.atan2(y,x)
+    return found_origin
+
+
+def _loop_cartesian2cylindrical(pos,vel,out_pos,out_vel,convert_pos,convert_vel):
+    for i in range(pos.shape[0]):
+        x=pos[i,0]
+        y=pos[i,1]
+        z=pos[i,2]
+        rho=math.hypot(x,y)
+        if convert_vel:
+            vx=vel[i,0]
+            vy=vel[i,1]
+            vz=vel[i,2]
+            cos_theta=1.
+            sin_theta=0.
+            if rho > 0:
+                cos_theta=x/rho
+                sin_theta=y/rho
+            out_vel[i,0]=vx*cos_theta+vy*sin_theta
+            out_vel[i,1]=vy*cos_theta-vx*sin_theta
+            out_vel[i,2]=vz
+        if convert_pos:
+            out_pos[i,0]=rho
+            out_pos[i,1]=math.atan2(y,x)
+            out_pos[i,2]=z
+    return False
+
+
+_KERNELS  = {'cartsph':jit(_loop_cartesian2spherical),
+             'cartcyl':jit(_loop_cartesian2cylindrical)}
+
+
+
+
+
+_TERMS    = {'cartcyl':_terms_cartesian2cylindrical,
+             'cartsph':_terms_cartesian2spherical,
+             'cylcart':_terms_cylindrical2cartesian,
+             'cylsph':_terms_cylindrical2spherical,
+             'sphcart':_terms_spherical2cartesian,
+             'sphcyl':_terms_spherical2cylindrical}
+
+_POSITION = {'cartcyl':_write_position_cartesian2cylindrical,
+             'cartsph':_write_position_cartesian2spherical,
+             'cylcart':_write_position_cylindrical2cartesian,
+             'cylsph':_write_position_cylindrical2spherical,
+             'sphcart':_write_position_spherical2cartesian,
+             'sphcyl':_write_position_spherical2cylindrical}
+
+_VELOCITY = {'cartcyl':_write_velocity_cartesian2cylindrical,
+             'cartsph':_write_velocity_cartesian2spherical,
+             'cylcart':_write_velocity_cylindrical2cartesian,
+             'cylsph':_write_velocity_cylindrical2spherical,
+             'sphcart':_write_velocity_spherical2cartesian,
+             'sphcyl':_write_velocity_spherical2cylindrical}
@@ -74,8 +74,182 @@ def sphericalvolume_per_shell(bins):
 
     #we calculate the larger sphere and we substract the inside sphere to get the volume of the shell
     
+    bins=np.asarray(bins) #also for a Bins specification
     nr=len(bins) #number of bins
     sphere=volume_sphere(bins)
     volume_per_shell=sphere[1:]-sphere[0:nr-1]
     
     return volume_per_shell
+
+
+
+class Bins(object):
+    """Bin specification : bin limits (edges) and the function assigning a bin to each element
+
+    The bins are [edges[i],edges[i+1]). A specification can be used everywhere an array of bin limits is expected (np.asarray(bins) gives the edges, len(bins) the number of edges). Elements outside the bins (or NaN) get the index nbins, as analysis.reduction.bin_index.
+    """
+
+    def __init__(self,edges):
+        self.edges=np.asarray(edges,dtype='float64')
+        self.nbins=len(self.edges)-1
+
+
+    def __len__(self):
+        return len(self.edges)
+
+
+    def __array__(self,dtype=None):
+        return self.edges if dtype is None else self.edges.astype(dtype)
+
+
+    def __repr__(self):
+        return self.__class__.__name__+"("+repr(self.edges)+")"
+
+
+    def index(self,x):
+        """Return the bin index of each element of x (binary search among the edges)"""
+
+        idx=np.searchsorted(self.edges,x,side='right')
+        idx-=1
+        idx[(idx<0) | (idx>=self.nbins)]=self.nbins
+        return idx
+
+
+    def centers(self):
+        """Return the middle of each bin"""
+
+        return midpoints(self.edges)
+
+
+    def _uniform_index(self,f):
+        """Bin index from the position f in units of bins from the first edge (arithmetic lookup)"""
+
+        with np.errstate(invalid='ignore'):
+            outside=~((f >= 0) & (f < self.nbins)) #also True for NaN
+        f[outside]=self.nbins
+        return f.astype('int64')
+
+
+
+class CustomBins(Bins):
+    """Bins with any increasing limits
+
+    Parameters:
+    ----------
+
+    edges : float array
+        bin limits
+
+    """
+    pass
+
+
+
+class LinearBins(Bins):
+    """nbins bins of the same width between xmin and xmax. The bin of each element is computed without any search.
+
+    Parameters:
+    ----------
+
+    xmin, xmax : float
+        limits of the first and the last bin
+
+    nbins : integer
+        number of bins
+
+
+    Example:
+    -------
+
+    >>> LinearBins(0.,1.,4).index(np.array([0.1,0.5,0.99,1.,-1.]))
+    array([0, 2, 3, 4, 4])
+
+    """
+
+    def __init__(self,xmin,xmax,nbins):
+        Bins.__init__(self,np.linspace(xmin,xmax,nbins+1))
+        self.xmin=float(xmin)
+        self.scale=nbins/float(xmax-xmin)
+
+
+    def index(self,x):
+        f=np.subtract(x,self.xmin,dtype='float64')
+        f*=self.scale
+        np.floor(f,out=f)
+        return self._uniform_index(f)
+
+
+
+class LogBins(Bins):
+    """nbins bins of the same width in logarithm between xmin and xmax (>0). The bin of each element is computed without any search.
+
+    Parameters:
+    ----------
+
+    xmin, xmax : float
+        limits of the first and the last bin (>0)
+
+    nbins : integer
+        number of bins
+
+
+    Example:
+    -------
+
+    >>> LogBins(1.,1000.,3).index(np.array([2.,50.,999.,0.,1e4]))
+    array([0, 1, 2, 3, 3])
+
+    """
+
+    def __init__(self,xmin,xmax,nbins):
+        Bins.__init__(self,np.logspace(np.log10(xmin),np.log10(xmax),nbins+1))
+        self.log_xmin=np.log10(xmin)
+        self.scale=nbins/(np.log10(xmax)-self.log_xmin)
+
+
+    def index(self,x):
+        with np.errstate(divide='ignore',invalid='ignore'): #x<=0 are outside
+            f=np.log10(np.asarray(x,dtype='float64'))
+        f-=self.log_xmin
+        f*=self.scale
+        np.floor(f,out=f)
+        return self._uniform_index(f)
+
+
+    def centers(self):
+        """Return the geometric middle of each bin"""
+
+        return np.sqrt(self.edges[1:]*self.edges[:-1])
+
+
+
+class QuantileBins(Bins):
+    """nbins bins with the same number of elements of x (equal-count bins)
+
+    The edges are found by selection (np.partition) and not by a full sort of x.
+
+    Parameters:
+    ----------
+
+    x : float array
+        values used to define the bins (eg.: radii)
+
+    nbins : integer
+        number of bins
+
+
+    Example:
+    -------
+
+    >>> bins=QuantileBins(r,20) #20 shells with the same number of particles
+    >>> rho=profile.mean(r,rho,bins)
+
+    """
+
+    def __init__(self,x,nbins):
+        x=np.asarray(x)
+        x=x[~np.isnan(x)]
+        kth=np.round(np.linspace(0,len(x)-1,nbins+1)).astype('int64')
+        edges=np.partition(x,kth)[kth].astype('float64')
+        edges[-1]=np.nextafter(edges[-1],np.inf) #the maximum belongs to the last bin
+        Bins.__init__(self,edges)
@@ -0,0 +1,247 @@
+###NAME: deposit.py
+###PURPOSE: deposit particle quantities (mass...) onto regular 2D and 3D grids with the NGP, CIC and TSC kernels
+
+import itertools
+import numpy as np
+from multiprocessing.pool import ThreadPool
+from internals.sanity_check import _check_if_keyword_is_correct
+from geometry.create_grid import Bins, LinearBins
+from units.system import unscale
+
+
+KERNELS = ["ngp","cic","tsc"] #nearest grid point, cloud in cell, triangular shaped cloud
+SUPPORT = {"ngp":1, "cic":2, "tsc":3} #number of cells touched by a particle along each axis
+
+PARTICLES_PER_CHUNK = 2**20
+SPARSE_SPAN         = 4 #a chunk covering more than SPARSE_SPAN cells per contribution is summed over the touched cells only
+
+
+
+def _kernel_weights(s,kernel):
+    """Return the cells touched along one axis and the weight of each one
+
+    Parameters:
+    ----------
+
+    s : float array
+        position in units of cells from the lower edge of the grid : the cell i covers [i,i+1)
+
+    kernel : string
+        'ngp', 'cic' or 'tsc'
+
+
+    Returns (cells,weights) : lists of SUPPORT[kernel] arrays. The weight of NGP is None (1 everywhere).
+    """
+
+    if kernel == "ngp":
+        return [np.floor(s).astype('int64')],[None]
+
+    if kernel == "cic":
+        t=s-0.5 #distance to the center of the cells
+        i=np.floor(t)
+        f=t-i
+        i=i.astype('int64')
+        return [i,i+1],[1.-f,f]
+
+    i=np.floor(s)
+    d=s-i-0.5 #distance to the center of the nearest cell, in [-0.5,0.5)
+    i=i.astype('int64')
+    return [i-1,i,i+1],[0.5*(0.5-d)**2,0.75-d*d,0.5*(0.5+d)**2]
+
+
+
+def _deposit_chunk(grid,pos,weights,kernel,axes,lower,cellsize,shape,periodic):
+    """Add the contribution of one chunk of particles to the flattened grid
+    """
+
+    ndim=len(shape)
+    cells=[]
+    kernel_weights=[]
+    for d in range(ndim):
+        s=pos[:,axes[d]]-lower[d]
+        s/=cellsize[d]
+        c,w=_kernel_weights(s,kernel)
+        if periodic:
+            c=[np.mod(ci,shape[d],out=ci) for ci in c]
+        cells.append(c)
+        kernel_weights.append(w)
+
+    ##one flat index and one weight per (particle, touched cell), for a single scatter-add
+    flat=[]
+    value=[]
+    for combination in itertools.product(range(SUPPORT[kernel]),repeat=ndim):
+        ind=np.zeros(len(pos),dtype='int64')
+        w=weights
+        inside=None
+        for d,k in enumerate(combination):
+            c=cells[d][k]
+            ind*=shape[d]
+            ind+=c
+            if kernel_weights[d][k] is not None:
+                w=w*kernel_weights[d][k]
+            if not periodic: #contributions outside the grid are lost
+                in_grid=(c >= 0) & (c < shape[d])
+                inside=in_grid if inside is None else inside & in_grid
+        if inside is not None:
+            ind=ind[inside]
+            w=w[inside]
+        flat.append(ind)
+        value.append(w)
+
+    flat=np.concatenate(flat)
+    if len(flat) == 0:
+        return
+    value=np.concatenate(value)
+
+    ##only the part of the grid covered by the chunk is touched (small if the particles are sorted in space)
+    first=np.min(flat)
+    if np.max(flat)-first < SPARSE_SPAN*len(flat):
+        flat-=first
+        contribution=np.bincount(flat,weights=value)
+        grid[first:first+len(contribution)]+=contribution
+    else: #particles scattered over the grid : the temporaries are bounded by the number of contributions, not by the grid
+        touched,inverse=np.unique(flat,return_inverse=True)
+        grid[touched]+=np.bincount(inverse,weights=value)
+
+
+
+def deposit(pos,shape,lower=None,upper=None,weights=None,kernel="cic",axes=None,boxsize=None,
+            chunk_size=PARTICLES_PER_CHUNK,nthreads=1,out=None):
+    """Deposit the particles (or a quantity carried by the particles, eg.: mass) onto a regular 2D or 3D grid
+
+    The particles are processed by chunks of chunk_size, so that the temporary arrays stay small whatever the number of particles. Each chunk is deposited with a single vectorized scatter-add (np.bincount) on the part of the grid it covers, or on the cells it touches if the particles are scattered over the grid : it is fastest when the particles are roughly sorted in space, as in the Peano-Hilbert order of the Gadget outputs. With several threads, each thread deposits its chunks onto a private grid, and the private grids are summed at the end (the memory used is then nthreads times the grid).
+
+    Parameters:
+    ----------
+
+    pos : float array [N,3] or units.system.ScaledArray
+        cartesian coordinates. Can be a np.memmap, only one chunk is read at a time. With a ScaledArray, the grid is converted to the units of the array instead of the particles.
+
+    shape : integer, tuple of integer, LinearBins or list of LinearBins
+        number of cells along each axis of the grid. An integer gives a cubic (or square) grid. With bin specifications (geometry.create_grid.LinearBins), the grid is given by the bins and lower, upper are not used.
+
+    lower, upper : list or float array
+        corners of the grid along axes. The grid covers [lower,upper). Default is the extent of the particles, or [0,boxsize] if boxsize is given.
+
+    weights : float array [N] or units.system.ScaledArray
+        quantity deposited by each particle (eg.: mass). Default is 1 per particle (number of particles). The scale of a ScaledArray is applied chunk by chunk.
+
+    kernel : string
+        'ngp' (nearest grid point), 'cic' (cloud in cell) or 'tsc' (triangular shaped cloud)
+
+    axes : list of integer
+        columns of pos used for the axes of the grid. Default is (0,1,2) for a 3D grid. Use eg. (0,1) for a 2D grid projected along z.
+
+    boxsize : float
+        size of the periodic box. If given, the contributions crossing a boundary of the box wrap around to the other side. Otherwise, they are lost.
+
+    chunk_size : integer
+        number of particles deposited at a time
+
+    nthreads : integer
+        number of threads, each with a private grid
+
+    out : float array
+        grid of the right shape to which the deposit is added (eg.: to accumulate several particle types or files)
+
+
+    Returns the grid : sum of the weights deposited in each cell. Divide by the volume (or area) of a cell to get a density.
+
+    Example:
+    -------
+
+    >>> rho=deposit(pos,512,weights=mass,boxsize=header["BoxSize"]) #3D CIC grid
+    >>> rho/=(header["BoxSize"]/512.)**3
+    >>> surface=deposit(pos,1024,lower=[0,0],upper=[100,100],weights=mass,axes=(0,1),kernel="tsc")
+
+    """
+
+    _check_if_keyword_is_correct(kernel,KERNELS)
+
+    ##grid given by bin specifications
+    if isinstance(shape,Bins):
+        shape=[shape]
+    if isinstance(shape,(list,tuple)) and any(isinstance(b,Bins) for b in shape):
+        if not all(isinstance(b,LinearBins) for b in shape):
+            raise ValueError("the cells of the grid must have the same size : use LinearBins")
+        if axes is None:
+            axes=(0,1,2) if len(shape) == 1 else tuple(range(len(shape)))
+        if len(shape) == 1:
+            shape=list(shape)*len(axes)
+        lower=[b.edges[0] for b in shape]
+        upper=[b.edges[-1] for b in shape]
+        shape=tuple(b.nbins for b in shape)
+
+    if axes is None:
+        axes=(0,1,2) if np.ndim(shape) == 0 else tuple(range(len(shape)))
+    ndim=len(axes)
+    shape=tuple(int(s) for s in np.broadcast_to(shape,(ndim,)))
+
+    ##lazy scales (units.system.ScaledArray) : the grid is moved to the units of pos, the weights are scaled chunk by chunk
+    array,pos_scale=unscale(pos)
+    if pos_scale > 0:
+        pos=array
+        if pos_scale != 1.:
+            lower=None if lower is None else np.asarray(lower,dtype='float64')/pos_scale
+            upper=None if upper is None else np.asarray(upper,dtype='float64')/pos_scale
+            boxsize=None if boxsize is None else boxsize/pos_scale
+    weights,weight_scale=unscale(weights)
+
+    ##extent of the grid
+    periodic=boxsize is not None
+    if periodic:
+        lower=np.zeros(ndim) if lower is None else lower
+        upper=np.ones(ndim)*boxsize if upper is None else upper
+    else:
+        if lower is None:
+            lower=[np.min(pos[:,a]) for a in axes]
+        if upper is None: #slightly larger, so that the last particle is inside the grid
+            upper=[np.max(pos[:,a]) for a in axes]
+            upper=[u+1e-7*(u-l) if u > l else u for l,u in zip(lower,upper)]
+    lower=np.asarray(lower,dtype='float64')
+    upper=np.asarray(upper,dtype='float64')
+    cellsize=(upper-lower)/np.asarray(shape)
+    cellsize[cellsize == 0]=1.
+
+    if out is None:
+        out=np.zeros(shape)
+    elif out.shape != shape:
+        raise ValueError("out must have the shape "+str(shape))
+
+    n=len(pos)
+    starts=range(0,n,chunk_size)
+
+    def _deposit_chunks(grid,chunks):
+        for start in chunks:
+            stop=min(start+chunk_size,n)
+            p=np.asarray(pos[start:stop],dtype='float64')
+            if weights is None:
+                w=np.ones(stop-start)
+            else:
+                w=np.asarray(weights[start:stop],dtype='float64')
+                if weight_scale != 1.:
+                    w=w*weight_scale
+            _deposit_chunk(grid,p,w,kernel,axes,lower,cellsize,shape,periodic)
+        return grid
+
+    if nthreads > 1 and len(starts) > 1:
+        ##contiguous blocks of chunks, so that each thread works on a compact region if the particles are sorted in space
+        nthreads=min(nthreads,len(starts))
+        blocks=np.array_split(starts,nthreads)
+        pool=ThreadPool(nthreads)
+        try:
+            grids=pool.map(lambda b: _deposit_chunks(np.zeros(np.prod(shape)),b),blocks)
+        finally:
+            pool.close()
+        for grid in grids:
+            out+=grid.reshape(shape)
+    else:
+        flat=out.reshape(-1) #view when out is contiguous
+        if not np.may_share_memory(flat,out):
+            flat=np.zeros(np.prod(shape))
+            _deposit_chunks(flat,starts)
+            out+=flat.reshape(shape)
+        else:
+            _deposit_chunks(flat,starts)
+
+    return out
@@ -0,0 +1,92 @@
+###NAME: periodic.py
+###PURPOSE: distances and positions in a periodic box
+
+import numpy as np
+
+
+
+def wrap(x,boxsize,out=None):
+    """Wrap positions into the box [0,boxsize)
+
+    Parameters:
+    ----------
+
+    x : float array
+        positions (any shape)
+
+    boxsize : float
+        size of the periodic box
+
+    out : float array
+        output array, may be x itself (in place).
+
+    Example:
+    -------
+
+    >>> wrap(np.array([-1.,5.,11.]),10.)
+    array([ 9.,  5.,  1.])
+
+    """
+
+    return np.mod(x,boxsize,out=out)
+
+
+
+def minimum_image(dx,boxsize,out=None):
+    """Return the separation dx brought back to [-boxsize/2,boxsize/2] (nearest periodic image)
+
+    Parameters:
+    ----------
+
+    dx : float array
+        separations (any shape)
+
+    boxsize : float
+        size of the periodic box
+
+    out : float array
+        output array, may be dx itself (in place).
+
+    Example:
+    -------
+
+    >>> minimum_image(np.array([-9.,4.,6.]),10.)
+    array([ 1.,  4., -4.])
+
+    """
+
+    shift=np.rint(dx/boxsize)
+    shift*=boxsize
+    return np.subtract(dx,shift,out=out)
+
+
+
+def recenter(pos,center,boxsize=None,out=None):
+    """Return the positions relative to center, using the nearest periodic image if boxsize is given
+
+    Use it on the particles of a region after the selection (eg.: pos[ind]), so that only the selected particles are copied and shifted.
+
+    Parameters:
+    ----------
+
+    pos : float array [N,3]
+        cartesian coordinates
+
+    center : list or float array (3)
+        new origin
+
+    boxsize : float
+        size of the periodic box. None for an open domain.
+
+    out : float array [N,3]
+        output array, may be pos itself (in place).
+
+    """
+
+    if out is None:
+        out=np.empty(np.shape(pos),dtype=np.result_type(pos.dtype,np.float32))
+    for i in range(3):
+        np.subtract(pos[:,i],center[i],out=out[:,i])
+        if boxsize is not None:
+            minimum_image(out[:,i],boxsize,out=out[:,i])
+    return out
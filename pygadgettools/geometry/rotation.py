@@ -0,0 +1,191 @@
+###NAME: rotation.py
+###PURPOSE: rotate positions and velocities, in place or by blocks, and align them with the frame of a disk
+
+import numpy as np
+from internals.parallel import run_blocks
+from internals.sanity_check import _check_if_keyword_is_correct
+from geometry.periodic import minimum_image
+from geometry.coordinates import change_phase_space
+from physics.fields import net_angular_momentum, inertia_tensor
+
+
+BLOCK_ROWS = 65536 #number of particles rotated at once by each thread
+
+
+
+def rotation_matrix(axis,target=[0,0,1]):
+    """Return the rotation matrix R which brings the direction of axis onto target (rotated vector = R.dot(vector))
+
+    The rotation is the smallest one, around axis x target (Rodrigues formula).
+
+    Parameters:
+    ----------
+
+    axis : float array (3)
+        vector to align (eg.: total angular momentum)
+
+    target : float array (3)
+        direction of axis after the rotation. Default is z.
+
+
+    Example:
+    -------
+
+    >>> R=rotation_matrix([1,0,0])
+    >>> R.dot([1,0,0])
+    array([ 0.,  0.,  1.])
+
+    """
+
+    a=np.asarray(axis,dtype='float64')
+    b=np.asarray(target,dtype='float64')
+    norm_a=np.linalg.norm(a)
+    if norm_a == 0:
+        raise ValueError("Cannot align a null vector.")
+    a=a/norm_a
+    b=b/np.linalg.norm(b)
+
+    v=np.cross(a,b)
+    s=np.linalg.norm(v)
+    c=np.dot(a,b)
+    if s < 1e-12: #already aligned, or opposite : rotation of pi around any axis orthogonal to a
+        if c > 0:
+            return np.eye(3)
+        ortho=np.cross(a,[1.,0.,0.] if abs(a[0]) < 0.9 else [0.,1.,0.])
+        ortho/=np.linalg.norm(ortho)
+        return 2.*np.outer(ortho,ortho)-np.eye(3)
+
+    vx=np.array([[0.,-v[2],v[1]],
+                 [v[2],0.,-v[0]],
+                 [-v[1],v[0],0.]])
+    return np.eye(3)+vx+vx.dot(vx)*(1.-c)/(s*s)
+
+
+
+def rotate(x,matrix,center=None,boxsize=None,out=None,nthreads=1):
+    """Rotate vectors (positions or velocities) by blocks : out = matrix.dot(x-center) for each particle
+
+    Only one block of BLOCK_ROWS particles is allocated at a time, so the rotation can be done in place (out=x) on arrays as large as the memory.
+
+    Parameters:
+    ----------
+
+    x : float array [N,3]
+        cartesian vectors
+
+    matrix : float array [3,3]
+        rotation matrix (see rotation_matrix)
+
+    center : list or float array (3)
+        subtracted before the rotation (eg.: center of the galaxy, or its bulk velocity). Default is no shift.
+
+    boxsize : float
+        size of the periodic box, for positions : the nearest periodic image of center is used
+
+    out : float array [N,3]
+        output array, may be x itself (in place). If None, a new array is allocated with the dtype of x (float32 stays float32).
+
+    nthreads : integer
+        number of threads rotating the blocks concurrently (None or 0 for all the cores)
+
+
+    Example:
+    -------
+
+    >>> rotate(pos,R,center=center,out=pos) #in place
+
+    """
+
+    matrix=np.asarray(matrix,dtype='float64')
+    if out is None:
+        out=np.empty(np.shape(x),dtype=np.result_type(x.dtype,np.float32))
+    elif np.shape(out) != np.shape(x):
+        raise ValueError("out must have the dimension "+str(np.shape(x)))
+    shift=None if center is None else np.asarray(center,dtype='float64')
+
+    def _block(start,stop):
+        block=np.asarray(x[start:stop],dtype='float64')
+        if shift is not None:
+            block=block-shift
+            if boxsize is not None:
+                minimum_image(block,boxsize,out=block)
+        out[start:stop]=block.dot(matrix.T)
+
+    run_blocks(_block,len(x),BLOCK_ROWS,nthreads)
+    return out
+
+
+
+def disk_frame(pos,vel,mass=None,center=[0,0,0],velocity=[0,0,0],radius=None,index=None,boxsize=None,
+               method="angular_momentum",coordinates="cart",out_pos=None,out_vel=None,nthreads=1):
+    """Move positions and velocities into the frame of a disk : centered, with the axis of the disk along z
+
+    The axis is computed as a reduction over the selected particles (see physics.fields.net_angular_momentum and inertia_tensor), then all the particles are rotated by blocks, and optionally converted to cylindrical or spherical coordinates in the same output arrays.
+
+    Parameters:
+    ----------
+
+    pos, vel : float array [N,3]
+        cartesian positions and velocities (can be np.memmap)
+
+    mass : float array [N]
+        mass of particles
+
+    center : list or float array (3)
+        center of the disk
+
+    velocity : list or float array (3)
+        bulk velocity of the disk
+
+    radius : float
+        only the particles within radius of center are used to find the axis (eg.: the stars of the inner disk)
+
+    index : integer array
+        only these particles are used to find the axis
+
+    boxsize : float
+        size of the periodic box
+
+    method : string
+        'angular_momentum' (axis along the net angular momentum) or 'inertia' (axis of smallest second moment, oriented along the angular momentum)
+
+    coordinates : string
+        coordinate system of the outputs ('cart', 'cyl' or 'sph')
+
+    out_pos, out_vel : float array [N,3]
+        output arrays, may be pos and vel themselves (in place). If None, new arrays are allocated.
+
+    nthreads : integer
+        number of threads
+
+
+    Returns (pos,vel,matrix) : positions and velocities in the frame of the disk, and the rotation matrix.
+
+    Example:
+    -------
+
+    >>> pos_cyl,vel_cyl,R=disk_frame(pos,vel,mass,center=center,velocity=vcenter,radius=10.,coordinates="cyl")
+    >>> vphi=vel_cyl[:,1]
+
+    """
+
+    _check_if_keyword_is_correct(method,["angular_momentum","inertia"])
+    _check_if_keyword_is_correct(coordinates,["cart","cyl","sph"])
+
+    L=net_angular_momentum(pos,vel,mass,center=center,velocity=velocity,radius=radius,index=index,
+                           boxsize=boxsize,nthreads=nthreads)
+    if method == "angular_momentum":
+        axis=L
+    else:
+        values,vectors=np.linalg.eigh(inertia_tensor(pos,mass,center=center,radius=radius,index=index,
+                                                     boxsize=boxsize,nthreads=nthreads))
+        axis=vectors[:,0] #smallest second moment : normal of the disk
+        if np.dot(axis,L) < 0:
+            axis=-axis
+    matrix=rotation_matrix(axis)
+
+    out_pos=rotate(pos,matrix,center=center,boxsize=boxsize,out=out_pos,nthreads=nthreads)
+    out_vel=rotate(vel,matrix,center=velocity,out=out_vel,nthreads=nthreads)
+    if coordinates != "cart":
+        change_phase_space(out_pos,out_vel,"cart",coordinates,out_pos=out_pos,out_vel=out_vel,nthreads=nthreads)
+    return out_pos,out_vel,matrix
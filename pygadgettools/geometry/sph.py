@@ -0,0 +1,322 @@
+###NAME: sph.py
+###PURPOSE: render SPH fields (projections and slices) on images with the cubic spline kernel and the smoothing lengths
+
+import numpy as np
+from multiprocessing.pool import ThreadPool
+
+
+PARTICLES_PER_CHUNK = 2**18
+SAMPLES_PER_BATCH   = 2**22 #maximal number of (particle,pixel) pairs evaluated at once
+NTABLE              = 1000  #number of points in the tabulated kernel integrals
+
+_TABLES = {}
+
+
+
+def kernel(q):
+    """Cubic spline kernel of Gadget for a smoothing length h=1 : W(r,h)=kernel(r/h)/h**3
+
+    Parameters:
+    ----------
+
+    q : float array
+        distance in units of the smoothing length (the kernel is 0 for q>=1)
+
+    """
+
+    q=np.asarray(q,dtype='float64')
+    w=np.where(q < 0.5,1.-6.*q*q+6.*q*q*q,2.*np.clip(1.-q,0.,None)**3)
+    w*=8./np.pi
+    return w
+
+
+
+def _tables():
+    """Return the kernel and its integrals tabulated on a regular grid of q**2 (computed once)
+
+    kernel(q)    : the kernel itself
+    projected(q) : integral of the kernel along a line of sight at the distance q
+    plane(q)     : integral of the kernel over a plane at the distance q
+    """
+
+    if not _TABLES:
+        x=np.sqrt(np.linspace(0.,1.,NTABLE+1))
+        t=np.linspace(0.,1.,2*NTABLE+1)
+        s=np.sqrt(1.-x*x)[:,None]*t[None,:] #integration variable, up to the edge of the kernel
+        w=kernel(np.sqrt(x[:,None]**2+s**2))
+        ##one more zero at the end, so that the interpolation of q**2=1 needs no special case
+        _TABLES.update(kernel=np.append(kernel(x),0.),
+                       projected=np.append(2.*np.trapz(w,s,axis=1),0.),
+                       plane=np.append(2.*np.pi*np.trapz(w*s,s,axis=1),0.))
+    return _TABLES
+
+
+
+def _lookup(table,q2):
+    """Linear interpolation of a tabulated kernel function at q2=(r/h)**2 (0 outside the kernel)
+
+    Faster than np.interp since the table is regular : no search is needed.
+    """
+
+    table=_tables()[table]
+    s=np.minimum(q2,1.)
+    s*=NTABLE
+    i=s.astype('int64')
+    s-=i
+    value=table[i+1]
+    value-=table[i]
+    value*=s
+    value+=table[i]
+    return value
+
+
+
+def _render_chunk(image,shape,x,y,h,dz,values,pixel,mode):
+    """Add the contribution of one chunk of particles to the flattened images [k,npixels]
+
+    x, y are in pixels from the lower corner of the image, h and dz in the units of the positions, values [n,k] are the quantities carried by each particle (already multiplied by the volume m/rho).
+    """
+
+    area=pixel[0]*pixel[1]
+
+    ##total contribution of each particle on the image plane
+    if mode == "slice":
+        values=values*(_lookup("plane",(dz/h)**2)/h)[:,None]
+
+    ##fast path : particles smaller than a pixel fall in one pixel
+    small=(2.*h < pixel[0]) & (2.*h < pixel[1])
+    ind=np.flatnonzero(small)
+    _add(image,_flat_pixel(np.floor(x[ind]),np.floor(y[ind]),shape),values[ind]/area)
+
+    ##large particles : kernel sampled at the center of the pixels, grouped by footprint size
+    nx=np.ceil(h/pixel[0]).astype('int64')
+    ny=np.ceil(h/pixel[1]).astype('int64')
+    large=np.flatnonzero(~small)
+    key=nx[large]*(np.max(ny)+1)+ny[large]
+    order=np.argsort(key,kind='mergesort')
+    large=large[order]
+    bounds=np.flatnonzero(np.diff(key[order]))+1
+    for group in np.split(large,bounds):
+        if len(group) == 0:
+            continue
+        ox=np.arange(-nx[group[0]],nx[group[0]]+1)
+        oy=np.arange(-ny[group[0]],ny[group[0]]+1)
+        batch=max(1,SAMPLES_PER_BATCH//(len(ox)*len(oy)))
+        for start in range(0,len(group),batch):
+            g=group[start:start+batch]
+            ##the footprint is separable : distances and pixels along each axis, combined by broadcasting
+            ix=np.floor(x[g])
+            iy=np.floor(y[g])
+            dx2=(((ix-x[g]+0.5)[:,None]+ox)*(pixel[0]/h[g])[:,None])**2
+            dy2=(((iy-y[g]+0.5)[:,None]+oy)*(pixel[1]/h[g])[:,None])**2
+            q2=dx2[:,:,None]+dy2[:,None,:]
+            if mode == "slice":
+                q2+=((dz[g]/h[g])**2)[:,None,None]
+            w=_lookup("projected" if mode == "projection" else "kernel",q2)
+
+            ##normalize the samples to the exact integral, so that nothing is lost at low resolution
+            norm=np.sum(w,axis=(1,2))
+            unresolved=norm == 0 #kernel between the pixel centers : nearest pixel
+            w[unresolved,len(ox)//2,len(oy)//2]=1.
+            norm[unresolved]=1.
+            norm*=area
+            pixels=_flat_pixel(ix[:,None,None]+ox[:,None],iy[:,None,None]+oy,shape)
+            _add(image,pixels.reshape(len(g),-1),values[g]/norm[:,None],w.reshape(len(g),-1))
+
+
+
+def _add(image,pixels,values,weights=None):
+    """Add values [n,k] (times weights [n,m]) in the pixels [n] (or [n,m]) of the flattened images [k,npixels]
+
+    Pixels outside the image are -1. Only the range of pixels touched is reduced.
+    """
+
+    inside=pixels >= 0
+    if not np.any(inside):
+        return
+    flat=pixels[inside]
+    first=np.min(flat)
+    flat-=first
+    for k in range(values.shape[1]):
+        if weights is None:
+            v=values[:,k][inside]
+        else:
+            v=(weights*values[:,k][:,None])[inside]
+        contribution=np.bincount(flat,weights=v)
+        image[k,first:first+len(contribution)]+=contribution
+
+
+
+def _flat_pixel(ix,iy,shape):
+    """Flat index of the pixels (ix,iy), -1 outside the image"""
+
+    ix=ix.astype('int64')
+    iy=iy.astype('int64')
+    flat=ix*shape[1]+iy
+    flat[(ix < 0) | (ix >= shape[0]) | (iy < 0) | (iy >= shape[1])]=-1
+    return flat
+
+
+
+def _render(pos,hsml,values,center,width,npixels,axis,mode,depth,chunk_size,nthreads):
+    """Render the quantities values [N,k] carried by the particles on k images, by chunks of particles distributed over threads
+    """
+
+    center=np.asarray(center,dtype='float64')
+    axes=[i for i in range(3) if i != axis]
+    width=np.broadcast_to(np.asarray(width,dtype='float64'),(2,))
+    shape=tuple(int(n) for n in np.broadcast_to(npixels,(2,)))
+    pixel=width/np.asarray(shape)
+    lower=center[axes]-width/2.
+    nvalues=len(values)
+
+    n=len(pos)
+    starts=range(0,n,chunk_size)
+
+    def _render_chunks(chunks):
+        image=np.zeros((nvalues,shape[0]*shape[1]))
+        for start in chunks:
+            stop=min(start+chunk_size,n)
+            p=np.asarray(pos[start:stop],dtype='float64')
+            h=np.asarray(hsml[start:stop],dtype='float64')
+            dz=p[:,axis]-center[axis]
+            x=(p[:,axes[0]]-lower[0])/pixel[0]
+            y=(p[:,axes[1]]-lower[1])/pixel[1]
+
+            ##particles overlapping the image (and the plane for a slice)
+            keep=(x+h/pixel[0] >= 0) & (x-h/pixel[0] <= shape[0]) & \
+                 (y+h/pixel[1] >= 0) & (y-h/pixel[1] <= shape[1]) & (h > 0)
+            if mode == "slice":
+                keep&=np.abs(dz) < h
+            elif depth is not None:
+                keep&=np.abs(dz) <= depth/2.
+            ind=np.flatnonzero(keep)
+            if len(ind) == 0:
+                continue
+            v=np.column_stack([np.asarray(value[start:stop],dtype='float64')[ind] for value in values])
+            _render_chunk(image,shape,x[ind],y[ind],h[ind],dz[ind],v,pixel,mode)
+        return image
+
+    if nthreads > 1 and len(starts) > 1:
+        nthreads=min(nthreads,len(starts))
+        pool=ThreadPool(nthreads)
+        try:
+            images=pool.map(_render_chunks,np.array_split(starts,nthreads))
+        finally:
+            pool.close()
+        image=np.sum(images,axis=0)
+    else:
+        image=_render_chunks(starts)
+
+    return [im.reshape(shape) for im in image]
+
+
+
+def _particle_values(mass,rho,q,weights):
+    """Quantities carried by each particle : [m q/rho] or [m w q/rho, m w/rho] for a weighted image"""
+
+    if q is None:
+        return [mass]
+    if rho is None:
+        raise ValueError("rho is needed to render a field other than the density")
+    volume=np.asarray(mass,dtype='float64')/rho
+    if weights is None:
+        return [volume*q]
+    return [volume*weights*q,volume*weights]
+
+
+
+def projection(pos,hsml,mass,center,width,npixels,q=None,rho=None,weights=None,axis=2,depth=None,
+               chunk_size=PARTICLES_PER_CHUNK,nthreads=1):
+    """Project a gas field along an axis with the SPH kernel of each particle
+
+    Each particle is spread with the cubic spline kernel integrated along the line of sight, read from a precomputed table. Particles smaller than a pixel are put directly in their pixel. For the others, the kernel is sampled at the center of the pixels and normalized, so that the integral of the image is exact at any resolution.
+
+    Parameters:
+    ----------
+
+    pos : float array [N,3]
+        cartesian coordinates
+
+    hsml : float array [N]
+        smoothing lengths (radius of the kernel, as in Gadget)
+
+    mass : float array [N]
+        masses
+
+    center : list or float array (3)
+        center of the image
+
+    width : float or list of 2 float
+        width of the image along each axis of the image
+
+    npixels : integer or list of 2 integer
+        number of pixels along each axis of the image
+
+    q : float array [N]
+        field to project. Default is the density : the image is then the surface density.
+
+    rho : float array [N]
+        densities, needed if q is given
+
+    weights : float array [N]
+        if given, the image is the mean of q along the line of sight weighted by weights (eg.: rho)
+
+    axis : integer
+        line of sight (0, 1 or 2). The image axes are the two other axes, in increasing order.
+
+    depth : float
+        only the particles within depth/2 of center along the line of sight are projected. Default is all.
+
+    chunk_size : integer
+        number of particles rendered at a time
+
+    nthreads : integer
+        number of threads, each with a private image
+
+
+    Returns the image [npixels[0],npixels[1]], indexed by the first and the second image axis (use image.T with plt.imshow).
+
+    Example:
+    -------
+
+    >>> sigma=projection(pos,hsml,mass,center,width=10.,npixels=512)
+    >>> T=projection(pos,hsml,mass,center,10.,512,q=temperature,rho=rho,weights=rho) #mass weighted temperature
+
+    """
+
+    images=_render(pos,hsml,_particle_values(mass,rho,q,weights),center,width,npixels,axis,"projection",depth,chunk_size,nthreads)
+    if len(images) == 2:
+        with np.errstate(invalid='ignore',divide='ignore'):
+            return images[0]/images[1]
+    return images[0]
+
+
+
+def slice_plane(pos,hsml,mass,center,width,npixels,q=None,rho=None,weights=None,axis=2,
+                chunk_size=PARTICLES_PER_CHUNK,nthreads=1):
+    """Interpolate a gas field on the plane through center perpendicular to axis, with the SPH kernel of each particle
+
+    Only the particles whose kernel crosses the plane are used. Particles smaller than a pixel are put directly in their pixel, with the integral of the kernel over the plane read from a precomputed table. For the others, the kernel is sampled at the center of the pixels and normalized to the same integral.
+
+    Parameters:
+    ----------
+
+    pos, hsml, mass, center, width, npixels, q, rho, weights, axis, chunk_size, nthreads :
+        see projection. Default q is the density.
+
+
+    Returns the image [npixels[0],npixels[1]], indexed by the first and the second image axis (use image.T with plt.imshow).
+
+    Example:
+    -------
+
+    >>> rho_slice=slice_plane(pos,hsml,mass,center,width=10.,npixels=512,axis=0)
+
+    """
+
+    images=_render(pos,hsml,_particle_values(mass,rho,q,weights),center,width,npixels,axis,"slice",None,chunk_size,nthreads)
+    if len(images) == 2:
+        with np.errstate(invalid='ignore',divide='ignore'):
+            return images[0]/images[1]
+    return images[0]
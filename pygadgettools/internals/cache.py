@@ -0,0 +1,168 @@
+###NAME: cache.py
+###PURPOSE: memory-bounded cache of arrays with least recently used (LRU) eviction
+
+import os
+from collections import OrderedDict
+import numpy as np
+
+
+CACHE_FRACTION = 0.25 #default budget of a cache, as a fraction of the physical memory
+MEMORY_MARGIN  = 0.1  #fraction of the physical memory always left free : nothing is cached below this margin
+
+
+
+def _physical_memory():
+    """Return the physical memory and the memory currently available, in bytes (None if unknown)"""
+
+    try:
+        page=os.sysconf('SC_PAGE_SIZE')
+        total=page*os.sysconf('SC_PHYS_PAGES')
+    except (ValueError,OSError,AttributeError): #not a POSIX system
+        return None,None
+
+    available=None
+    try: #MemAvailable counts the page cache which can be reclaimed
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available=int(line.split()[1])*1024
+                    break
+    except IOError:
+        pass
+    if available is None:
+        try:
+            available=page*os.sysconf('SC_AVPHYS_PAGES')
+        except (ValueError,OSError):
+            pass
+    return total,available
+
+
+
+def _nbytes(value):
+    """Memory used by a cached value : the arrays it contains, memory maps and broadcast arrays excluded"""
+
+    if isinstance(value,np.ndarray):
+        if isinstance(value,np.memmap) or 0 in value.strides:
+            return 0
+        return value.nbytes
+    if isinstance(value,dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value,(list,tuple)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+
+class LRUCache(object):
+    """Cache of arrays with a memory budget : when a new value does not fit, the least recently used values are evicted
+
+    A value is not cached (but still returned by the caller) if it is larger than the budget, or if caching it would leave less than MEMORY_MARGIN of the physical memory free, so that the cache never pushes the job into swap.
+
+    Parameters:
+    ----------
+
+    max_bytes : integer
+        memory budget in bytes. Default is CACHE_FRACTION of the physical memory.
+
+
+    Example:
+    -------
+
+    >>> cache=LRUCache(8*1024**3) #8 GB
+    >>> cache.put(("r","dm"),r)
+    >>> r=cache.get(("r","dm")) #None if it was evicted
+
+    """
+
+    def __init__(self,max_bytes=None):
+        total,_=_physical_memory()
+        if max_bytes is None:
+            max_bytes=int(CACHE_FRACTION*total) if total is not None else 2*1024**3
+        self.max_bytes=int(max_bytes)
+        self.nbytes=0
+        self.hits=0
+        self.misses=0
+        self._values=OrderedDict() #key -> (value,nbytes), from the least to the most recently used
+
+
+    def __len__(self):
+        return len(self._values)
+
+
+    def __contains__(self,key):
+        return key in self._values
+
+
+    def keys(self):
+        """Keys of the cached values, from the least to the most recently used"""
+        return list(self._values.keys())
+
+
+    def get(self,key,default=None):
+        """Return the cached value (and mark it as recently used), or default"""
+
+        if key not in self._values:
+            self.misses+=1
+            return default
+        self.hits+=1
+        value,size=self._values.pop(key)
+        self._values[key]=(value,size)
+        return value
+
+
+    def peek(self,key,default=None):
+        """Return the cached value without marking it as recently used, or default"""
+
+        if key not in self._values:
+            return default
+        return self._values[key][0]
+
+
+    def put(self,key,value):
+        """Cache value under key, evicting the least recently used values if needed. Return True if it was cached."""
+
+        self.pop(key)
+        size=_nbytes(value)
+        if size > self.max_bytes:
+            return False
+
+        while self._values and self.nbytes+size > self.max_bytes:
+            self._evict()
+
+        ##the value is already in memory : keep it only if the last MEMORY_MARGIN of the memory is still free, evicting more if needed
+        total,available=_physical_memory()
+        if total is not None and available is not None:
+            while self._values and available < MEMORY_MARGIN*total:
+                available+=self._evict()
+            if available < MEMORY_MARGIN*total:
+                return False
+
+        self._values[key]=(value,size)
+        self.nbytes+=size
+        return True
+
+
+    def pop(self,key,default=None):
+        """Remove a value from the cache and return it"""
+
+        if key not in self._values:
+            return default
+        value,size=self._values.pop(key)
+        self.nbytes-=size
+        return value
+
+
+    def _evict(self):
+        """Remove the least recently used value, return its size"""
+
+        _,(_,size)=self._values.popitem(last=False)
+        self.nbytes-=size
+        return size
+
+
+    def clear(self,match=None):
+        """Remove all the values, or only those whose key satisfies match(key)"""
+
+        for key in list(self._values.keys()):
+            if match is None or match(key):
+                self.pop(key)
@@ -0,0 +1,15 @@
+###NAME: dtypes.py
+###PURPOSE: dtypes of the outputs computed from several arrays
+
+import numpy as np
+
+
+
+def _float_dtype(*arrays):
+    """Return the floating dtype of the result : float32 stays float32, integers become float64
+    """
+
+    dtype=np.result_type(*arrays)
+    if not np.issubdtype(dtype,np.floating):
+        dtype=np.dtype('float64')
+    return dtype
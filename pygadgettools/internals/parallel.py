@@ -0,0 +1,89 @@
+###NAME: parallel.py
+###PURPOSE: thread-parallel execution of block kernels (numba when available, numpy otherwise)
+
+import numpy as np
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+try:
+    import numba
+except ImportError: #numba is optional : the kernels fall back to numpy by blocks
+    numba = None
+
+
+BLOCKS_PER_THREAD = 4 #more blocks than threads, so that the threads stay busy until the end
+
+
+
+def jit(function):
+    """Compile a kernel with numba (nopython, releasing the GIL), or return None if numba is not installed
+
+    Example:
+    -------
+
+    >>> _kernel=jit(_python_kernel)
+    >>> if _kernel is not None:
+    ...     _kernel(pos,out)
+
+    """
+
+    if numba is None:
+        return None
+    return numba.njit(nogil=True)(function)
+
+
+
+def _nthreads(nthreads):
+    """Number of threads : None or 0 for all the cores"""
+
+    if not nthreads:
+        return cpu_count()
+    return int(nthreads)
+
+
+
+def run_blocks(kernel,n,block_rows,nthreads=1):
+    """Run kernel(start,stop) on the blocks of rows [start,stop) covering [0,n), on a pool of threads
+
+    Each block must write into its own slice of a preallocated output, so that the blocks are independent. The numpy ufuncs and the numba kernels release the GIL : the threads run on several cores.
+
+    Parameters:
+    ----------
+
+    kernel : function
+        kernel(start,stop) processing the rows [start,stop)
+
+    n : integer
+        number of rows
+
+    block_rows : integer
+        maximal number of rows per block (the temporaries of the numpy kernels are allocated for one block)
+
+    nthreads : integer
+        number of threads. None or 0 for all the cores, 1 to run in the calling thread.
+
+
+    Returns the list of the values returned by kernel for each block, in order.
+
+    Example:
+    -------
+
+    >>> def _block(start,stop):
+    ...     np.sqrt(x[start:stop],out=out[start:stop])
+    >>> run_blocks(_block,len(x),65536,nthreads=8)
+
+    """
+
+    nthreads=_nthreads(nthreads)
+    if nthreads > 1 and n > block_rows: #smaller blocks, so that all the threads get some
+        block_rows=max(min(block_rows,-(-n//(nthreads*BLOCKS_PER_THREAD))),1)
+    blocks=[(start,min(start+block_rows,n)) for start in range(0,n,block_rows)]
+
+    if nthreads <= 1 or len(blocks) <= 1:
+        return [kernel(start,stop) for start,stop in blocks]
+
+    pool=ThreadPool(min(nthreads,len(blocks)))
+    try:
+        return pool.map(lambda block: kernel(*block),blocks,chunksize=1)
+    finally:
+        pool.close()
@@ -26,13 +26,68 @@ def get_full_path(n,root="snapshot_",dir="./",ndigits=3,ext=""):
     ndigits : integer
         number of digits to add leading zeros
 
-    COMMENTS : 1. currently assume one single file to read for a given time.
+    COMMENTS : 1. return the path of a single file. For snapshots split in several files, see get_snapshot_files.
     """
 
     numbering=str(n).zfill(ndigits) ##add leading zeros
     dir=os.path.join(dir, '') #append '/' character if needed
-    input_file=dir+root+numbering+'.'+ext
+    input_file=dir+root+numbering
+    if ext != "":
+        input_file+='.'+ext
 
     return input_file
 
 
+
+def get_snapshot_files(n,root="snapshot_",dir="./",ndigits=3,ext=""):
+    """Return the list of all the files of a snapshot, which may be split in several files
+
+    The following layouts are searched, in this order :
+        dir/snapshot_079[.ext]                    (single file)
+        dir/snapshot_079.0[.ext], ...             (split files)
+        dir/snapdir_079/snapshot_079.0[.ext], ... (split files in a subdirectory)
+    The number of files is read from the header of the first file (NumFilesPerSnapshot).
+
+    Parameters:
+    ----------
+
+    n : integer
+        snapshot number
+
+    root : string 
+        root name of snapshot
+
+    dir : string
+        directory of files
+
+    ext : string
+        extension of file (eg.: "hdf5")
+
+    ndigits : integer
+        number of digits to add leading zeros
+
+    """
+
+    from readers.snapfile import open_snapshot #imported here to keep names independent of the readers
+
+    numbering=str(n).zfill(ndigits)
+    suffix='.'+ext if ext != "" else ""
+    single=get_full_path(n,root=root,dir=dir,ndigits=ndigits,ext=ext)
+    if os.path.isfile(single):
+        return [single]
+
+    for subdir in [dir,os.path.join(dir,"snapdir_"+numbering)]:
+        base=os.path.join(subdir,root+numbering)
+        if os.path.isfile(base+".0"+suffix):
+            first=open_snapshot(base+".0"+suffix)
+            nfiles=int(first.header["NumFilesPerSnapshot"])
+            first.close()
+            files=[base+"."+str(i)+suffix for i in range(nfiles)]
+            missing=[f for f in files if not os.path.isfile(f)]
+            if len(missing) > 0:
+                raise IOError("Missing files of snapshot "+numbering+": "+", ".join(missing))
+            return files
+
+    raise IOError("No file found for snapshot "+numbering+" in "+dir)
+
+
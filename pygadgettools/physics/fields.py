@@ -5,6 +5,11 @@ import sys
 import numpy as np
 from units.common import PROTON_MASS,ADIABATIC_INDEX, BOLTZMANN_CONSTANT
 from internals.sanity_check import _check_if_keyword_is_correct
+from internals.parallel import jit, run_blocks
+from internals.dtypes import _float_dtype
+from geometry.periodic import recenter
+
+BLOCK_ROWS = 65536 #number of particles computed at once by each thread
 
          
 
@@ -99,7 +104,25 @@ def _specific_angular_momentum_spherical(pos,vel):
 
 
 
-def specific_angular_momentum(pos,vel,coordinates='cart'):
+def _loop_cross_product(pos,vel,out):
+    """Compiled kernel (numba) of the cartesian specific angular momentum, without temporary arrays"""
+
+    for i in range(pos.shape[0]):
+        x=pos[i,0]
+        y=pos[i,1]
+        z=pos[i,2]
+        vx=vel[i,0]
+        vy=vel[i,1]
+        vz=vel[i,2]
+        out[i,0]=y*vz-z*vy
+        out[i,1]=z*vx-vz*x
+        out[i,2]=x*vy-vx*y
+
+_cross_product=jit(_loop_cross_product)
+
+
+
+def specific_angular_momentum(pos,vel,coordinates='cart',out=None,nthreads=1):
     """Compute the specific angular momentum in spherical coordinates
 
 
@@ -114,6 +137,12 @@ def specific_angular_momentum(pos,vel,coordinates='cart'):
 
     coordinates : string
         which coordinates system are you using ? ('cart','cyl','sph')
+
+    out : float array [N,3]
+        output array. If None, a new array is allocated.
+
+    nthreads : integer
+        number of threads computing blocks of BLOCK_ROWS particles concurrently (None or 0 for all the cores). The cartesian case uses a compiled kernel when numba is installed.
    
     """
 
@@ -124,17 +153,27 @@ def specific_angular_momentum(pos,vel,coordinates='cart'):
 
     list_sys=["cart","cyl","sph"] #list of authorized strings for sys1 and sys2. I could also authorize complete names
     _check_if_keyword_is_correct(coordinates,list_sys)
-        
-    try:
-        return options[coordinates](pos,vel)
-    except KeyError: #if wrong coordinates system, quit
-        sys.exit()
 
+    if out is None:
+        out=np.empty((len(pos),3),dtype=_float_dtype(pos,vel))
+
+    compiled=_cross_product is not None and coordinates == 'cart' and \
+        all(a.dtype == out.dtype and a.dtype.isnative for a in (pos,vel,out))
+
+    def _block(start,stop):
+        if compiled:
+            _cross_product(pos[start:stop],vel[start:stop],out[start:stop])
+        else:
+            out[start:stop]=options[coordinates](pos[start:stop],vel[start:stop])
 
+    run_blocks(_block,len(pos),BLOCK_ROWS,nthreads)
+    return out
 
 
 
-def angular_momentum(pos,vel,mass,coordinates='cart'):
+
+
+def angular_momentum(pos,vel,mass,coordinates='cart',nthreads=1):
     """Compute the angular momentum in spherical coordinates
 
 
@@ -152,10 +191,144 @@ def angular_momentum(pos,vel,mass,coordinates='cart'):
 
     coordinates : string
         which coordinates system are you using ? ('cart','cyl','sph')
+
+    nthreads : integer
+        number of threads
    
     """
-    
-    return mass[:,None]*specific_angular_momentum(pos,vel,coordinates=coordinates)
+
+    mass=np.asarray(mass)
+    out=np.empty((len(pos),3),dtype=_float_dtype(pos,vel,mass)) #float64 masses give float64 momenta, as mass*j
+    j=specific_angular_momentum(pos,vel,coordinates=coordinates,out=out,nthreads=nthreads)
+    j*=mass[:,None]
+    return j
+
+
+
+
+
+
+def _selection_blocks(pos,mass,center,boxsize,radius,index,function,nthreads):
+    """Apply function(p,m,rows) to blocks of the selected particles, recentered (and within radius), and sum the results
+
+    p is a float64 block of positions relative to center, m the masses (None if not given) and rows the rows of the block in the original arrays.
+    """
+
+    n=len(pos) if index is None else len(index)
+
+    def _block(start,stop):
+        rows=slice(start,stop) if index is None else index[start:stop]
+        p=recenter(np.asarray(pos[rows],dtype='float64'),center,boxsize)
+        m=None if mass is None else np.asarray(mass[rows],dtype='float64')
+        if radius is not None:
+            inside=np.einsum('ij,ij->i',p,p) <= radius*radius
+            p=p[inside]
+            m=None if m is None else m[inside]
+            rows=np.arange(start,stop)[inside] if index is None else rows[inside]
+        return function(p,m,rows)
+
+    return sum(run_blocks(_block,n,BLOCK_ROWS,nthreads))
+
+
+
+def net_angular_momentum(pos,vel,mass=None,center=[0,0,0],velocity=[0,0,0],radius=None,index=None,boxsize=None,nthreads=1):
+    """Compute the total angular momentum of a selection of particles, as a reduction by blocks (no [N,3] temporary)
+
+    Parameters:
+    ----------
+
+    pos : float array [N,3]
+        cartesian coordinates (can be a np.memmap)
+
+    vel : float array [N,3]
+        cartesian velocity
+
+    mass : float array [N]
+        mass of particles. If None, the specific angular momentum summed over the particles.
+
+    center : list or float array (3)
+        origin of the positions
+
+    velocity : list or float array (3)
+        origin of the velocities (eg.: bulk velocity of the galaxy)
+
+    radius : float
+        only the particles within radius of center are used
+
+    index : integer array
+        only these particles are used (eg.: from filter.spatial)
+
+    boxsize : float
+        size of the periodic box. If given, the nearest periodic image of center is used.
+
+    nthreads : integer
+        number of threads
+
+
+    Example:
+    -------
+
+    >>> L=net_angular_momentum(pos,vel,mass,center=center,radius=20.)
+    >>> L/np.linalg.norm(L) #axis of the disk
+
+    """
+
+    velocity=np.asarray(velocity,dtype='float64')
+    def _sum(p,m,rows):
+        v=np.asarray(vel[rows],dtype='float64')-velocity #new array : vel[rows] can be a view of the input
+        if m is not None:
+            p*=m[:,None]
+        return np.cross(p,v).sum(axis=0)
+
+    return np.zeros(3)+_selection_blocks(pos,mass,center,boxsize,radius,index,_sum,nthreads)
+
+
+
+def inertia_tensor(pos,mass=None,center=[0,0,0],radius=None,index=None,boxsize=None,reduced=False,nthreads=1):
+    """Compute the second moment tensor sum(m x_i x_j) of a selection of particles, as a reduction by blocks
+
+    The eigenvector with the smallest eigenvalue is the axis of a disk (the moment of inertia tensor is trace(S)*I-S).
+
+    Parameters:
+    ----------
+
+    pos : float array [N,3]
+        cartesian coordinates (can be a np.memmap)
+
+    mass : float array [N]
+        mass of particles. If None, all the particles have the same weight.
+
+    center : list or float array (3)
+        origin of the positions
+
+    radius : float
+        only the particles within radius of center are used
+
+    index : integer array
+        only these particles are used
+
+    boxsize : float
+        size of the periodic box
+
+    reduced : boolean
+        if True, each particle is weighted by 1/r^2 (reduced tensor, less sensitive to the outer particles)
+
+    nthreads : integer
+        number of threads
+
+
+    Returns a [3,3] float array.
+    """
+
+    def _sum(p,m,rows):
+        w=np.ones(len(p)) if m is None else m
+        if reduced:
+            r2=np.einsum('ij,ij->i',p,p)
+            with np.errstate(invalid='ignore',divide='ignore'):
+                w=np.where(r2 > 0,w/r2,0.)
+        return np.dot((p*w[:,None]).T,p)
+
+    return np.zeros((3,3))+_selection_blocks(pos,mass,center,boxsize,radius,index,_sum,nthreads)
 
 
 
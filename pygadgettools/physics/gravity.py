@@ -0,0 +1,372 @@
+###NAME: gravity.py
+###PURPOSE: gravitational potential and accelerations with a Barnes-Hut tree (octree)
+
+import numpy as np
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from units.common import UnitGravity
+from filter.index import _concatenate_ranges
+
+
+LEAF_SIZE         = 8    #maximal number of particles in a leaf
+MAX_LEVEL         = 21   #21 bits per dimension in the 63 bits Morton keys
+TARGETS_PER_BATCH = 512  #number of targets walking the tree together
+GROUP_SIZE        = 4    #number of neighbouring targets sharing the same interaction list
+
+
+
+def _spread_bits(i):
+    """Insert two zeros between the bits of the 21 bits integers i (for the Morton keys)"""
+
+    i=i.astype('uint64')
+    i&=np.uint64(0x1fffff)
+    for shift,mask in ((32,0x1f00000000ffff),(16,0x1f0000ff0000ff),(8,0x100f00f00f00f00f),
+                       (4,0x10c30c30c30c30c3),(2,0x1249249249249249)):
+        i=(i | (i << np.uint64(shift))) & np.uint64(mask)
+    return i
+
+
+
+def morton_keys(pos,lower,size):
+    """Return the Morton (Z-order) keys of the positions in the cube [lower,lower+size)
+
+    Parameters:
+    ----------
+
+    pos : float array [N,3]
+        cartesian coordinates
+
+    lower : float array (3)
+        lower corner of the cube
+
+    size : float
+        side of the cube
+
+    """
+
+    key=np.zeros(len(pos),dtype='uint64')
+    for i in range(3):
+        cell=np.floor((pos[:,i]-lower[i])/size*2**MAX_LEVEL)
+        np.clip(cell,0,2**MAX_LEVEL-1,out=cell)
+        key|=_spread_bits(cell) << np.uint64(2-i)
+    return key
+
+
+
+def _sum_ranges(x,start,end):
+    """Sum of x[start[i]:end[i]] for all i (non empty ranges)"""
+
+    x=np.concatenate((x,np.zeros((1,)+x.shape[1:],dtype=x.dtype)))
+    return np.add.reduceat(x,np.column_stack((start,end)).ravel(),axis=0)[::2]
+
+
+
+class GravityTree(object):
+    """Octree of the particles for the Barnes-Hut computation of the potential and the accelerations
+
+    The tree is built level by level from the sorted Morton keys of the particles, with vectorized operations only : the cells of a level are the runs of equal key prefixes, and a cell is split if it has more than leaf_size particles. The tree is then walked by many targets at once, sorted along the same Morton curve and gathered in groups of neighbours : each (group,node) pair is either accepted (monopole), or replaced by the children of the node, or by the particles of a leaf (direct sum). The interactions of all the targets of the batch are then summed in a few vectorized operations.
+
+    Parameters:
+    ----------
+
+    pos : float array [N,3]
+        cartesian coordinates
+
+    mass : float array [N]
+        masses
+
+    leaf_size : integer
+        maximal number of particles in a leaf
+
+
+    Example:
+    -------
+
+    >>> tree=GravityTree(pos,mass)
+    >>> phi=tree.potential(softening=0.1) #potential at the position of each particle
+    >>> phi,acc=tree.evaluate(targets,theta=0.7)
+
+    """
+
+    def __init__(self,pos,mass,leaf_size=LEAF_SIZE):
+        pos=np.asarray(pos,dtype='float64')
+        mass=np.broadcast_to(np.asarray(mass,dtype='float64'),(len(pos),))
+        self.leaf_size=leaf_size
+
+        lower=np.min(pos,axis=0)
+        size=np.max(np.max(pos,axis=0)-lower)*(1.+1e-7)
+        if size == 0:
+            size=1.
+        self.lower=lower
+        self.extent=size
+        key=morton_keys(pos,lower,size)
+        self.order=np.argsort(key,kind='mergesort')
+        key=key[self.order]
+        self.pos=pos[self.order]
+        self.mass=mass[self.order]
+
+        ##cells of each level, kept if their parent is split
+        starts=[np.zeros(1,dtype='int64')]
+        ends=[np.array([len(pos)],dtype='int64')]
+        levels=[np.zeros(1,dtype='int64')]
+        parents=[np.array([-1],dtype='int64')]
+        split=[ends[0]-starts[0] > leaf_size]
+        first_node=[0]
+        level=0
+        while np.any(split[-1]) and level < MAX_LEVEL:
+            level+=1
+            ##particles of the split cells, and the first particle of each new cell
+            s=starts[-1][split[-1]]
+            e=ends[-1][split[-1]]
+            ind=_concatenate_ranges(s,e)
+            prefix=key[ind] >> np.uint64(3*(MAX_LEVEL-level))
+            new=np.ones(len(ind),dtype=bool)
+            new[1:]=prefix[1:] != prefix[:-1]
+            new[np.cumsum(e-s)[:-1]]=True #a new parent always starts a new cell
+            cell_start=ind[new]
+            cell_end=np.append(cell_start[1:],0)
+            last=np.cumsum(e-s)-1 #last particle of each parent in ind
+            cell_end[np.searchsorted(cell_start,ind[last],side='right')-1]=ind[last]+1
+            parent_ind=np.flatnonzero(split[-1])+first_node[-1]
+            parent=parent_ind[np.searchsorted(s,cell_start,side='right')-1]
+
+            first_node.append(first_node[-1]+len(starts[-1]))
+            starts.append(cell_start)
+            ends.append(cell_end)
+            levels.append(np.repeat(level,len(cell_start)))
+            parents.append(parent)
+            split.append(cell_end-cell_start > leaf_size)
+
+        self.start=np.concatenate(starts)
+        self.end=np.concatenate(ends)
+        self.level=np.concatenate(levels)
+        parent=np.concatenate(parents)
+        self.leaf=~np.concatenate(split)
+        if level == MAX_LEVEL: #identical keys : the last level has only leaves
+            self.leaf[first_node[-1]:]=True
+
+        ##children are contiguous since the nodes of a level are sorted by key
+        nnodes=len(self.start)
+        self.child_start=np.searchsorted(parent[1:],np.arange(nnodes),side='left')+1
+        self.child_end=np.searchsorted(parent[1:],np.arange(nnodes),side='right')+1
+
+        ##monopole of each node, and distance between the center of mass and the geometric center
+        self.node_mass=_sum_ranges(self.mass,self.start,self.end)
+        self.com=_sum_ranges(self.pos*self.mass[:,None],self.start,self.end)/self.node_mass[:,None]
+        self.size=size/2.**self.level
+        corner=self.pos[self.start]-lower
+        corner=np.floor(corner/self.size[:,None])*self.size[:,None]+lower
+        self.delta=np.sqrt(np.sum((self.com-corner-self.size[:,None]/2.)**2,axis=1))
+
+        ##one contiguous array per axis, faster to gather and reduce during the walk
+        self._pos_axes=[np.ascontiguousarray(self.pos[:,i]) for i in range(3)]
+        self._com_axes=[np.ascontiguousarray(self.com[:,i]) for i in range(3)]
+
+
+    def evaluate(self,targets=None,theta=0.5,softening=0.,G=UnitGravity,potential=True,acceleration=True,nthreads=None):
+        """Compute the potential and the acceleration at the position of targets
+
+        A node is accepted if its distance to the target is larger than size/theta + delta, where delta is the distance between its center of mass and its geometric center (Barnes 1994). Its mass is then taken at its center of mass.
+
+        Parameters:
+        ----------
+
+        targets : float array [M,3]
+            positions where the potential is computed. Default is the position of the particles of the tree, without the interaction of a particle with itself.
+
+        theta : float
+            opening angle. 0 gives the direct sum.
+
+        softening : float
+            Plummer softening length : phi=-G*m/sqrt(r**2+softening**2)
+
+        G : float
+            gravitational constant. Default is in Gadget units (see units.common).
+
+        potential, acceleration : boolean
+            quantities to compute
+
+        nthreads : integer
+            number of threads. Default is the number of cores.
+
+
+        Returns (phi,acc) : potential [M] and acceleration [M,3] (None if not computed). With the default targets, they are in the order of the particles given to the tree.
+        """
+
+        if targets is None:
+            targets=self.pos
+            self_index=np.arange(len(self.pos))
+        else: #sorted along the Morton curve, so that the groups of targets are compact
+            targets=np.atleast_2d(np.asarray(targets,dtype='float64'))
+            target_order=np.argsort(morton_keys(targets,self.lower,self.extent),kind='mergesort')
+            targets=targets[target_order]
+            self_index=None
+        m=len(targets)
+        batches=[slice(i,min(i+TARGETS_PER_BATCH,m)) for i in range(0,m,TARGETS_PER_BATCH)]
+
+        def _batch(b):
+            return self._walk(targets[b],None if self_index is None else self_index[b],
+                              theta,softening**2,potential,acceleration)
+
+        nthreads=cpu_count() if nthreads is None else nthreads
+        if nthreads > 1 and len(batches) > 1:
+            pool=ThreadPool(min(nthreads,len(batches)))
+            try:
+                results=pool.map(_batch,batches)
+            finally:
+                pool.close()
+        else:
+            results=[_batch(b) for b in batches]
+
+        ##back to the order of the input
+        order=self.order if self_index is not None else target_order
+        phi=None
+        acc=None
+        if potential:
+            phi=np.empty(m)
+            phi[order]=np.concatenate([r[0] for r in results])*(-G)
+        if acceleration:
+            acc=np.empty((m,3))
+            acc[order]=np.concatenate([r[1] for r in results])*(-G)
+        return phi,acc
+
+
+    def potential(self,targets=None,theta=0.5,softening=0.,G=UnitGravity,nthreads=None):
+        """Return the potential at the position of targets (see evaluate)"""
+
+        return self.evaluate(targets,theta,softening,G,acceleration=False,nthreads=nthreads)[0]
+
+
+    def acceleration(self,targets=None,theta=0.5,softening=0.,G=UnitGravity,nthreads=None):
+        """Return the acceleration at the position of targets (see evaluate)"""
+
+        return self.evaluate(targets,theta,softening,G,potential=False,nthreads=nthreads)[1]
+
+
+    def _walk(self,targets,self_index,theta,eps2,potential,acceleration):
+        """Walk the tree for a batch of targets (neighbours along the Morton curve). Return -phi/G and -acc/G.
+        """
+
+        m=len(targets)
+        phi=np.zeros(m)
+        acc=np.zeros((m,3))
+
+        ##groups of targets : center and radius of a sphere containing all the targets of the group
+        group_start=np.arange(0,m,GROUP_SIZE)
+        group_end=np.minimum(group_start+GROUP_SIZE,m)
+        ntargets=group_end-group_start
+        group_center=_sum_ranges(targets,group_start,group_end)/ntargets[:,None]
+        d=targets-np.repeat(group_center,ntargets,axis=0)
+        group_radius=np.maximum.reduceat(np.sqrt(np.sum(d*d,axis=1)),group_start)
+
+        ##interaction list of each group
+        accepted=[]
+        leaves=[]
+        group=np.arange(len(group_start))
+        node=np.zeros(len(group),dtype='int64')
+        while len(group) > 0:
+            r2=np.zeros(len(node))
+            for i in range(3):
+                r2+=(self._com_axes[i][node]-group_center[group,i])**2
+            r=np.sqrt(r2)-group_radius[group] #distance to the closest possible target
+            if theta > 0:
+                accept=r > self.size[node]/theta+self.delta[node]
+            else:
+                accept=np.zeros(len(group),dtype=bool)
+            leaf=~accept & self.leaf[node]
+            accepted.append((group[accept],node[accept]))
+            leaves.append((group[leaf],node[leaf]))
+
+            ##other nodes : replaced by their children
+            opened=~(accept | leaf)
+            group=group[opened]
+            node=node[opened]
+            group=np.repeat(group,self.child_end[node]-self.child_start[node])
+            node=_concatenate_ranges(self.child_start[node],self.child_end[node])
+
+        def _expand(pairs):
+            ##(group,node) pairs into (target,node) pairs
+            group=np.concatenate([g for g,n in pairs])
+            node=np.concatenate([n for g,n in pairs])
+            target=_concatenate_ranges(group_start[group],group_end[group])
+            return target,np.repeat(node,ntargets[group])
+
+        target_axes=[np.ascontiguousarray(targets[:,i]) for i in range(3)]
+
+        def _add(t,source,s,mass):
+            ##Plummer softened monopoles of the sources s : dx points from the target to the source
+            dx=[source[i][s]-target_axes[i][t] for i in range(3)]
+            r2=dx[0]*dx[0]
+            r2+=dx[1]*dx[1]
+            r2+=dx[2]*dx[2]
+            r2+=eps2
+            inv_r=1./np.sqrt(r2)
+            inv_r*=mass
+            if potential:
+                phi[:]+=np.bincount(t,weights=inv_r,minlength=m)
+            if acceleration:
+                inv_r/=r2
+                for i in range(3):
+                    dx[i]*=inv_r
+                    acc[:,i]-=np.bincount(t,weights=dx[i],minlength=m)
+
+        ##accepted nodes : monopole at their center of mass
+        t,node=_expand(accepted)
+        if len(t) > 0:
+            _add(t,self._com_axes,node,self.node_mass[node])
+
+        ##leaves : direct sum on their particles
+        t,node=_expand(leaves)
+        if len(t) > 0:
+            count=self.end[node]-self.start[node]
+            p=_concatenate_ranges(self.start[node],self.end[node])
+            t=np.repeat(t,count)
+            if self_index is not None:
+                other=p != self_index[t]
+                p=p[other]
+                t=t[other]
+            _add(t,self._pos_axes,p,self.mass[p])
+
+        return phi,acc
+
+
+
+def potential(pos,mass,targets=None,theta=0.5,softening=0.,G=UnitGravity,nthreads=None):
+    """Return the gravitational potential of the particles (pos,mass) at the position of targets, with a Barnes-Hut tree
+
+    Parameters:
+    ----------
+
+    pos : float array [N,3]
+        cartesian coordinates
+
+    mass : float array [N]
+        masses
+
+    targets, theta, softening, G, nthreads :
+        see GravityTree.evaluate. Default targets are the particles themselves.
+
+
+    Example:
+    -------
+
+    >>> phi=potential(pos,mass,softening=0.1) #in Gadget units, like the POT block
+    >>> bound=0.5*np.sum(vel**2,axis=1)+phi < 0
+
+    """
+
+    return GravityTree(pos,mass).potential(targets,theta,softening,G,nthreads)
+
+
+
+def acceleration(pos,mass,targets=None,theta=0.5,softening=0.,G=UnitGravity,nthreads=None):
+    """Return the gravitational acceleration due to the particles (pos,mass) at the position of targets, with a Barnes-Hut tree
+
+    Parameters:
+    ----------
+
+    see potential
+
+    """
+
+    return GravityTree(pos,mass).acceleration(targets,theta,softening,G,nthreads)
@@ -0,0 +1,371 @@
+###NAME: registry.py
+###PURPOSE: registry of the derived fields and their dependencies : a request for several fields is planned as one graph and evaluated chunk by chunk
+
+import numpy as np
+from readers.common import _particle_type
+from geometry.coordinates import change_coordinates
+from geometry.periodic import recenter
+from physics.fields import specific_angular_momentum
+from physics.thermodynamics import thermodynamics, FIELDS as THERMODYNAMIC_FIELDS
+
+
+CHUNK_ROWS = 2**20 #number of particles evaluated at once
+DEFAULT_PARAMETERS = {"center":(0.,0.,0.), "boxsize":None, "Xh":0.76}
+
+
+
+class FieldPlan(object):
+    """Evaluation order of a set of derived fields (see FieldRegistry.plan)
+
+    Attributes:
+    ----------
+
+    fields : list of string
+        requested fields
+
+    blocks : list of string
+        raw blocks read from the snapshot (each one once)
+
+    steps : list of string
+        derived fields to compute, in an order where each field comes after its dependencies (each one once)
+
+    release : list of list of string
+        values which are not needed anymore after each step, and can be freed
+
+    parameters : list of string
+        parameters used by the fields (eg.: center, boxsize)
+
+    """
+
+    def __init__(self,fields,blocks,steps,release,parameters):
+        self.fields=fields
+        self.blocks=blocks
+        self.steps=steps
+        self.release=release
+        self.parameters=parameters
+
+
+    def __repr__(self):
+        return "FieldPlan(blocks="+str(self.blocks)+", steps="+str(self.steps)+")"
+
+
+
+class FieldRegistry(object):
+    """Registry of derived fields, each declaring the raw blocks and the other fields it depends on
+
+    A request for several fields is planned as a single graph : each raw block is read once, the shared intermediate fields (eg.: the recentered positions, the radius) are computed once, and the evaluation runs chunk by chunk, each intermediate being freed as soon as no other field needs it. Any name which is not registered is a raw block of the snapshot.
+
+    Example:
+    -------
+
+    >>> FIELDS.register("v2",lambda vel:np.einsum('ij,ij->i',vel,vel),["VEL"])
+    >>> FIELDS.plan(["T","j_z","v_r"])
+    FieldPlan(blocks=['NE', 'POS', 'U', 'VEL'], steps=['temperature', 'pos', 'j_z', 'r', 'v_r'])
+    >>> FIELDS.plan(["T"],available=["POS","U"]) #no cooling : fully ionized gas
+    FieldPlan(blocks=['U'], steps=['temperature'])
+
+    """
+
+    def __init__(self):
+        self.functions={}
+        self.dependencies={}
+        self.field_parameters={}
+        self.optional={}
+        self.aliases={}
+
+
+    def register(self,name,function,depends,parameters=(),optional=()):
+        """Register a derived field
+
+        Parameters:
+        ----------
+
+        name : string
+            name of the field
+
+        function : function
+            compute the field of a chunk of particles : function(*depends,**parameters), each dependency being an array with one row per particle
+
+        depends : list of string
+            raw blocks ('POS','VEL','U'...) and other fields used by the function, in the order of its arguments
+
+        parameters : list of string
+            keyword parameters of the function (eg.: 'center', 'boxsize', 'Xh')
+
+        optional : list of string
+            raw blocks of depends which may be missing from the snapshot (eg.: 'NE' without cooling) : the function then gets None
+
+        """
+
+        self.functions[name]=function
+        self.dependencies[name]=list(depends)
+        self.field_parameters[name]=tuple(parameters)
+        self.optional[name]=tuple(optional)
+
+
+    def alias(self,name,target):
+        """Give another name to a field (eg.: 'T' for 'temperature')"""
+        self.aliases[name]=target
+
+
+    def _resolve(self,name):
+        return self.aliases.get(name,name)
+
+
+    def __contains__(self,name):
+        return self._resolve(name) in self.functions
+
+
+    def parameters(self,name):
+        """Return all the parameters a field depends on, through its dependencies"""
+
+        name=self._resolve(name)
+        if name not in self.functions:
+            return ()
+        result=set(self.field_parameters[name])
+        for d in self.dependencies[name]:
+            result.update(self.parameters(d))
+        return tuple(sorted(result))
+
+
+    def plan(self,fields,available=None):
+        """Order the evaluation of several fields and of their dependencies, see FieldPlan
+
+        Parameters:
+        ----------
+
+        fields : list of string
+            derived fields or raw blocks
+
+        available : list of string
+            blocks of the snapshot. The optional blocks missing from it are not read (see register). Default is to read all of them.
+
+
+        COMMENTS : raises ValueError if the dependencies contain a cycle.
+        """
+
+        steps=[]
+        blocks=[]
+        state={} #name -> 1 while its dependencies are visited, 2 when done
+
+        def _visit(name):
+            if state.get(name) == 2:
+                return
+            if state.get(name) == 1:
+                raise ValueError("cyclic dependency of the derived field "+name)
+            if name not in self.functions: #raw block
+                state[name]=2
+                blocks.append(name)
+                return
+            state[name]=1
+            for d in self.dependencies[name]:
+                if available is not None and d in self.optional[name] and d not in available:
+                    continue
+                _visit(self._resolve(d))
+            state[name]=2
+            steps.append(name)
+
+        names=[self._resolve(f) for f in fields]
+        for name in names:
+            _visit(name)
+
+        ##last step using each value : it can be freed after this step (the requested ones are copied to the output first)
+        last={}
+        for k,name in enumerate(steps):
+            for d in self.dependencies[name]:
+                if self._resolve(d) in state: #not the optional blocks left out
+                    last[self._resolve(d)]=k
+        release=[[] for name in steps]
+        for name,k in last.items():
+            release[k].append(name)
+        for k,name in enumerate(steps):
+            if name not in last:
+                release[k].append(name)
+
+        parameters=set()
+        for name in names:
+            parameters.update(self.parameters(name))
+
+        return FieldPlan(list(fields),sorted(blocks),steps,release,sorted(parameters))
+
+
+    def evaluate(self,snap,ptype,fields,start=0,stop=None,chunk_rows=CHUNK_ROWS,out=None,**parameters):
+        """Compute several derived fields of the particles ptype in a single pass over the snapshot
+
+        Parameters:
+        ----------
+
+        snap : snapshot
+            opened snapshot (see readers.snapfile.open_snapshot) or readers.snapshot.Snapshot
+
+        ptype : integer or string
+            particle type
+
+        fields : list of string
+            fields to compute (derived fields or raw blocks)
+
+        start, stop : integer
+            range of particles
+
+        chunk_rows : integer
+            number of particles evaluated at once : the raw blocks and the intermediate fields only exist for one chunk
+
+        out : dictionary of array
+            output arrays for some of the fields (eg.: memmaps)
+
+        **parameters :
+            parameters of the fields (center, boxsize, Xh...), see DEFAULT_PARAMETERS
+
+
+        Returns a dictionary with an array per requested field.
+
+        Example:
+        -------
+
+        >>> result=FIELDS.evaluate(snap,"gas",["T","j_z","v_r"],center=center)
+        >>> T=result["T"]
+
+        """
+
+        plan=self.plan(fields,snap.blocks())
+        ptype=_particle_type(ptype)
+        stop=snap.npart(ptype) if stop is None else stop
+        output={} if out is None else dict(out)
+
+        for first in range(start,stop,chunk_rows):
+            last=min(first+chunk_rows,stop)
+            chunk=dict((b,np.asarray(snap.read(b,ptype,first,last))) for b in plan.blocks)
+            for name,value in self.compute(chunk,plan,**parameters).items():
+                if name not in output: #allocated with the first chunk
+                    output[name]=np.empty((stop-start,)+np.shape(value)[1:],dtype=value.dtype)
+                output[name][first-start:last-start]=value
+
+        return output
+
+
+    def compute(self,chunk,plan,**parameters):
+        """Compute the fields of a plan for one chunk of particles already read
+
+        Parameters:
+        ----------
+
+        chunk : dictionary of array
+            raw blocks of the plan (plan.blocks) for the same particles. The optional blocks missing from the chunk are passed as None.
+
+        plan : FieldPlan
+            see plan
+
+        **parameters :
+            parameters of the fields (center, boxsize, Xh...), see DEFAULT_PARAMETERS
+
+
+        Returns a dictionary with an array per requested field. The intermediate fields are freed as soon as they are not needed anymore.
+        """
+
+        values=dict(DEFAULT_PARAMETERS)
+        values.update(parameters)
+        chunk=dict(chunk)
+        requested={}
+        for f in plan.fields:
+            requested.setdefault(self._resolve(f),[]).append(f)
+
+        result={}
+        for k,name in enumerate(plan.steps):
+            args=[chunk.get(d) if d in self.optional[name] else chunk[self._resolve(d)] for d in self.dependencies[name]]
+            kwargs=dict((p,values[p]) for p in self.field_parameters[name])
+            chunk[name]=self.functions[name](*args,**kwargs)
+            for r in plan.release[k]:
+                value=chunk.pop(r)
+                for f in requested.get(r,[]):
+                    result[f]=value
+
+        for name,value in chunk.items(): #raw blocks requested but not used by any field
+            for f in requested.get(name,[]):
+                result[f]=value
+        return result
+
+
+## BUILT-IN FIELDS
+## positions and velocities are relative to center (nearest periodic image if boxsize is given)
+
+def _zero_where(mask,x):
+    x[mask]=0.
+    return x
+
+
+def _radius(pos):
+    return np.sqrt(np.einsum('ij,ij->i',pos,pos))
+
+
+def _cylindrical_radius(pos):
+    return np.hypot(pos[:,0],pos[:,1])
+
+
+def _radial_velocity(pos,vel,r):
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return _zero_where(r == 0,np.einsum('ij,ij->i',pos,vel)/r)
+
+
+def _cylindrical_radial_velocity(pos,vel,R):
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return _zero_where(R == 0,(pos[:,0]*vel[:,0]+pos[:,1]*vel[:,1])/R)
+
+
+def _azimuthal_velocity(pos,vel,R):
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return _zero_where(R == 0,(pos[:,0]*vel[:,1]-pos[:,1]*vel[:,0])/R)
+
+
+def _angular_momentum_component(i):
+    a,b=(i+1)%3,(i+2)%3
+    def _component(pos,vel):
+        return pos[:,a]*vel[:,b]-pos[:,b]*vel[:,a]
+    return _component
+
+
+def _thermodynamic_field(name,blocks):
+    def _field(*args,**parameters):
+        values=dict(zip(blocks,args))
+        return thermodynamics(values["U"],values.get("NE"),values.get("RHO"),fields=(name,),**parameters)[name]
+    return _field
+
+
+## raw blocks of each thermodynamic field (see physics.thermodynamics) : without NE, the gas is fully ionized
+THERMODYNAMIC_BLOCKS = {"mu":["U","NE"], "temperature":["U","NE"], "pressure":["U","RHO"], "entropy":["U","RHO"],
+                        "number_density":["U","NE","RHO"]}
+
+
+FIELDS = FieldRegistry() #default registry
+
+FIELDS.register("pos",lambda pos,center,boxsize: recenter(pos,center,boxsize),["POS"],("center","boxsize"))
+FIELDS.register("r",_radius,["pos"])
+FIELDS.register("R",_cylindrical_radius,["pos"])
+FIELDS.register("pos_sph",lambda pos: change_coordinates(pos,"pos","cart","sph"),["pos"])
+FIELDS.register("pos_cyl",lambda pos: change_coordinates(pos,"pos","cart","cyl"),["pos"])
+FIELDS.register("vel_sph",lambda pos,vel: change_coordinates(pos,"vel","cart","sph",vel),["pos","VEL"])
+FIELDS.register("vel_cyl",lambda pos,vel: change_coordinates(pos,"vel","cart","cyl",vel),["pos","VEL"])
+FIELDS.register("v_r",_radial_velocity,["pos","VEL","r"])
+FIELDS.register("v_R",_cylindrical_radial_velocity,["pos","VEL","R"])
+FIELDS.register("v_phi",_azimuthal_velocity,["pos","VEL","R"])
+FIELDS.register("v_z",lambda vel: vel[:,2],["VEL"])
+FIELDS.register("j",specific_angular_momentum,["pos","VEL"])
+for _i,_axis in enumerate("xyz"):
+    FIELDS.register("j_"+_axis,_angular_momentum_component(_i),["pos","VEL"])
+for _name in THERMODYNAMIC_FIELDS:
+    FIELDS.register(_name,_thermodynamic_field(_name,THERMODYNAMIC_BLOCKS[_name]),THERMODYNAMIC_BLOCKS[_name],("Xh",),optional=("NE",))
+FIELDS.alias("T","temperature")
+
+
+
+def evaluate(snap,ptype,fields,**kwargs):
+    """Compute several derived fields in a single pass over the snapshot with the default registry (see FieldRegistry.evaluate)
+
+    Example:
+    -------
+
+    >>> result=evaluate(snap,"gas",["T","j_z","v_r"],center=center) #POS, VEL, U and NE (if present) are read once
+    >>> profile.mean(result["v_r"],result["T"],bins)
+
+    """
+
+    return FIELDS.evaluate(snap,ptype,fields,**kwargs)
@@ -0,0 +1,144 @@
+###NAME: thermodynamics.py
+###PURPOSE: gas temperature, pressure, entropy and number density in cgs, directly from the Gadget blocks U, NE and RHO
+
+import numpy as np
+from units.common import PROTON_MASS, ADIABATIC_INDEX, BOLTZMANN_CONSTANT, \
+     UnitLength, UnitMass, UnitVelocity
+from internals.sanity_check import _check_if_keyword_is_correct
+from internals.dtypes import _float_dtype
+
+
+FIELDS     = ["mu","temperature","pressure","entropy","number_density"]
+BLOCK_ROWS = 32768 #number of particles computed at once : the temporaries of a block stay in cache
+
+## conversion factors from the Gadget units, merged with the physical constants
+_U_CGS   = UnitVelocity**2                                       #specific internal energy
+_RHO_CGS = UnitMass/UnitLength**3                                #density
+_U2T     = PROTON_MASS*(ADIABATIC_INDEX-1.)/BOLTZMANN_CONSTANT*_U_CGS #temperature = _U2T*mu*u
+
+
+
+def thermodynamics(u,ne=None,rho=None,Xh=0.76,fields=("temperature",),out=None):
+    """Compute the thermodynamic quantities of the gas in cgs, from the raw Gadget blocks, in one pass
+
+    The particles are processed by blocks of BLOCK_ROWS : the mean molecular weight and the other intermediate quantities only exist for one block, and the constants (physical constants and Gadget units) are merged into a single factor per field. float32 inputs give float32 outputs.
+
+    Parameters:
+    ----------
+
+    u : float array
+        specific internal energy in Gadget units (block U)
+
+    ne : float array
+        electron abundance (block NE). If None, the gas is assumed fully ionized (adiabatic case, as mean_molecular_weight).
+
+    rho : float array
+        density in Gadget units (block RHO). Needed for pressure, entropy and number_density.
+
+    Xh : float or float array
+        hydrogen mass fraction
+
+    fields : list of string
+        quantities to compute, among ["mu", "temperature", "pressure", "entropy", "number_density"] :
+        mu             : mean molecular weight
+        temperature    : temperature in K
+        pressure       : (gamma-1)*rho*u in erg/cm^3
+        entropy        : entropic function P/rho^gamma in cgs
+        number_density : rho/(mu*m_p) in cm^-3
+
+    out : dictionary of float array
+        output arrays for some of the fields (eg.: memmaps)
+
+
+    Returns a dictionary of arrays.
+
+    Example:
+    -------
+
+    >>> gas=thermodynamics(snap.block("U","gas"),snap.block("NE","gas"),snap.block("RHO","gas"),fields=("temperature","number_density"))
+    >>> histogram([gas["number_density"],gas["temperature"]],[LogBins(1e-6,1e4,100),LogBins(10,1e8,100)])
+
+    """
+
+    for f in fields:
+        _check_if_keyword_is_correct(f,FIELDS)
+    if rho is None and any(f in fields for f in ("pressure","entropy","number_density")):
+        raise ValueError("rho is needed to compute the pressure, the entropy and the number density")
+
+    n=len(u)
+    dtype=_float_dtype(u) if rho is None else _float_dtype(u,rho)
+    out={} if out is None else dict(out)
+    for f in fields:
+        if f not in out:
+            out[f]=np.empty(n,dtype=dtype)
+    gamma=ADIABATIC_INDEX
+
+    for start in range(0,n,BLOCK_ROWS):
+        stop=min(start+BLOCK_ROWS,n)
+        ub=np.asarray(u[start:stop]).astype(dtype,copy=False)
+        x=Xh if np.ndim(Xh) == 0 else np.asarray(Xh[start:stop]).astype(dtype,copy=False)
+
+        ##mean molecular weight : (1+4y)/(1+y+ne) with y=(1-X)/(4X), or fully ionized
+        y=(1.-x)/(4.*x)
+        if ne is None:
+            mu=np.empty(stop-start,dtype=dtype)
+            mu[:]=(1.+4.*y)/(2.+3.*y)
+        else:
+            mu=np.asarray(ne[start:stop]).astype(dtype)
+            mu+=1.+y
+            np.divide(1.+4.*y,mu,out=mu)
+        if "mu" in fields:
+            out["mu"][start:stop]=mu
+
+        if "temperature" in fields:
+            t=out["temperature"][start:stop]
+            np.multiply(ub,mu,out=t)
+            t*=_U2T
+
+        if rho is not None:
+            rb=np.asarray(rho[start:stop]).astype(dtype,copy=False)
+            if "pressure" in fields:
+                p=out["pressure"][start:stop]
+                np.multiply(rb,ub,out=p)
+                p*=(gamma-1.)*_RHO_CGS*_U_CGS
+            if "entropy" in fields: #(gamma-1)*u*rho^(1-gamma), without the tiny rho^gamma
+                s=out["entropy"][start:stop]
+                np.power(rb,1.-gamma,out=s)
+                s*=ub
+                s*=(gamma-1.)*_U_CGS*_RHO_CGS**(1.-gamma)
+            if "number_density" in fields:
+                nd=out["number_density"][start:stop]
+                np.divide(rb,mu,out=nd)
+                nd*=_RHO_CGS/PROTON_MASS
+
+    return out
+
+
+
+def gas_temperature(u,ne=None,Xh=0.76,out=None):
+    """Return the temperature in K from the raw Gadget blocks U and NE, in one pass (see thermodynamics)
+
+    Parameters:
+    ----------
+
+    u : float array
+        specific internal energy in Gadget units (block U)
+
+    ne : float array
+        electron abundance (block NE). If None, the gas is assumed fully ionized.
+
+    Xh : float or float array
+        hydrogen mass fraction
+
+    out : float array
+        output array
+
+
+    Example:
+    -------
+
+    >>> T=gas_temperature(snap.block("U","gas"),snap.block("NE","gas"))
+
+    """
+
+    return thermodynamics(u,ne,Xh=Xh,fields=("temperature",),out=None if out is None else {"temperature":out})["temperature"]
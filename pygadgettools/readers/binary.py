@@ -0,0 +1,233 @@
+###NAME: binary.py
+###PURPOSE: memory-mapped reader for Gadget binary snapshots (SnapFormat 1 and 2)
+
+import numpy as np
+from readers.common import NTYPES, VECTOR_BLOCKS, BLOCK_TYPES, CHUNK_BYTES, _particle_type
+
+
+## order of the blocks in SnapFormat=1 files, which have no block names
+BLOCK_ORDER         = ["HEAD","POS","VEL","ID","MASS","U","RHO","HSML"]
+BLOCK_ORDER_COOLING = ["HEAD","POS","VEL","ID","MASS","U","RHO","NE","NH","HSML"]
+
+## layout of the 256 bytes header
+HEADER_FIELDS = [("NumPart_ThisFile",          "i4", 6),
+                 ("MassTable",                 "f8", 6),
+                 ("Time",                      "f8", 1),
+                 ("Redshift",                  "f8", 1),
+                 ("Flag_Sfr",                  "i4", 1),
+                 ("Flag_Feedback",             "i4", 1),
+                 ("NumPart_Total",             "u4", 6),
+                 ("Flag_Cooling",              "i4", 1),
+                 ("NumFilesPerSnapshot",       "i4", 1),
+                 ("BoxSize",                   "f8", 1),
+                 ("Omega0",                    "f8", 1),
+                 ("OmegaLambda",               "f8", 1),
+                 ("HubbleParam",               "f8", 1),
+                 ("Flag_StellarAge",           "i4", 1),
+                 ("Flag_Metals",               "i4", 1),
+                 ("NumPart_Total_HighWord",    "u4", 6),
+                 ("Flag_Entropy_ICs",          "i4", 1)]
+
+
+
+class GadgetBinaryFile(object):
+    """Gadget binary snapshot (SnapFormat 1 or 2) whose blocks are exposed as memory maps.
+
+    Nothing is read at opening except the header and the record markers. Each block is returned as a np.memmap view, so only the pages actually used by a computation are read from disk, and they are shared through the page cache with every other process reading the same file.
+
+    Parameters:
+    ----------
+
+    filename : string
+        path of the snapshot file
+
+    block_order : list of string
+        order of the blocks for SnapFormat=1 files (ignored for SnapFormat=2). Use BLOCK_ORDER_COOLING for runs with cooling, which have the NE and NH blocks.
+
+
+    Example:
+    -------
+
+    >>> snap=GadgetBinaryFile("snapshot_000")
+    >>> pos=snap.block("POS","gas") #np.memmap [N,3], nothing read yet
+    >>> z=pos[:,2]
+
+    """
+
+    def __init__(self,filename,block_order=BLOCK_ORDER):
+        self.filename=filename
+        self._maps={}
+        self._records={}
+        self._scan_records(block_order)
+
+
+    def _scan_records(self,block_order):
+        """Walk through the Fortran records of the file, read the header and save the position of each block
+        """
+
+        with open(self.filename,'rb') as f:
+            ##the first marker is 256 (header) for SnapFormat=1 and 8 (block name) for SnapFormat=2
+            first=np.fromfile(f,dtype='<i4',count=1)[0]
+            for endian,value in (('<',first),('>',first.byteswap())):
+                if value in (8,256):
+                    self.endian=endian
+                    self.format=2 if value == 8 else 1
+                    break
+            else:
+                raise IOError(self.filename+" is not a Gadget binary snapshot.")
+
+            marker=np.dtype(self.endian+'i4')
+            f.seek(0,2)
+            filesize=f.tell()
+            f.seek(0)
+            names=list(block_order)
+            while f.tell() < filesize:
+                if self.format == 2: #a small record with the name of the next block
+                    f.seek(4,1)
+                    name=str(f.read(4).decode('ascii').strip())
+                    f.seek(8,1)
+                else:
+                    ##blocks without any particle are not written
+                    while len(names) > 0 and names[0] != "HEAD" and len(self._types_in_block(names[0])) == 0:
+                        names.pop(0)
+                    if len(names) == 0:
+                        break
+                    name=names.pop(0)
+
+                size=np.fromfile(f,dtype=marker,count=1)[0]
+                self._records[name]=(f.tell(),int(size))
+                if name == "HEAD":
+                    self.header=self._parse_header(f)
+                f.seek(self._records[name][0]+int(size))
+                if np.fromfile(f,dtype=marker,count=1)[0] != size:
+                    raise IOError("Inconsistent record markers for block "+name+" in "+self.filename)
+
+        if "HEAD" not in self._records:
+            raise IOError("No header found in "+self.filename)
+
+
+    def _parse_header(self,f):
+        """Read the header at the current position of the file f
+        """
+
+        dtype=np.dtype([(name,self.endian+fmt,(n,)) if n > 1 else (name,self.endian+fmt)
+                        for name,fmt,n in HEADER_FIELDS])
+        raw=np.fromfile(f,dtype=dtype,count=1)[0]
+        return dict((name,np.array(raw[name]).astype(fmt)) for name,fmt,n in HEADER_FIELDS)
+
+
+    def npart(self,ptype):
+        """Number of particles of type ptype in this file"""
+        return int(self.header["NumPart_ThisFile"][_particle_type(ptype)])
+
+
+    def _types_in_block(self,name):
+        """Return the list of particle types stored in the block name
+        """
+
+        npart=self.header["NumPart_ThisFile"]
+        if name == "MASS":
+            return [t for t in range(NTYPES) if npart[t] > 0 and self.header["MassTable"][t] == 0]
+        types=BLOCK_TYPES.get(name,range(NTYPES))
+        return [t for t in types if npart[t] > 0]
+
+
+    def blocks(self):
+        """Return the list of blocks available in the file"""
+        names=sorted(self._records,key=lambda name:self._records[name][0]) #order in the file
+        return [name for name in names if name != "HEAD"]
+
+
+    def _memmap(self,name):
+        """Return a np.memmap of the whole block and the offset of each particle type inside the block
+        """
+
+        if name not in self._maps:
+            if name not in self._records:
+                raise KeyError(name+" must be ["+", ".join(self.blocks())+"]")
+
+            offset,size=self._records[name]
+            types=self._types_in_block(name)
+            npart=self.header["NumPart_ThisFile"]
+            ntot=int(np.sum(npart[types]))
+            ncomp=3 if name in VECTOR_BLOCKS else 1
+            itemsize=size//max(ntot*ncomp,1)
+            kind='u' if name == "ID" else 'f'
+            dtype=np.dtype(self.endian+kind+str(itemsize))
+            shape=(ntot,3) if ncomp == 3 else (ntot,)
+            if ntot > 0:
+                data=np.memmap(self.filename,dtype=dtype,mode='r',offset=offset,shape=shape)
+            else:
+                data=np.zeros(shape,dtype=dtype)
+
+            start={}
+            first=0
+            for t in types:
+                start[t]=first
+                first+=int(npart[t])
+            self._maps[name]=(data,start)
+
+        return self._maps[name]
+
+
+    def block(self,name,ptype):
+        """Return the block name of the particles ptype as a memory map (no copy)
+
+        Parameters:
+        ----------
+
+        name : string
+            name of the block ('POS','VEL','ID','MASS','U','RHO','NE','NH','HSML'...)
+
+        ptype : integer or string
+            particle type (0 to 5, or 'gas','dm','disk','bulge','star','bndry')
+
+
+        COMMENTS : for particle types with a fixed mass in the header, MASS is returned as a read-only broadcast array which takes no memory.
+        """
+
+        ptype=_particle_type(ptype)
+        n=self.npart(ptype)
+        if name == "MASS" and self.header["MassTable"][ptype] > 0:
+            return np.broadcast_to(np.float32(self.header["MassTable"][ptype]),(n,))
+
+        data,start=self._memmap(name)
+        if ptype not in start:
+            raise KeyError("Block "+name+" does not exist for particle type "+str(ptype))
+        return data[start[ptype]:start[ptype]+n]
+
+
+    def read(self,name,ptype,start=0,stop=None,out=None):
+        """Return the rows [start,stop) of a block, as a memory map or copied into out if given.
+        """
+
+        data=self.block(name,ptype)[start:stop]
+        if out is None:
+            return data
+        out[...]=data
+        return out
+
+
+    def chunk_rows(self,name,ptype,chunk_bytes=CHUNK_BYTES):
+        """Number of rows per chunk of about chunk_bytes"""
+
+        data=self.block(name,ptype)
+        row_bytes=data.dtype.itemsize*int(np.prod(data.shape[1:]))
+        return max(chunk_bytes//row_bytes,1)
+
+
+    def iter_chunks(self,name,ptype,chunk_bytes=CHUNK_BYTES):
+        """Iterate over a block by chunks of about chunk_bytes. Yield (start, stop, array).
+        """
+
+        nrows=self.chunk_rows(name,ptype,chunk_bytes)
+        ntot=self.npart(ptype)
+        for start in range(0,ntot,nrows):
+            stop=min(start+nrows,ntot)
+            yield start,stop,self.read(name,ptype,start,stop)
+
+
+    def close(self):
+        """Release the memory maps. Arrays already returned stay valid."""
+        self._maps={}
+
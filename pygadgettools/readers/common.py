@@ -0,0 +1,48 @@
+###NAME: common.py
+###PURPOSE: definitions shared by all the snapshot readers
+
+from internals.sanity_check import _check_if_keyword_is_correct
+
+
+## particle types, following the Gadget convention
+PARTICLE_TYPES = {"gas":0, "dm":1, "disk":2, "bulge":3, "star":4, "bndry":5}
+NTYPES         = 6
+
+CHUNK_BYTES = 64*1024**2 #default size of the chunks returned by iter_chunks
+
+## name of each block in the HDF5 snapshots
+BLOCK_NAMES = {"POS":"Coordinates",
+               "VEL":"Velocities",
+               "ID":"ParticleIDs",
+               "MASS":"Masses",
+               "U":"InternalEnergy",
+               "RHO":"Density",
+               "NE":"ElectronAbundance",
+               "NH":"NeutralHydrogenAbundance",
+               "HSML":"SmoothingLength",
+               "SFR":"StarFormationRate",
+               "AGE":"StellarFormationTime",
+               "Z":"Metallicity",
+               "POT":"Potential",
+               "ACCE":"Acceleration",
+               "TSTP":"TimeStep"}
+GADGET_NAMES = dict((dataset,name) for name,dataset in BLOCK_NAMES.items()) #HDF5 name -> Gadget name
+
+## blocks with 3 components per particle
+VECTOR_BLOCKS = ["POS","VEL","ACCE"]
+
+## blocks only written for some particle types. All other blocks are written for every type.
+BLOCK_TYPES = {"U":[0], "RHO":[0], "NE":[0], "NH":[0], "HSML":[0], "SFR":[0],
+               "AGE":[4], "Z":[0,4]}
+
+
+
+def _particle_type(ptype):
+    """Return the Gadget particle type (integer) from an integer or a name ('gas','dm','disk','bulge','star','bndry')
+    """
+
+    if ptype in range(NTYPES):
+        return int(ptype)
+
+    _check_if_keyword_is_correct(ptype,sorted(PARTICLE_TYPES.keys()))
+    return PARTICLE_TYPES[ptype]
@@ -0,0 +1,133 @@
+###NAME: hdf5.py
+###PURPOSE: lazy reader for Gadget/GIZMO HDF5 snapshots
+
+import numpy as np
+from readers.common import NTYPES, BLOCK_NAMES, GADGET_NAMES, CHUNK_BYTES, _particle_type
+
+try:
+    import h5py
+except ImportError: #h5py is only needed for HDF5 snapshots
+    h5py = None
+
+
+
+class GadgetHDF5File(object):
+    """Gadget/GIZMO HDF5 snapshot whose blocks are read lazily.
+
+    The file is opened once. Each block is returned as a h5py dataset : nothing is read until it is sliced, and slicing reads only the corresponding hyperslab.
+
+    Parameters:
+    ----------
+
+    filename : string
+        path of the snapshot file
+
+
+    Example:
+    -------
+
+    >>> snap=GadgetHDF5File("snapshot_079.hdf5")
+    >>> pos=snap.block("POS","gas") #nothing read yet
+    >>> first=pos[:1000] #read only the first 1000 rows
+    >>> for start,stop,chunk in snap.iter_chunks("POS","gas"):
+    ...     pass
+
+    """
+
+    def __init__(self,filename):
+        if h5py is None:
+            raise ImportError("h5py is required to read HDF5 snapshots.")
+
+        self.filename=filename
+        self._file=h5py.File(filename,'r')
+        self.header=dict((key,np.array(value)) for key,value in self._file["Header"].attrs.items())
+
+
+    def npart(self,ptype):
+        """Number of particles of type ptype in this file"""
+        return int(self.header["NumPart_ThisFile"][_particle_type(ptype)])
+
+
+    def blocks(self,ptype=None):
+        """Return the list of blocks available in the file (for the particle type ptype if given), with the Gadget names ('POS','NE'...) as the binary files, or the HDF5 names for the other blocks"""
+
+        types=range(NTYPES) if ptype is None else [_particle_type(ptype)]
+        names=set()
+        for t in types:
+            group="PartType"+str(t)
+            if group in self._file:
+                names.update(str(GADGET_NAMES.get(dataset,dataset)) for dataset in self._file[group].keys())
+        return sorted(names)
+
+
+    def block(self,name,ptype):
+        """Return the block name of the particles ptype as a lazy array (h5py dataset)
+
+        Parameters:
+        ----------
+
+        name : string
+            name of the block, either the Gadget name ('POS','VEL','MASS','U','NE'...) or the HDF5 name ('Coordinates','Velocities','Masses'...)
+
+        ptype : integer or string
+            particle type (0 to 5, or 'gas','dm','disk','bulge','star','bndry')
+
+
+        COMMENTS : for particle types with a fixed mass in the header, MASS is returned as a read-only broadcast array which takes no memory.
+        """
+
+        ptype=_particle_type(ptype)
+        dataset=BLOCK_NAMES.get(name,name)
+        group="PartType"+str(ptype)
+        if dataset == "Masses" and self.header["MassTable"][ptype] > 0:
+            return np.broadcast_to(np.float32(self.header["MassTable"][ptype]),(self.npart(ptype),))
+
+        if group not in self._file or dataset not in self._file[group]:
+            raise KeyError("Block "+name+" does not exist for particle type "+str(ptype))
+        return self._file[group][dataset]
+
+
+    def read(self,name,ptype,start=0,stop=None,out=None):
+        """Read the rows [start,stop) of a block. If out is given, read directly into it without intermediate copy.
+        """
+
+        data=self.block(name,ptype)
+        stop=len(data) if stop is None else stop
+        if out is None:
+            return np.array(data[start:stop])
+
+        if isinstance(data,np.ndarray): #broadcast masses
+            out[...]=data[start:stop]
+        elif stop > start:
+            data.read_direct(out,source_sel=np.s_[start:stop])
+        return out
+
+
+    def chunk_rows(self,name,ptype,chunk_bytes=CHUNK_BYTES):
+        """Number of rows per chunk : about chunk_bytes, rounded to a multiple of the HDF5 chunk layout
+        """
+
+        data=self.block(name,ptype)
+        if isinstance(data,np.ndarray):
+            return max(len(data),1)
+
+        row_bytes=data.dtype.itemsize*int(np.prod(data.shape[1:]))
+        layout=data.chunks[0] if data.chunks is not None else 1
+        nrows=max(chunk_bytes//row_bytes,1)
+        return max(nrows//layout,1)*layout
+
+
+    def iter_chunks(self,name,ptype,chunk_bytes=CHUNK_BYTES):
+        """Iterate over a block by chunks aligned with the HDF5 chunks. Yield (start, stop, array).
+        """
+
+        nrows=self.chunk_rows(name,ptype,chunk_bytes)
+        ntot=self.npart(ptype)
+        for start in range(0,ntot,nrows):
+            stop=min(start+nrows,ntot)
+            yield start,stop,self.read(name,ptype,start,stop)
+
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
@@ -0,0 +1,142 @@
+###NAME: multifile.py
+###PURPOSE: read snapshots split in several files (NumFilesPerSnapshot > 1)
+
+import numpy as np
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from readers.common import NTYPES, CHUNK_BYTES, _particle_type
+
+
+
+class MultiFileSnapshot(object):
+    """Snapshot split in several files, read as if it was a single file.
+
+    Blocks are read concurrently by a pool of threads, each file being copied directly into its slice of one preallocated output array (no concatenation at the end).
+
+    Parameters:
+    ----------
+
+    files : list of readers
+        opened snapshot files (GadgetBinaryFile or GadgetHDF5File), in the order of the files
+
+    nthreads : integer
+        number of threads used to read the files. Default is min(number of files, number of cores).
+
+
+    Example:
+    -------
+
+    >>> files=get_snapshot_files(79,dir="output")
+    >>> snap=MultiFileSnapshot([open_snapshot(f) for f in files])
+    >>> pos=snap.read("POS","gas")
+
+    """
+
+    def __init__(self,files,nthreads=None):
+        self.files=list(files)
+        self.nthreads=min(len(self.files),cpu_count()) if nthreads is None else nthreads
+
+        self.header=dict(self.files[0].header)
+        self._npart=np.array([[f.npart(t) for t in range(NTYPES)] for f in self.files],dtype='int64')
+        self.header["NumPart_ThisFile"]=np.sum(self._npart,axis=0)
+        self._first=np.cumsum(self._npart,axis=0)-self._npart #index of the first particle of each file
+
+
+    def npart(self,ptype):
+        """Total number of particles of type ptype in all the files"""
+        return int(self.header["NumPart_ThisFile"][_particle_type(ptype)])
+
+
+    def blocks(self,*args):
+        """Return the list of blocks available in the files"""
+
+        names=set()
+        for f in self.files:
+            names.update(f.blocks(*args))
+        return sorted(names)
+
+
+    def _output(self,name,ptype,nrows):
+        """Allocate the output array of a block, with the dtype and shape of the first file having it
+        """
+
+        for i,f in enumerate(self.files):
+            if self._npart[i,ptype] > 0:
+                data=f.block(name,ptype)
+                return np.empty((nrows,)+data.shape[1:],dtype=data.dtype.newbyteorder('='))
+        raise KeyError("No particle of type "+str(ptype))
+
+
+    def read(self,name,ptype,start=0,stop=None,out=None):
+        """Read the rows [start,stop) of a block from all the files concurrently.
+
+        Parameters:
+        ----------
+
+        name : string
+            name of the block ('POS','VEL','MASS'...)
+
+        ptype : integer or string
+            particle type
+
+        start, stop : integer
+            first and last (excluded) rows to read, counted over all the files
+
+        out : array
+            preallocated output. If not given, a new array is allocated.
+
+        """
+
+        ptype=_particle_type(ptype)
+        stop=self.npart(ptype) if stop is None else stop
+        if out is None:
+            out=self._output(name,ptype,stop-start)
+
+        ##part of each file falling in [start,stop)
+        jobs=[]
+        for i,f in enumerate(self.files):
+            first=self._first[i,ptype]
+            lo=max(start,first)
+            hi=min(stop,first+self._npart[i,ptype])
+            if hi > lo:
+                jobs.append((f,lo-first,hi-first,out[lo-start:hi-start]))
+
+        def _read(job):
+            f,lo,hi,dest=job
+            f.read(name,ptype,lo,hi,out=dest)
+
+        if self.nthreads > 1 and len(jobs) > 1:
+            pool=ThreadPool(min(self.nthreads,len(jobs)))
+            try:
+                pool.map(_read,jobs)
+            finally:
+                pool.close()
+        else:
+            for job in jobs:
+                _read(job)
+
+        return out
+
+
+    def block(self,name,ptype):
+        """Return the full block of all the files (read in memory)"""
+        return self.read(name,ptype)
+
+
+    def iter_chunks(self,name,ptype,chunk_bytes=CHUNK_BYTES):
+        """Iterate over a block file by file, by chunks of about chunk_bytes. Yield (start, stop, array) with start and stop counted over all the files.
+        """
+
+        ptype=_particle_type(ptype)
+        for i,f in enumerate(self.files):
+            if self._npart[i,ptype] == 0:
+                continue
+            first=self._first[i,ptype]
+            for start,stop,chunk in f.iter_chunks(name,ptype,chunk_bytes):
+                yield first+start,first+stop,chunk
+
+
+    def close(self):
+        """Close all the files."""
+        for f in self.files:
+            f.close()
@@ -0,0 +1,49 @@
+###NAME: snapfile.py
+###PURPOSE: open a snapshot with the right reader
+
+from readers.binary import GadgetBinaryFile
+from readers.hdf5 import GadgetHDF5File
+from readers.multifile import MultiFileSnapshot
+
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+
+
+def open_snapshot(filename,nthreads=None,**kwargs):
+    """Open a snapshot file, either Gadget binary (SnapFormat 1 or 2) or HDF5
+
+    Parameters:
+    ----------
+
+    filename : string or list of string
+        path of the snapshot file. For a snapshot split in several files, the list of all the files (see names.filename.get_snapshot_files).
+
+    nthreads : integer
+        number of threads used to read a snapshot split in several files
+
+    **kwargs : 
+        other arguments passed to the reader (eg.: block_order for SnapFormat=1)
+
+
+    Example:
+    -------
+
+    >>> snap=open_snapshot("snapshot_079.hdf5")
+    >>> pos=snap.block("POS","gas")
+
+    >>> snap=open_snapshot(get_snapshot_files(79,dir="output")) #snapshot_079.0, snapshot_079.1...
+
+    """
+
+    if isinstance(filename,(list,tuple)):
+        if len(filename) > 1:
+            return MultiFileSnapshot([open_snapshot(f,**kwargs) for f in filename],nthreads=nthreads)
+        filename=filename[0]
+
+    with open(filename,'rb') as f:
+        signature=f.read(len(HDF5_SIGNATURE))
+
+    if signature == HDF5_SIGNATURE:
+        return GadgetHDF5File(filename,**kwargs)
+    else:
+        return GadgetBinaryFile(filename,**kwargs)
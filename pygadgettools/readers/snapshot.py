@@ -0,0 +1,311 @@
+###NAME: snapshot.py
+###PURPOSE: snapshot container : per-type column store of the raw blocks and memory-bounded cache of the derived fields (r, spherical coordinates, temperature...)
+
+import numpy as np
+from readers.common import NTYPES, _particle_type
+from readers.snapfile import open_snapshot
+from internals.cache import LRUCache
+from internals.sanity_check import _check_if_keyword_is_correct
+from geometry.coordinates import change_coordinates, radius
+from geometry.periodic import recenter
+from physics.fields import specific_angular_momentum
+from physics.registry import FIELDS as REGISTRY, CHUNK_ROWS
+
+try:
+    basestring
+except NameError: #python 3
+    basestring = str
+
+COORDINATES = ["cart","cyl","sph"]
+
+
+
+## DERIVED FIELDS
+## each field is computed from the raw columns (and other derived fields) of one particle type : function(snap,ptype,center,coordinates,boxsize)
+
+def _position(snap,ptype,center,coordinates,boxsize):
+    if coordinates == "cart":
+        return recenter(snap.column("POS",ptype),center,boxsize)
+    pos=snap.field("pos",ptype,center,"cart",boxsize)
+    return change_coordinates(pos,"pos","cart",coordinates)
+
+
+def _velocity(snap,ptype,center,coordinates,boxsize):
+    vel=snap.column("VEL",ptype)
+    if coordinates == "cart":
+        return vel
+    pos=snap.field("pos",ptype,center,"cart",boxsize)
+    return change_coordinates(pos,"vel","cart",coordinates,vel)
+
+
+def _radius(snap,ptype,center,coordinates,boxsize):
+    return radius(snap.column("POS",ptype),center,boxsize)
+
+
+def _specific_angular_momentum(snap,ptype,center,coordinates,boxsize):
+    pos=snap.field("pos",ptype,center,"cart",boxsize)
+    j=specific_angular_momentum(pos,snap.column("VEL",ptype))
+    if coordinates != "cart":
+        j=change_coordinates(pos,"vel","cart",coordinates,j,out=j)
+    return j
+
+
+## name -> (function, parameters of the field among center, coordinates and boxsize)
+## the other derived fields (temperature, v_r, j_z...) come from physics.registry.FIELDS
+DERIVED_FIELDS = {"pos":(_position,("center","coordinates","boxsize")),
+                  "vel":(_velocity,("center","coordinates","boxsize")),
+                  "r":(_radius,("center","boxsize")),
+                  "j":(_specific_angular_momentum,("center","coordinates","boxsize"))}
+
+
+class Snapshot(object):
+    """Snapshot with a cache of the raw blocks and of the derived fields of each particle type
+
+    A raw block (POS, VEL, MASS, U...) is read when first needed and kept as a contiguous array with the dtype of the file. The derived fields (see DERIVED_FIELDS) are cached with a key (field, type, center, coordinate system, box). The raw blocks and the derived fields share the memory budget of a LRUCache : asking again for the same field costs nothing, and the least recently used ones are evicted when the budget is reached (an evicted raw block is read again when needed). Only the columns added by the user (add_column) are kept outside the budget, as they cannot be read again.
+
+    Parameters:
+    ----------
+
+    source : string, list of string or reader
+        snapshot file(s) (see readers.snapfile.open_snapshot), or an opened snapshot
+
+    center : list or float array (3)
+        default center of the derived fields
+
+    boxsize : float
+        size of the periodic box. If given, the derived fields use the nearest periodic image of the center.
+
+    cache_bytes : integer
+        memory budget of the raw blocks and the derived fields in bytes. Default is internals.cache.CACHE_FRACTION of the physical memory.
+
+
+    Example:
+    -------
+
+    >>> snap=Snapshot("snapshot_079.hdf5",center=[50,50,50],cache_bytes=64*1024**3)
+    >>> r=snap.field("r","dm") #computed
+    >>> r=snap.field("r","dm") #from the cache
+    >>> vel=snap.field("vel","star",coordinates="cyl")
+    >>> T=snap.field("temperature","gas")
+    >>> profile.mean(snap.field("r","gas"),T,bins)
+
+    """
+
+    def __init__(self,source,center=[0,0,0],boxsize=None,cache_bytes=None):
+        if isinstance(source,(basestring,list,tuple)):
+            source=open_snapshot(source)
+        self.source=source
+        self.header=source.header
+        self.center=np.asarray(center,dtype='float64')
+        self.boxsize=boxsize
+        self.columns=[{} for t in range(NTYPES)] #columns added by the user for each particle type
+        self.cache=LRUCache(cache_bytes)
+
+
+    def npart(self,ptype):
+        """Number of particles of type ptype"""
+        return self.source.npart(ptype)
+
+
+    def blocks(self,*args):
+        """Return the list of blocks available in the snapshot"""
+        return self.source.blocks(*args)
+
+
+    def _cached_column(self,name,ptype):
+        """Return a column already in memory (added by the user or cached), or None"""
+
+        if name in self.columns[ptype]:
+            return self.columns[ptype][name]
+        return self.cache.peek((name,ptype,None,None,None))
+
+
+    def _is_raw(self,key):
+        """True if a key of the cache is a raw block, False for a derived field"""
+        return key[0] not in DERIVED_FIELDS and key[0] not in REGISTRY
+
+
+    def _is_column(self,value,ptype):
+        """True if value is a column of ptype in memory, which is not cached a second time as a derived field"""
+
+        if any(value is c for c in self.columns[ptype].values()):
+            return True
+        return any(value is self.cache.peek(key) for key in self.cache.keys() if key[1] == ptype and self._is_raw(key))
+
+
+    def column(self,name,ptype):
+        """Return the raw block name of the particles ptype, read when first needed (and again if it was evicted from the cache)
+
+        COMMENTS : the blocks with a fixed mass in the header stay broadcast arrays (no memory).
+        """
+
+        ptype=_particle_type(ptype)
+        if name in self.columns[ptype]:
+            return self.columns[ptype][name]
+        key=(name,ptype,None,None,None)
+        data=self.cache.get(key)
+        if data is None:
+            data=self.source.block(name,ptype)
+            if not (isinstance(data,np.ndarray) and not isinstance(data,np.memmap) and 0 in data.strides):
+                data=np.ascontiguousarray(data[...])
+                data=data.astype(data.dtype.newbyteorder('='),copy=False)
+            self.cache.put(key,data)
+        return data
+
+    block=column #so that a Snapshot can be used wherever a reader is expected
+
+
+    def read(self,name,ptype,start=0,stop=None,out=None):
+        """Return the rows [start,stop) of a block, from the memory if already read"""
+
+        ptype=_particle_type(ptype)
+        data=self._cached_column(name,ptype)
+        if data is not None:
+            data=data[start:stop]
+            if out is None:
+                return data
+            out[...]=data
+            return out
+        return self.source.read(name,ptype,start,stop,out=out)
+
+
+    def iter_chunks(self,*args,**kwargs):
+        """Iterate over a block by chunks, without storing it (see the readers)"""
+        return self.source.iter_chunks(*args,**kwargs)
+
+
+    def add_column(self,name,ptype,values):
+        """Store a column computed by the user (eg.: a membership flag), available with column and field"""
+
+        ptype=_particle_type(ptype)
+        if len(values) != self.npart(ptype):
+            raise ValueError("a column must have one value per particle")
+        self.cache.pop((name,ptype,None,None,None))
+        self.columns[ptype][name]=values
+
+
+    def _key(self,name,ptype,center,coordinates,boxsize):
+        """Key of a derived field in the cache : (name, type, center, coordinates, boxsize), None for the parameters the field does not depend on"""
+
+        if name not in DERIVED_FIELDS:
+            name=REGISTRY.aliases.get(name,name) #'T' and 'temperature' are the same field
+        parameters=DERIVED_FIELDS[name][1] if name in DERIVED_FIELDS else REGISTRY.parameters(name)
+        if "center" in parameters:
+            center=tuple(self.center if center is None else np.asarray(center,dtype='float64'))
+        else:
+            center=None
+        coordinates=coordinates if "coordinates" in parameters else None
+        if "boxsize" in parameters:
+            boxsize=self.boxsize if boxsize is None else boxsize
+        else:
+            boxsize=None
+        return (name,ptype,center,coordinates,boxsize)
+
+
+    def field(self,name,ptype,center=None,coordinates="cart",boxsize=None):
+        """Return a derived field (or a raw column) of the particles ptype, computed once and cached
+
+        Parameters:
+        ----------
+
+        name : string
+            derived field (see DERIVED_FIELDS : 'pos', 'vel', 'r', 'j', or physics.registry.FIELDS : 'temperature', 'v_r', 'j_z'...) or raw block ('MASS', 'RHO'...)
+
+        ptype : integer or string
+            particle type
+
+        center : list or float array (3)
+            center of the geometric fields. Default is the center of the snapshot.
+
+        coordinates : string
+            coordinate system of the vector fields ('cart', 'cyl', 'sph')
+
+        boxsize : float
+            size of the periodic box. Default is the box of the snapshot.
+
+
+        COMMENTS : the returned arrays are shared with the cache, they must not be modified in place.
+        """
+
+        if name not in DERIVED_FIELDS:
+            if name in REGISTRY:
+                return self.fields([name],ptype,center,boxsize)[name]
+            return self.column(name,ptype)
+        _check_if_keyword_is_correct(coordinates,COORDINATES)
+
+        ptype=_particle_type(ptype)
+        key=self._key(name,ptype,center,coordinates,boxsize)
+        value=self.cache.get(key)
+        if value is None:
+            value=DERIVED_FIELDS[name][0](self,*key[1:])
+            if not self._is_column(value,ptype): #eg.: cartesian velocity, already cached as VEL
+                self.cache.put(key,value)
+        return value
+
+
+    def fields(self,names,ptype,center=None,boxsize=None,chunk_rows=CHUNK_ROWS):
+        """Return several fields of the registry (physics.registry.FIELDS) in a dictionary, computed in a single pass and cached
+
+        Only the fields missing from the cache are evaluated, together, chunk by chunk : the raw blocks they need are taken from the column store if already read, otherwise read once from the files without being stored.
+
+        Example:
+        -------
+
+        >>> gas=snap.fields(["T","j_z","v_r"],"gas")
+
+        """
+
+        ptype=_particle_type(ptype)
+        keys=dict((name,self._key(name,ptype,center,None,boxsize)) for name in names)
+        output={}
+        missing=[]
+        for name in names:
+            value=self.cache.get(keys[name])
+            if value is None:
+                missing.append(name)
+            else:
+                output[name]=value
+
+        if missing:
+            center=self.center if center is None else center
+            boxsize=self.boxsize if boxsize is None else boxsize
+            computed=REGISTRY.evaluate(self,ptype,missing,chunk_rows=chunk_rows,center=center,boxsize=boxsize)
+            for name in missing:
+                self.cache.put(keys[name],computed[name])
+                output[name]=computed[name]
+        return output
+
+
+    def __getitem__(self,key):
+        """snap[ptype,name] : derived field or raw column with the default center and cartesian coordinates"""
+
+        ptype,name=key
+        return self.field(name,ptype)
+
+
+    def release(self,ptype=None,columns=True,fields=True):
+        """Free the raw columns (with the columns added by the user) and/or the derived fields (of one particle type, or all)"""
+
+        types=range(NTYPES) if ptype is None else [_particle_type(ptype)]
+        for t in types:
+            if columns:
+                self.columns[t]={}
+                self.cache.clear(lambda key: key[1] == t and self._is_raw(key))
+            if fields:
+                self.cache.clear(lambda key: key[1] == t and not self._is_raw(key))
+
+
+    @property
+    def nbytes(self):
+        """Memory used by the raw columns, the derived fields and the columns added by the user, in bytes"""
+
+        columns=sum(c.nbytes for t in range(NTYPES) for c in self.columns[t].values()
+                    if isinstance(c,np.ndarray) and 0 not in c.strides)
+        return columns+self.cache.nbytes
+
+
+    def close(self):
+        """Free the memory and close the files"""
+
+        self.release()
+        self.source.close()
@@ -20,5 +20,6 @@ UnitMass     = 1.989e43    # M_solar * 10^10 --> grams
 UnitVelocity = 1.0e5       #            km/s --> cm/s
 UnitTime     = UnitLength/UnitVelocity #Seconds
 UnitEnergy   = UnitMass * UnitLength * UnitLength / (UnitTime*UnitTime) #Erg
+UnitGravity  = GRAVITATIONAL_CONSTANT * UnitMass * UnitTime**2 / UnitLength**3 #gravitational constant in Gadget Units
 
 
@@ -1,38 +1,39 @@
 ### NAME: convert.py
-### PURPOSE: convert units from Gadget Units (GU) to cgs
+### PURPOSE: convert units from Gadget Units (GU) to cgs. All the functions take an optional out array : out=x converts x in place.
+import numpy as np
 from units.common import UnitLength, UnitMass, UnitVelocity, UnitTime, UnitEnergy
 
 
 
-def length(l):
-    return l*UnitLength
+def length(l,out=None):
+    return np.multiply(l,UnitLength,out=out)
 
-def mass(m):
-    return m*UnitMass
+def mass(m,out=None):
+    return np.multiply(m,UnitMass,out=out)
 
-def velocity(v):
-    return v*UnitVelocity
+def velocity(v,out=None):
+    return np.multiply(v,UnitVelocity,out=out)
 
-def time(t):
-    return t*UnitTime
+def time(t,out=None):
+    return np.multiply(t,UnitTime,out=out)
 
-def energy(e):
-    return e*UnitEnergy
+def energy(e,out=None):
+    return np.multiply(e,UnitEnergy,out=out)
 
-def density(rho):
-    return rho*UnitMass/UnitLength**3
+def density(rho,out=None):
+    return np.multiply(rho,UnitMass/UnitLength**3,out=out)
 
-def surfacedensity(rho):
-    return rho*UnitMass/UnitLength**2
+def surfacedensity(rho,out=None):
+    return np.multiply(rho,UnitMass/UnitLength**2,out=out)
 
-def energypermass(u):
-    return u*UnitEnergy/UnitMass
+def energypermass(u,out=None):
+    return np.multiply(u,UnitEnergy/UnitMass,out=out)
 
-def angular_momentum(l):
-    return l*UnitLength*UnitMass*UnitVelocity
+def angular_momentum(l,out=None):
+    return np.multiply(l,UnitLength*UnitMass*UnitVelocity,out=out)
 
-def specific_angular_momentum(l):
-    return l*UnitLength*UnitVelocity
+def specific_angular_momentum(l,out=None):
+    return np.multiply(l,UnitLength*UnitVelocity,out=out)
 
-def accretion_rate(l):
-    return l*UnitMass/UnitTime
+def accretion_rate(l,out=None):
+    return np.multiply(l,UnitMass/UnitTime,out=out)
@@ -0,0 +1,271 @@
+### NAME: system.py
+### PURPOSE: unit system of a snapshot (Gadget units, comoving coordinates and h factors) and arrays with a lazy scale factor
+
+import numpy as np
+from units.common import UnitLength, UnitMass, UnitVelocity
+
+
+## dimension of each quantity : exponents of (length, mass, velocity) in the internal units, and of (a, h) for the comoving quantities of the cosmological runs
+QUANTITIES = {"length":                    (1, 0, 0,  1. , -1),
+              "mass":                      (0, 1, 0,  0. , -1),
+              "velocity":                  (0, 0, 1,  0.5,  0), #Gadget velocities are sqrt(a)*dx/dt
+              "time":                      (1, 0,-1,  0. , -1),
+              "density":                   (-3,1, 0, -3. ,  2),
+              "surfacedensity":            (-2,1, 0, -2. ,  1),
+              "energypermass":             (0, 0, 2,  0. ,  0),
+              "energy":                    (0, 1, 2,  0. , -1),
+              "pressure":                  (-3,1, 2, -3. ,  2),
+              "potential":                 (0, 0, 2, -1. ,  0),
+              "specific_angular_momentum": (1, 0, 1,  1.5, -1),
+              "dimensionless":             (0, 0, 0,  0. ,  0)}
+
+## quantity of each block
+BLOCK_QUANTITIES = {"POS":"length", "VEL":"velocity", "MASS":"mass", "U":"energypermass",
+                    "RHO":"density", "HSML":"length", "POT":"potential", "ID":"dimensionless",
+                    "NE":"dimensionless", "NH":"dimensionless", "Z":"dimensionless"}
+
+## names of the units in the parameter files of Gadget/GIZMO
+PARAMETERS = {"length":"UnitLength_in_cm", "mass":"UnitMass_in_g", "velocity":"UnitVelocity_in_cm_per_s",
+              "h":"HubbleParam", "comoving":"ComovingIntegrationOn"}
+
+
+
+class ScaledArray(object):
+    """Array with a lazy scale factor : the values are array*scale, but the multiplication is only done when needed
+
+    The reductions (analysis.reduction, the accumulators and the histograms) and the deposits (geometry.deposit) apply the scale to their results instead of the particles. Slicing keeps the scale, so that a chunk of a np.memmap stays lazy.
+
+    Parameters:
+    ----------
+
+    array : array
+        values in the original units (eg.: a block of the snapshot)
+
+    scale : float
+        factor to convert them
+
+
+    Example:
+    -------
+
+    >>> rho=ScaledArray(snap.block("RHO","gas"),units.factor("density"))
+    >>> profile.mean(r,rho,radius) #in g/cm^3, without any temporary copy of rho
+    >>> rho.apply(out=rho.array) #convert in place, if really needed
+
+    """
+
+    def __init__(self,array,scale=1.):
+        if isinstance(array,ScaledArray):
+            scale*=array.scale
+            array=array.array
+        self.array=array
+        self.scale=scale
+
+
+    def __len__(self):
+        return len(self.array)
+
+
+    @property
+    def shape(self):
+        return np.shape(self.array)
+
+
+    @property
+    def dtype(self):
+        return self.array.dtype
+
+
+    @property
+    def ndim(self):
+        return np.ndim(self.array)
+
+
+    def __getitem__(self,key):
+        return ScaledArray(self.array[key],self.scale)
+
+
+    def __mul__(self,factor):
+        return ScaledArray(self.array,self.scale*factor)
+
+    __rmul__=__mul__
+
+
+    def __div__(self,factor):
+        return ScaledArray(self.array,self.scale/factor)
+
+    __truediv__=__div__
+
+
+    def __array__(self,dtype=None):
+        values=self.apply()
+        return values if dtype is None else values.astype(dtype,copy=False)
+
+
+    def __repr__(self):
+        return "ScaledArray("+repr(self.array)+", scale="+repr(self.scale)+")"
+
+
+    def apply(self,out=None):
+        """Return the scaled values. out=self.array converts the array in place (the scale is then 1)."""
+
+        values=np.multiply(self.array,self.scale,out=out)
+        if out is self.array:
+            self.scale=1.
+        return values
+
+
+
+def unscale(x):
+    """Return (array,scale) : the original array and its lazy scale factor (1 if x is not a ScaledArray)"""
+
+    if isinstance(x,ScaledArray):
+        return x.array,x.scale
+    return x,1.
+
+
+
+class UnitSystem(object):
+    """Units of a snapshot : internal units in cgs, expansion factor and Hubble parameter
+
+    In a cosmological run (comoving=True), Gadget writes the lengths in comoving units/h, the masses in units/h and the velocities multiplied by 1/sqrt(a). The physical values are obtained with the factors a and h of QUANTITIES.
+
+    Parameters:
+    ----------
+
+    length, mass, velocity : float
+        internal units in cm, g and cm/s. Default is units.common.
+
+    a : float
+        expansion factor
+
+    h : float
+        Hubble parameter in units of 100 km/s/Mpc
+
+    comoving : boolean
+        True if the snapshot is in comoving units (cosmological run)
+
+
+    Example:
+    -------
+
+    >>> units=UnitSystem.from_header(snap.header)
+    >>> pos=units.scaled(snap.block("POS","dm"),"length",cgs=False) #physical units, lazy
+    >>> rho=units.convert(snap.block("RHO","gas").copy(),"density",inplace=True) #in g/cm^3, in place
+
+    """
+
+    def __init__(self,length=UnitLength,mass=UnitMass,velocity=UnitVelocity,a=1.,h=1.,comoving=False):
+        self.length=float(length)
+        self.mass=float(mass)
+        self.velocity=float(velocity)
+        self.a=float(a)
+        self.h=float(h)
+        self.comoving=bool(comoving)
+
+
+    def __repr__(self):
+        return "UnitSystem(length=%g, mass=%g, velocity=%g, a=%g, h=%g, comoving=%s)" % \
+            (self.length,self.mass,self.velocity,self.a,self.h,self.comoving)
+
+
+    @classmethod
+    def from_header(cls,header,comoving=None,**kwargs):
+        """Unit system of a snapshot from its header (readers)
+
+        Parameters:
+        ----------
+
+        header : dictionary
+            header of the snapshot (Time, HubbleParam, Omega0...)
+
+        comoving : boolean
+            True for a cosmological run. Default is True if Omega0 and HubbleParam are not 0.
+
+        **kwargs :
+            internal units (length, mass, velocity), see UnitSystem
+
+        """
+
+        h=float(header.get("HubbleParam",0.))
+        if comoving is None:
+            comoving=float(header.get("Omega0",0.)) > 0 and h > 0
+        if not comoving:
+            return cls(a=1.,h=1.,comoving=False,**kwargs)
+        return cls(a=float(header["Time"]),h=h,comoving=True,**kwargs)
+
+
+    @classmethod
+    def from_parameters(cls,filename,header=None):
+        """Unit system from the parameter file of Gadget/GIZMO (and the header for the expansion factor)
+
+        Parameters:
+        ----------
+
+        filename : string
+            parameter file (lines 'name value', comments start with %)
+
+        header : dictionary
+            header of the snapshot, for the expansion factor
+
+        """
+
+        values={}
+        with open(filename) as f:
+            for line in f:
+                words=line.split("%")[0].split()
+                if len(words) >= 2:
+                    values[words[0]]=words[1]
+
+        kwargs={}
+        for name in ("length","mass","velocity"):
+            if PARAMETERS[name] in values:
+                kwargs[name]=float(values[PARAMETERS[name]])
+        comoving=int(values.get(PARAMETERS["comoving"],0)) == 1
+        h=float(values.get(PARAMETERS["h"],1.))
+        a=float(header["Time"]) if (comoving and header is not None) else 1.
+        return cls(a=a,h=h if comoving else 1.,comoving=comoving,**kwargs)
+
+
+    def factor(self,quantity,physical=True,cgs=True):
+        """Return the factor converting a quantity from the snapshot to physical (without h) and/or cgs units
+
+        Parameters:
+        ----------
+
+        quantity : string
+            one of QUANTITIES (eg.: 'length', 'density') or a block name (eg.: 'POS')
+
+        physical : boolean
+            remove the factors a and h of the comoving units
+
+        cgs : boolean
+            convert the internal units to cgs
+
+        """
+
+        quantity=BLOCK_QUANTITIES.get(quantity,quantity)
+        if quantity not in QUANTITIES:
+            raise KeyError(quantity+" must be ["+", ".join(sorted(QUANTITIES.keys()))+"]")
+        l,m,v,ea,eh=QUANTITIES[quantity]
+
+        factor=1.
+        if cgs:
+            factor*=self.length**l*self.mass**m*self.velocity**v
+        if physical and self.comoving:
+            factor*=self.a**ea*self.h**eh
+        return factor
+
+
+    def scaled(self,array,quantity,physical=True,cgs=True):
+        """Return array as a ScaledArray, converted lazily (see factor)"""
+
+        return ScaledArray(array,self.factor(quantity,physical,cgs))
+
+
+    def convert(self,array,quantity,physical=True,cgs=True,inplace=False,out=None):
+        """Return the converted array (see factor). inplace=True converts array itself, without any copy."""
+
+        if inplace:
+            out=array
+        return np.multiply(array,self.factor(quantity,physical,cgs),out=out)
@@ -0,0 +1,8 @@
+###NAME: __init__.py
+###PURPOSE: tests of pygadgettools, run from the root of the repository with : python -m unittest discover tests
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT,"pygadgettools")] #the modules of the package import each other as geometry.x, readers.x...
@@ -0,0 +1,164 @@
+###NAME: synthetic.py
+###PURPOSE: small random snapshots written in the Gadget binary (SnapFormat 1 and 2) and HDF5 formats, to test the readers and everything built on them
+
+import numpy as np
+from readers.common import NTYPES, BLOCK_NAMES
+from readers.binary import HEADER_FIELDS, BLOCK_ORDER, BLOCK_ORDER_COOLING
+
+try:
+    import h5py
+except ImportError: #the HDF5 tests are skipped
+    h5py = None
+
+
+
+def particles(npart,masses=[0.]*NTYPES,cooling=True,boxsize=10.,seed=0,dtype='float32'):
+    """Return a dictionary of random blocks for npart particles of each type, in the order of the types
+
+    Parameters:
+    ----------
+
+    npart : list of integer (6)
+        number of particles of each type
+
+    masses : list of float (6)
+        mass table : the types with a mass in the table have no MASS rows
+
+    cooling : boolean
+        write the NE and NH blocks of the gas
+
+    """
+
+    rng=np.random.RandomState(seed)
+    ntot=sum(npart)
+    variable=sum(n for n,m in zip(npart,masses) if m == 0)
+    data={"POS":(rng.rand(ntot,3)*boxsize).astype(dtype),
+          "VEL":rng.randn(ntot,3).astype(dtype),
+          "ID":np.arange(ntot,dtype='uint32'),
+          "MASS":(rng.rand(variable)+1.).astype(dtype),
+          "U":(rng.rand(npart[0])*100.).astype(dtype),
+          "RHO":rng.rand(npart[0]).astype(dtype),
+          "HSML":(rng.rand(npart[0])*0.5).astype(dtype)}
+    if cooling:
+        data["NE"]=(rng.rand(npart[0])*1.2).astype(dtype)
+        data["NH"]=rng.rand(npart[0]).astype(dtype)
+    return data
+
+
+
+def header(npart,masses=[0.]*NTYPES,boxsize=10.,numfiles=1,npart_total=None):
+    """Return the header of a snapshot as a dictionary, with the fields of readers.binary.HEADER_FIELDS"""
+
+    values=dict((name,np.zeros(n,dtype=fmt) if n > 1 else np.zeros((),dtype=fmt)) for name,fmt,n in HEADER_FIELDS)
+    values["NumPart_ThisFile"][:]=npart
+    values["NumPart_Total"][:]=npart if npart_total is None else npart_total
+    values["MassTable"][:]=masses
+    values["Time"][...]=0.5
+    values["Redshift"][...]=1.
+    values["NumFilesPerSnapshot"][...]=numfiles
+    values["BoxSize"][...]=boxsize
+    return values
+
+
+
+def write_binary(filename,npart,masses=[0.]*NTYPES,cooling=True,fmt=2,endian='<',data=None,numfiles=1,**kwargs):
+    """Write a Gadget binary snapshot and return its blocks (see particles)
+
+    Example:
+    -------
+
+    >>> data=write_binary("snapshot_000",[100,200,0,0,0,0],fmt=1)
+
+    """
+
+    data=particles(npart,masses,cooling,**kwargs) if data is None else data
+    head=header(npart,masses,kwargs.get("boxsize",10.),numfiles)
+    layout=np.dtype([(name,endian+fmt_,(n,)) if n > 1 else (name,endian+fmt_) for name,fmt_,n in HEADER_FIELDS])
+    raw=np.zeros(1,dtype=layout)
+    for name,fmt_,n in HEADER_FIELDS:
+        raw[name]=head[name]
+    blocks={"HEAD":raw.tobytes()+b'\0'*(256-layout.itemsize)}
+
+    order=BLOCK_ORDER_COOLING if "NE" in data else BLOCK_ORDER
+    with open(filename,'wb') as f:
+        for name in order:
+            if name != "HEAD":
+                if len(data.get(name,[])) == 0:
+                    continue
+                value=np.asarray(data[name])
+                blocks[name]=value.astype(value.dtype.newbyteorder(endian)).tobytes()
+            size=np.array([len(blocks[name])],dtype=endian+'i4').tobytes()
+            if fmt == 2:
+                f.write(np.array([8],dtype=endian+'i4').tobytes()+name.ljust(4).encode('ascii')
+                        +np.array([len(blocks[name])+8,8],dtype=endian+'i4').tobytes())
+            f.write(size+blocks[name]+size)
+    return data
+
+
+
+def write_hdf5(filename,npart,masses=[0.]*NTYPES,cooling=True,data=None,numfiles=1,**kwargs):
+    """Write a Gadget/GIZMO HDF5 snapshot and return its blocks (see particles)
+
+    Example:
+    -------
+
+    >>> data=write_hdf5("snapshot_000.hdf5",[100,200,0,0,0,0])
+
+    """
+
+    data=particles(npart,masses,cooling,**kwargs) if data is None else data
+    first=np.cumsum([0]+list(npart))
+    first_mass=np.cumsum([0]+[n if m == 0 else 0 for n,m in zip(npart,masses)])
+    with h5py.File(filename,'w') as f:
+        head=f.create_group("Header")
+        for name,value in header(npart,masses,kwargs.get("boxsize",10.),numfiles).items():
+            head.attrs[name]=value
+        for t in range(NTYPES):
+            if npart[t] == 0:
+                continue
+            group=f.create_group("PartType"+str(t))
+            for name,value in data.items():
+                if name == "MASS":
+                    if masses[t] == 0:
+                        group.create_dataset(BLOCK_NAMES[name],data=value[first_mass[t]:first_mass[t+1]])
+                elif len(value) == first[-1]:
+                    group.create_dataset(BLOCK_NAMES[name],data=value[first[t]:first[t+1]])
+                elif t == 0: #gas blocks
+                    group.create_dataset(BLOCK_NAMES[name],data=value)
+    return data
+
+
+
+def split(data,npart,nfiles,masses=[0.]*NTYPES):
+    """Split the blocks of a snapshot (see particles) in nfiles parts, each with about the same number of particles of each type
+
+    Returns (npart,data) for each file.
+    """
+
+    files=[]
+    for i in range(nfiles):
+        bounds=[(n*i//nfiles,n*(i+1)//nfiles) for n in npart]
+        part=dict((name,[]) for name in data)
+        for t in range(NTYPES):
+            lo,hi=bounds[t]
+            for name in data:
+                if name == "MASS" and masses[t] > 0:
+                    continue
+                if name not in ("POS","VEL","ID","MASS") and t != 0:
+                    continue
+                part[name].append(rows(data,name,npart,t,masses)[lo:hi])
+        files.append(([hi-lo for lo,hi in bounds],dict((name,np.concatenate(value)) for name,value in part.items())))
+    return files
+
+
+
+def rows(data,name,npart,ptype,masses=[0.]*NTYPES):
+    """Return the rows of the particles ptype in a block written by write_binary or write_hdf5"""
+
+    if name in ("POS","VEL","ID"):
+        first=sum(npart[:ptype])
+    elif name == "MASS":
+        first=sum(n for n,m in zip(npart[:ptype],masses[:ptype]) if m == 0)
+    else:
+        first=0
+    return data[name][first:first+npart[ptype]]
@@ -0,0 +1,74 @@
+###NAME: test_accumulators.py
+###PURPOSE: chunked and merged reductions (analysis.accumulators, analysis.histogram) against the reductions of all the particles at once
+
+import unittest
+import numpy as np
+from analysis.accumulators import BinnedAccumulator
+from analysis.histogram import HistogramAccumulator, histogram
+from analysis.reduction import binned_statistics
+from geometry.create_grid import LinearBins, LogBins
+
+STATISTICS = ("count","sum","mean","var","min","max","weighted_mean")
+
+
+
+class BinnedAccumulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        rng=np.random.RandomState(0)
+        self.x=rng.rand(10000)*12.-1.
+        self.q=rng.randn(10000)*3.+100.
+        self.w=rng.rand(10000)
+        self.bins=LinearBins(0.,10.,20)
+
+
+    def check(self,result):
+        expected=binned_statistics(self.x,self.bins,self.q,weights=self.w,statistics=STATISTICS)
+        for s in STATISTICS:
+            np.testing.assert_allclose(result[s],expected[s],rtol=1e-10,err_msg=s)
+
+
+    def test_chunks(self):
+        acc=BinnedAccumulator(self.bins,STATISTICS)
+        for start in range(0,len(self.x),777):
+            acc.add(self.x[start:start+777],self.q[start:start+777],self.w[start:start+777])
+        self.check(acc.result())
+
+
+    def test_merge(self):
+        parts=[BinnedAccumulator(LinearBins(0.,10.,20),STATISTICS) for i in range(3)]
+        for k,part in enumerate(parts):
+            part.add(self.x[k::3],self.q[k::3],self.w[k::3])
+        self.check(parts[0].merge(parts[1]).merge(parts[2]).result())
+
+
+    def test_merge_mismatch(self):
+        acc=BinnedAccumulator(self.bins,("mean",))
+        self.assertRaises(ValueError,acc.merge,BinnedAccumulator(LinearBins(0.,10.,21),("mean",)))
+        self.assertRaises(ValueError,acc.merge,BinnedAccumulator(LogBins(0.1,10.,20),("mean",)))
+        self.assertRaises(ValueError,acc.merge,BinnedAccumulator(self.bins,("mean","var")))
+        self.assertRaises(ValueError,acc.merge,BinnedAccumulator(self.bins,("sum",)))
+        acc.merge(BinnedAccumulator(self.bins.edges,("mean",))) #same edges
+
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_against_histogramdd(self):
+        rng=np.random.RandomState(1)
+        x=rng.rand(5000,2)
+        mass=rng.rand(5000)
+        bins=[np.linspace(0,1,11),LinearBins(0.,1.,7)]
+        expected,edges=np.histogramdd(x,bins=[bins[0],bins[1].edges],weights=mass)
+        np.testing.assert_allclose(histogram([x[:,0],x[:,1]],bins,mass,statistics=("sum",))["sum"],expected)
+
+        parts=[HistogramAccumulator(bins,("sum",)) for i in range(2)]
+        parts[0].add([x[:2000,0],x[:2000,1]],mass[:2000])
+        parts[1].add([x[2000:,0],x[2000:,1]],mass[2000:])
+        np.testing.assert_allclose(parts[0].merge(parts[1]).result()["sum"],expected)
+        self.assertRaises(ValueError,parts[0].merge,HistogramAccumulator([bins[0],LinearBins(0.,1.,8)],("sum",)))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
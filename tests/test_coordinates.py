@@ -0,0 +1,134 @@
+###NAME: test_coordinates.py
+###PURPOSE: coordinate conversions (geometry.coordinates) against the original formulas, and round trips between the coordinate systems
+
+import unittest
+import warnings
+import numpy as np
+from geometry.coordinates import change_coordinates, change_phase_space
+from physics.fields import specific_angular_momentum
+
+
+SYSTEMS=["cart","cyl","sph"]
+PHI_COLUMN={"cyl":1,"sph":2} #column of the azimuth
+
+
+
+## original formulas, from cartesian coordinates (float64)
+def _reference_spherical(pos,vel):
+    x,y,z=pos.T
+    vx,vy,vz=vel.T
+    r=np.sqrt(x**2+y**2+z**2)
+    theta=np.arccos(z/r)
+    phi=np.arctan2(y,x)
+    vr=vx*np.sin(theta)*np.cos(phi) + vy*np.sin(theta)*np.sin(phi) + vz*np.cos(theta)
+    vtheta=vx*np.cos(theta)*np.cos(phi) + vy*np.cos(theta)*np.sin(phi) - vz*np.sin(theta)
+    vphi=-vx*np.sin(phi) + vy*np.cos(phi)
+    return np.dstack((r,theta,phi))[0],np.dstack((vr,vtheta,vphi))[0]
+
+
+def _reference_cylindrical(pos,vel):
+    x,y,z=pos.T
+    vx,vy,vz=vel.T
+    theta=np.arctan2(y,x)
+    vr=vx*np.cos(theta) + vy*np.sin(theta)
+    vtheta=-vx*np.sin(theta) + vy*np.cos(theta)
+    return np.dstack((np.sqrt(x**2+y**2),theta,z))[0],np.dstack((vr,vtheta,vz))[0]
+
+
+
+class CoordinatesTest(unittest.TestCase):
+
+    def setUp(self):
+        rng=np.random.RandomState(7)
+        self.pos=rng.randn(3000,3)*10.
+        self.vel=rng.randn(3000,3)*100.
+
+
+    def _convert(self,pos,vel,sys1,sys2,**kwargs):
+        return change_coordinates(pos,"pos",sys1,sys2,**kwargs),change_coordinates(pos,"vel",sys1,sys2,vel,**kwargs)
+
+
+    def test_against_original_formulas(self):
+        for sys2,reference in (("sph",_reference_spherical),("cyl",_reference_cylindrical)):
+            expected_pos,expected_vel=reference(self.pos,self.vel)
+            pos,vel=self._convert(self.pos,self.vel,"cart",sys2)
+            np.testing.assert_allclose(pos,expected_pos,rtol=1e-12,atol=1e-12)
+            np.testing.assert_allclose(vel,expected_vel,rtol=1e-10,atol=1e-10)
+
+
+    def test_round_trips(self):
+        for sys1 in SYSTEMS:
+            pos,vel=self.pos,self.vel
+            if sys1 != "cart":
+                pos,vel=self._convert(pos,vel,"cart",sys1)
+            for sys2 in SYSTEMS:
+                if sys2 == sys1:
+                    continue
+                p,v=self._convert(pos,vel,sys1,sys2)
+                back_pos,back_vel=self._convert(p,v,sys2,sys1)
+                if sys1 != "cart": #the azimuth may come back shifted by 2pi
+                    phi=PHI_COLUMN[sys1]
+                    back_pos[:,phi]=np.angle(np.exp(1j*back_pos[:,phi]))
+                np.testing.assert_allclose(back_pos,pos,rtol=1e-10,atol=1e-10,err_msg=sys1+"->"+sys2)
+                np.testing.assert_allclose(back_vel,vel,rtol=1e-10,atol=1e-8,err_msg=sys1+"->"+sys2)
+
+
+    def test_direct_cylindrical_spherical_velocity(self):
+        ##cyl<->sph velocities are computed directly, they must agree with the conversion through cartesian coordinates
+        pos_cyl,vel_cyl=self._convert(self.pos,self.vel,"cart","cyl")
+        pos_sph,vel_sph=self._convert(self.pos,self.vel,"cart","sph")
+        np.testing.assert_allclose(change_coordinates(pos_cyl,"vel","cyl","sph",vel_cyl),vel_sph,rtol=1e-10,atol=1e-8)
+        np.testing.assert_allclose(change_coordinates(pos_sph,"vel","sph","cyl",vel_sph),vel_cyl,rtol=1e-10,atol=1e-8)
+
+
+    def test_out_and_threads(self):
+        expected_pos,expected_vel=self._convert(self.pos,self.vel,"cart","sph")
+        pos=self.pos.copy()
+        vel=self.vel.copy()
+        change_coordinates(pos,"vel","cart","sph",vel,out=vel,nthreads=3) #velocity first : it needs the cartesian positions
+        change_coordinates(pos,"pos","cart","sph",out=pos,nthreads=3)
+        np.testing.assert_array_equal(pos,expected_pos)
+        np.testing.assert_array_equal(vel,expected_vel)
+
+
+    def test_float32(self):
+        pos,vel=self._convert(self.pos.astype('float32'),self.vel.astype('float32'),"cart","sph")
+        self.assertEqual(pos.dtype,np.float32)
+        self.assertEqual(vel.dtype,np.float32)
+        expected_pos,expected_vel=_reference_spherical(self.pos,self.vel)
+        np.testing.assert_allclose(pos,expected_pos,rtol=1e-4,atol=1e-4)
+
+        ##theta=pi rounded to float32 is slightly above np.pi, but is on the axis
+        sph=np.array([[1.,np.pi,0.],[2.,0.,1.]],dtype='float32')
+        cart=change_coordinates(sph,"pos","sph","cart")
+        np.testing.assert_allclose(cart,[[0.,0.,-1.],[0.,0.,2.]],atol=1e-6)
+        self.assertRaises(ValueError,change_coordinates,np.array([[1.,4.,0.]]),"pos","sph","cart")
+
+
+    def test_origin(self):
+        pos=np.array([[0.,0.,0.],[1.,0.,0.]])
+        vel=np.array([[1.,2.,3.],[1.,2.,3.]])
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            sph_vel=change_coordinates(pos,"vel","cart","sph",vel)
+        self.assertEqual(len(caught),1)
+        np.testing.assert_array_equal(sph_vel[0],[0.,0.,0.])
+        np.testing.assert_array_equal(change_coordinates(pos,"pos","cart","sph")[0],[0.,0.,0.])
+
+
+    def test_change_phase_space(self):
+        for sys1,sys2 in (("cart","sph"),("cart","cyl"),("cyl","sph"),("sph","cart")):
+            pos,vel=self.pos,self.vel
+            if sys1 != "cart":
+                pos,vel=self._convert(pos,vel,"cart",sys1)
+            expected_pos,expected_vel=self._convert(pos,vel,sys1,sys2)
+            p,v,j=change_phase_space(pos,vel,sys1,sys2,angular_momentum=True,nthreads=2)
+            np.testing.assert_allclose(p,expected_pos,rtol=1e-14,atol=1e-14)
+            np.testing.assert_allclose(v,expected_vel,rtol=1e-14,atol=1e-12)
+            np.testing.assert_allclose(j,specific_angular_momentum(p,v,coordinates=sys2),rtol=1e-14,atol=1e-12)
+        self.assertRaises(KeyError,change_phase_space,self.pos,self.vel,"cart","cart")
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+###NAME: test_cumulative.py
+###PURPOSE: cumulative radial profiles (analysis.cumulative) against sums over all the particles at each radius
+
+import unittest
+import numpy as np
+from analysis.cumulative import CumulativeProfile, enclosed_mass_at
+
+
+
+class CumulativeProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        rng=np.random.RandomState(9)
+        self.r=np.abs(rng.randn(5000))*10.
+        self.r[:20]=self.r[20] #ties
+        self.mass=rng.rand(5000)+0.5
+        self.radius=np.concatenate(([0.,self.r[20],1e3],np.linspace(0.1,40.,50)))
+        self.profile=CumulativeProfile(self.r,self.mass,G=2.)
+
+
+    def test_enclosed_mass(self):
+        expected=np.array([np.sum(self.mass[self.r <= R]) for R in self.radius])
+        np.testing.assert_allclose(self.profile.enclosed_mass(self.radius),expected,rtol=1e-12)
+        np.testing.assert_allclose(enclosed_mass_at(self.r,self.mass,self.radius),expected,rtol=1e-12)
+
+
+    def test_potential(self):
+        radius=self.radius[1:] #the potential diverges at 0
+        expected=np.array([-2.*(np.sum(self.mass[self.r <= R])/R+np.sum(self.mass[self.r > R]/self.r[self.r > R]))
+                           for R in radius])
+        np.testing.assert_allclose(self.profile.potential(radius),expected,rtol=1e-12)
+        np.testing.assert_allclose(self.profile.escape_velocity(radius),np.sqrt(-2.*expected),rtol=1e-12)
+
+
+    def test_circular_velocity(self):
+        radius=self.radius[1:]
+        expected=np.sqrt(2.*np.array([np.sum(self.mass[self.r <= R]) for R in radius])/radius)
+        np.testing.assert_allclose(self.profile.circular_velocity(radius),expected,rtol=1e-12)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
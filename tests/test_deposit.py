@@ -0,0 +1,58 @@
+###NAME: test_deposit.py
+###PURPOSE: deposit onto grids (geometry.deposit) : conservation of the mass, NGP against np.histogramdd, independence on the order of the particles
+
+import unittest
+import numpy as np
+from geometry.deposit import deposit, KERNELS
+
+
+
+class DepositTest(unittest.TestCase):
+
+    def setUp(self):
+        rng=np.random.RandomState(0)
+        self.pos=rng.rand(20000,3)*10.
+        self.mass=rng.rand(20000)+1.
+
+
+    def test_mass_conservation_periodic(self):
+        for kernel in KERNELS:
+            grid=deposit(self.pos,16,weights=self.mass,kernel=kernel,boxsize=10.)
+            self.assertEqual(grid.shape,(16,16,16))
+            self.assertAlmostEqual(grid.sum()/self.mass.sum(),1.,places=10)
+
+
+    def test_mass_conservation_projection(self):
+        for kernel in KERNELS:
+            grid=deposit(self.pos,(20,30),weights=self.mass,kernel=kernel,axes=(0,2),boxsize=10.)
+            self.assertEqual(grid.shape,(20,30))
+            self.assertAlmostEqual(grid.sum()/self.mass.sum(),1.,places=10)
+
+
+    def test_ngp_against_histogram(self):
+        grid=deposit(self.pos,8,lower=[0,0,0],upper=[10,10,10],weights=self.mass,kernel="ngp")
+        expected,edges=np.histogramdd(self.pos,bins=8,range=[(0,10)]*3,weights=self.mass)
+        np.testing.assert_allclose(grid,expected)
+
+
+    def test_order_chunks_and_threads(self):
+        expected=deposit(self.pos,32,weights=self.mass,kernel="tsc",boxsize=10.)
+        order=np.argsort(self.pos[:,0]) #sorted along x : each chunk covers a slab of the grid
+        for pos,mass in ((self.pos[order],self.mass[order]),(self.pos[::-1],self.mass[::-1])):
+            for chunk_size,nthreads in ((1000,1),(777,3)):
+                grid=deposit(pos,32,weights=mass,kernel="tsc",boxsize=10.,chunk_size=chunk_size,nthreads=nthreads)
+                np.testing.assert_allclose(grid,expected,rtol=1e-10,atol=1e-12)
+
+
+    def test_scattered_particles(self):
+        pos=np.array([[0.01,0.01,0.01],[9.99,9.99,9.99],[5.,5.,5.]])
+        grid=deposit(pos,256,kernel="ngp",boxsize=10.)
+        self.assertEqual(grid[0,0,0],1.)
+        self.assertEqual(grid[-1,-1,-1],1.)
+        self.assertEqual(grid[128,128,128],1.)
+        self.assertEqual(grid.sum(),3.)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+###NAME: test_executor.py
+###PURPOSE: out-of-core executor (analysis.executor) against the same reductions done in memory
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from tests.synthetic import write_binary, h5py
+from readers.snapfile import open_snapshot
+from physics.registry import evaluate
+from analysis.executor import ChunkedExecutor, Filter, Compute, ProfileSink, DepositSink, CatalogueWriter
+from analysis.reduction import binned_statistics
+from geometry.create_grid import LinearBins
+from geometry.deposit import deposit
+
+NPART = [3000,0,0,0,0,0]
+
+
+
+class ExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+        self.data=write_binary(os.path.join(self.dir,"snap"),NPART)
+        self.snap=open_snapshot(os.path.join(self.dir,"snap"))
+        self.center=[5.,5.,5.]
+
+
+    def tearDown(self):
+        self.snap.close()
+        shutil.rmtree(self.dir)
+
+
+    def test_sinks_against_memory(self):
+        bins=LinearBins(0.,8.,16)
+        for prefetch in (True,False):
+            executor=ChunkedExecutor(self.snap,"gas",["r","T","pos","MASS"],chunk_bytes=4096,prefetch=prefetch,center=self.center)
+            self.assertTrue(executor.chunk_rows < NPART[0])
+            results=executor.run({"T":ProfileSink("r","T",bins,statistics=("count","mean","var")),
+                                  "map":DepositSink("pos",8,weights="MASS",lower=[-5]*3,upper=[5]*3)})
+
+            fields=evaluate(self.snap,"gas",["r","T","pos"],center=self.center)
+            expected=binned_statistics(fields["r"],bins,fields["T"],statistics=("count","mean","var"))
+            np.testing.assert_array_equal(results["T"]["count"],expected["count"])
+            np.testing.assert_allclose(results["T"]["mean"],expected["mean"],rtol=1e-6)
+            np.testing.assert_allclose(results["T"]["var"],expected["var"],rtol=1e-5)
+            np.testing.assert_allclose(results["map"],deposit(fields["pos"],8,weights=self.data["MASS"],lower=[-5]*3,upper=[5]*3),
+                                       rtol=1e-6)
+
+
+    def test_pipeline(self):
+        executor=ChunkedExecutor(self.snap,"gas",["r","U"],chunk_bytes=4096,center=self.center)
+        pipeline=[Filter(lambda c: c["r"] < 3.),Compute("u2",lambda u: 2*u,"U")]
+        u2=np.concatenate([c["u2"] for c in executor.chunks(pipeline)])
+        r=evaluate(self.snap,"gas",["r"],center=self.center)["r"]
+        np.testing.assert_allclose(u2,2*self.data["U"][r < 3.])
+
+
+    @unittest.skipIf(h5py is None,"h5py is not installed")
+    def test_catalogue(self):
+        filename=os.path.join(self.dir,"hot.hdf5")
+        executor=ChunkedExecutor(self.snap,"gas",["POS","MASS","T"],chunk_bytes=4096)
+        count=executor.run([CatalogueWriter(filename,["POS","MASS","T"],self.snap.header)],
+                           pipeline=[Filter(lambda c: c["T"] > 1e5)])[0]
+
+        T=evaluate(self.snap,"gas",["T"])["T"]
+        catalogue=open_snapshot(filename)
+        self.assertEqual(count,np.sum(T > 1e5))
+        self.assertEqual(catalogue.npart("gas"),count)
+        np.testing.assert_array_equal(catalogue.read("POS","gas"),self.data["POS"][T > 1e5])
+        np.testing.assert_array_equal(catalogue.read("T","gas"),T[T > 1e5])
+        catalogue.close()
+
+
+    @unittest.skipIf(h5py is None,"h5py is not installed")
+    def test_catalogue_closed_on_error(self):
+        def _fail(chunk):
+            if self.calls > 0: #after the first chunk is written
+                raise RuntimeError("step failed")
+            self.calls+=1
+            return chunk
+        self.calls=0
+        writer=CatalogueWriter(os.path.join(self.dir,"cat.hdf5"),["POS"])
+        executor=ChunkedExecutor(self.snap,"gas",["POS"],chunk_bytes=4096)
+        self.assertRaises(RuntimeError,executor.run,[writer],[_fail])
+        self.assertIsNone(writer._file)
+        h5py.File(os.path.join(self.dir,"cat.hdf5"),'r').close() #not locked
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+###NAME: test_fields.py
+###PURPOSE: angular momentum and disk frame (physics.fields, geometry.rotation) against direct numpy computations
+
+import unittest
+import numpy as np
+from physics.fields import specific_angular_momentum, angular_momentum, net_angular_momentum, inertia_tensor
+from geometry.rotation import rotation_matrix, disk_frame
+
+
+
+class AngularMomentumTest(unittest.TestCase):
+
+    def setUp(self):
+        rng=np.random.RandomState(1)
+        self.pos=rng.randn(5000,3).astype('float32')
+        self.vel=rng.randn(5000,3).astype('float32')
+        self.mass=rng.rand(5000)+1.
+
+
+    def test_against_cross_product(self):
+        expected=np.cross(self.pos.astype('float64'),self.vel.astype('float64'))
+        for nthreads in (1,3):
+            j=specific_angular_momentum(self.pos,self.vel,nthreads=nthreads)
+            self.assertEqual(j.dtype,np.float32)
+            np.testing.assert_allclose(j,expected,rtol=1e-5,atol=1e-5)
+
+
+    def test_dtype_of_mass(self):
+        L=angular_momentum(self.pos,self.vel,self.mass)
+        self.assertEqual(L.dtype,np.float64)
+        np.testing.assert_array_equal(L,self.mass[:,None]*specific_angular_momentum(self.pos,self.vel)) #as the original mass*j
+        self.assertEqual(angular_momentum(self.pos,self.vel,self.mass.astype('float32')).dtype,np.float32)
+
+
+    def test_net_angular_momentum(self):
+        center=np.array([0.1,0.2,0.3])
+        velocity=np.array([1.,-1.,0.5])
+        vel=self.vel.astype('float64')
+        before=vel.copy()
+        p=self.pos-center
+        inside=np.sqrt((p**2).sum(axis=1)) < 1.5
+        L=net_angular_momentum(self.pos,vel,self.mass,center=center,velocity=velocity,radius=1.5,nthreads=2)
+        expected=(self.mass[inside,None]*np.cross(p[inside],vel[inside]-velocity)).sum(axis=0)
+        np.testing.assert_allclose(L,expected,rtol=1e-6)
+        np.testing.assert_array_equal(vel,before) #the input is not shifted in place
+        S=inertia_tensor(self.pos,self.mass,center=center,radius=1.5)
+        np.testing.assert_allclose(S,np.dot((p[inside]*self.mass[inside,None]).T,p[inside]),rtol=1e-6)
+
+
+
+class DiskFrameTest(unittest.TestCase):
+
+    def test_tilted_disk(self):
+        rng=np.random.RandomState(2)
+        R=rng.uniform(1.,10.,5000)
+        phi=rng.uniform(0.,2*np.pi,5000)
+        pos=np.c_[R*np.cos(phi),R*np.sin(phi),np.zeros(5000)]
+        vel=np.c_[-np.sin(phi),np.cos(phi),np.zeros(5000)]*200.
+        tilt=rotation_matrix([0,0,1],[1.,2.,-0.5])
+        center=np.array([5.,5.,5.])
+        velocity=np.array([30.,-20.,10.])
+        pos=pos.dot(tilt.T)+center
+        vel=vel.dot(tilt.T)+velocity
+
+        for method in ("angular_momentum","inertia"):
+            pos_cyl,vel_cyl,matrix=disk_frame(pos,vel,center=center,velocity=velocity,method=method,coordinates="cyl")
+            np.testing.assert_allclose(pos_cyl[:,0],R,rtol=1e-8)
+            np.testing.assert_allclose(vel_cyl,np.c_[np.zeros(5000),np.ones(5000)*200.,np.zeros(5000)],atol=1e-6)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
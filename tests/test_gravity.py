@@ -0,0 +1,89 @@
+###NAME: test_gravity.py
+###PURPOSE: Barnes-Hut tree (physics.gravity) against the direct summation over all the pairs of particles
+
+import unittest
+import numpy as np
+from physics.gravity import GravityTree, potential, acceleration
+
+
+
+def _direct(pos,mass,targets=None,softening=0.,G=1.):
+    """Plummer-softened potential and acceleration summed over all the particles, without the self-interaction"""
+
+    same=targets is None
+    targets=pos if same else targets
+    dx=pos[None,:,:]-targets[:,None,:] #from the target to the source
+    r2=np.sum(dx**2,axis=2)+softening**2
+    with np.errstate(divide='ignore'):
+        inv_r=1./np.sqrt(r2)
+    if same:
+        np.fill_diagonal(inv_r,0.)
+    phi=-G*np.dot(inv_r,mass)
+    acc=G*np.einsum('ij,ijk->ik',inv_r**3*mass,dx)
+    return phi,acc
+
+
+
+class GravityTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        rng=np.random.RandomState(11)
+        ##a concentrated halo and a uniform background, so that the tree has several levels
+        self.pos=np.concatenate((rng.randn(1500,3),rng.rand(500,3)*20.-10.))
+        self.mass=rng.rand(2000)+0.5
+        self.phi,self.acc=_direct(self.pos,self.mass,softening=0.05)
+
+
+    def test_theta_zero_is_direct(self):
+        phi,acc=GravityTree(self.pos,self.mass).evaluate(theta=0.,softening=0.05,G=1.)
+        np.testing.assert_allclose(phi,self.phi,rtol=1e-10)
+        np.testing.assert_allclose(acc,self.acc,rtol=1e-8,atol=1e-8*np.max(np.abs(self.acc)))
+
+
+    def test_opening_angle(self):
+        tree=GravityTree(self.pos,self.mass,leaf_size=4)
+        previous=0.
+        for theta in (0.3,0.5,0.8):
+            phi,acc=tree.evaluate(theta=theta,softening=0.05,G=1.)
+            phi_error=np.max(np.abs(phi/self.phi-1.))
+            acc_error=np.sqrt(np.mean(np.sum((acc-self.acc)**2,axis=1)/np.sum(self.acc**2,axis=1)))
+            self.assertTrue(phi_error < 0.01,(theta,phi_error))
+            self.assertTrue(acc_error < 0.02,(theta,acc_error))
+            self.assertTrue(acc_error >= previous) #a larger angle accepts more nodes
+            previous=acc_error
+
+
+    def test_targets(self):
+        targets=np.random.RandomState(12).randn(300,3)*3.
+        expected_phi,expected_acc=_direct(self.pos,self.mass,targets,softening=0.05,G=2.)
+        phi,acc=GravityTree(self.pos,self.mass).evaluate(targets,theta=0.,softening=0.05,G=2.)
+        np.testing.assert_allclose(phi,expected_phi,rtol=1e-10)
+        np.testing.assert_allclose(acc,expected_acc,rtol=1e-8,atol=1e-8*np.max(np.abs(expected_acc)))
+        np.testing.assert_allclose(potential(self.pos,self.mass,targets,theta=0.5,softening=0.05,G=2.),expected_phi,rtol=0.01)
+        np.testing.assert_allclose(acceleration(self.pos,self.mass,targets,theta=0.,softening=0.05,G=2.),expected_acc,
+                                   rtol=1e-8,atol=1e-8*np.max(np.abs(expected_acc)))
+
+
+    def test_threads(self):
+        tree=GravityTree(self.pos,self.mass)
+        phi,acc=tree.evaluate(theta=0.6,softening=0.05,nthreads=1)
+        phi_threads,acc_threads=tree.evaluate(theta=0.6,softening=0.05,nthreads=4)
+        np.testing.assert_array_equal(phi,phi_threads)
+        np.testing.assert_array_equal(acc,acc_threads)
+        self.assertTrue(tree.potential(softening=0.05,nthreads=2) is not None)
+        self.assertEqual(tree.evaluate(potential=False)[0],None)
+
+
+    def test_identical_positions(self):
+        ##more than leaf_size particles at the same place cannot be split
+        pos=np.concatenate((np.zeros((20,3)),np.eye(3)))
+        mass=np.ones(23)
+        expected_phi,expected_acc=_direct(pos,mass,softening=0.1)
+        phi,acc=GravityTree(pos,mass).evaluate(theta=0.5,softening=0.1,G=1.)
+        np.testing.assert_allclose(phi,expected_phi,rtol=1e-10)
+        np.testing.assert_allclose(acc,expected_acc,rtol=1e-8,atol=1e-10)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+###NAME: test_profile.py
+###PURPOSE: profiles (analysis.profile) and binned reductions (analysis.reduction) against the loops of the original implementation
+
+import unittest
+import numpy as np
+import geometry.create_grid as grid
+import analysis.profile as profile
+from analysis.reduction import bin_index, reduce_indexed, binned_statistics
+
+
+
+## ORIGINAL LOOPS : one boolean mask per bin
+
+def _loop(x,q,bins,reduction,empty):
+    result=np.zeros(len(bins)-1)
+    for i in range(len(bins)-1):
+        sublist=(x>=bins[i]) & (x<bins[i+1])
+        result[i]=reduction(q[sublist]) if np.any(sublist) else empty
+    return result
+
+
+def loop_mean(x,q,radius):
+    return _loop(x,q,grid.grid_around(radius),np.mean,np.nan)
+
+
+def loop_min(x,q,radius):
+    return _loop(x,q,grid.grid_around(radius),np.min,np.nan)
+
+
+def loop_n_in_shell(x,bins):
+    return _loop(x,x,bins,len,0.)
+
+
+def loop_mass_per_shell(x,mass,bins):
+    return _loop(x,mass,bins,np.sum,0.)
+
+
+
+class ProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        rng=np.random.RandomState(0)
+        self.x=rng.rand(5000)*12.-1. #some particles outside the bins on both sides
+        self.q=rng.randn(5000)*3.+1.
+        self.radius=np.array([0.5,1.,2.,4.,4.2,4.3,8.,9.])
+        self.bins=np.array([0.,0.5,1.,3.,3.0001,7.,10.])
+
+
+    def test_against_loops(self):
+        np.testing.assert_allclose(profile.mean(self.x,self.q,self.radius),loop_mean(self.x,self.q,self.radius))
+        np.testing.assert_allclose(profile.min(self.x,self.q,self.radius),loop_min(self.x,self.q,self.radius))
+        np.testing.assert_allclose(profile.n_in_shell(self.x,self.bins),loop_n_in_shell(self.x,self.bins))
+        np.testing.assert_allclose(profile.mass_per_shell(self.x,self.q,self.bins),loop_mass_per_shell(self.x,self.q,self.bins))
+        np.testing.assert_allclose(profile.enclosed_mass(self.x,self.q,self.bins),np.cumsum(loop_mass_per_shell(self.x,self.q,self.bins)))
+
+
+    def test_empty_bins(self):
+        bins=np.array([20.,21.,22.]) #all the particles are outside
+        x=np.append(self.x,20.5)
+        q=np.append(self.q,2.)
+        expected=_loop(x,q,bins,np.mean,np.nan)
+        np.testing.assert_array_equal(binned_statistics(x,bins,q,statistics=("mean",))["mean"],expected)
+        np.testing.assert_array_equal(profile.min(x,q,np.array([20.5,21.5])),[2.,np.nan])
+
+
+    def test_no_particle(self):
+        empty=np.array([])
+        radius=np.array([1.,2.,3.])
+        for statistic in ("mean","var","min","max"):
+            result=binned_statistics(empty,grid.grid_around(radius),empty,statistics=(statistic,))[statistic]
+            self.assertEqual(result.dtype,np.float64)
+            self.assertTrue(np.all(np.isnan(result)),statistic)
+        self.assertTrue(np.all(np.isnan(profile.mean(empty,empty,radius))))
+        np.testing.assert_array_equal(profile.mass_per_shell(empty,empty,radius),[0.,0.])
+        result=reduce_indexed(np.array([],dtype='int64'),3,empty,empty,statistics=("weighted_mean",))
+        self.assertTrue(np.all(np.isnan(result["weighted_mean"])))
+
+
+    def test_variance_and_weighted_mean(self):
+        w=np.abs(self.q)
+        result=binned_statistics(self.x,self.bins,self.q,weights=w,statistics=("count","var","max","weighted_mean"))
+        np.testing.assert_allclose(result["var"],_loop(self.x,self.q,self.bins,np.var,np.nan))
+        np.testing.assert_allclose(result["max"],_loop(self.x,self.q,self.bins,np.max,np.nan))
+        with np.errstate(invalid='ignore'): #the bin [3,3.0001] is empty
+            sums=loop_mass_per_shell(self.x,w*self.q,self.bins)/loop_mass_per_shell(self.x,w,self.bins)
+        np.testing.assert_allclose(result["weighted_mean"],sums)
+        np.testing.assert_array_equal(result["count"],loop_n_in_shell(self.x,self.bins))
+
+
+    def test_bins_specification(self):
+        bins=grid.LogBins(0.1,10.,20)
+        x=np.abs(self.x)
+        np.testing.assert_array_equal(bin_index(x,bins),bin_index(x,bins.edges))
+
+
+    def test_weighted_mean_needs_weights(self):
+        self.assertRaises(ValueError,reduce_indexed,np.zeros(3,dtype='int64'),2,np.ones(3),statistics=("weighted_mean",))
+        self.assertRaises(KeyError,reduce_indexed,np.zeros(3,dtype='int64'),2,np.ones(3),statistics=("median",))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
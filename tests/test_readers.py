@@ -0,0 +1,134 @@
+###NAME: test_readers.py
+###PURPOSE: snapshot readers (readers.binary, readers.hdf5, readers.multifile) against the synthetic blocks they were written from
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from tests.synthetic import particles, split, write_binary, write_hdf5, rows, h5py
+from readers.snapfile import open_snapshot
+from readers.binary import GadgetBinaryFile, BLOCK_ORDER_COOLING
+from readers.hdf5 import GadgetHDF5File
+from readers.multifile import MultiFileSnapshot
+from names.filename import get_snapshot_files
+
+NPART  = [100,200,0,0,50,0]
+MASSES = [0.,0.5,0.,0.,0.,0.] #the masses of the dark matter are in the header
+
+
+
+class ReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def check_snapshot(self,snap,data,npart=NPART,masses=MASSES):
+        self.assertEqual([snap.npart(t) for t in range(6)],list(npart))
+        for ptype in ("gas","dm","star"):
+            t={"gas":0,"dm":1,"star":4}[ptype]
+            for name in ("POS","VEL","ID"):
+                np.testing.assert_array_equal(snap.read(name,ptype),rows(data,name,npart,t))
+            if masses[t] > 0:
+                np.testing.assert_array_equal(snap.block("MASS",ptype),np.float32(masses[t])*np.ones(npart[t]))
+            else:
+                np.testing.assert_array_equal(snap.read("MASS",ptype),rows(data,"MASS",npart,t,masses))
+        for name in ("U","RHO","NE","HSML"):
+            np.testing.assert_array_equal(snap.read(name,"gas"),data[name])
+
+        ##partial reads, into a preallocated output and by chunks
+        np.testing.assert_array_equal(snap.read("POS","dm",10,60),rows(data,"POS",npart,1)[10:60])
+        out=np.zeros((50,3),dtype=data["VEL"].dtype)
+        snap.read("VEL","dm",5,55,out=out)
+        np.testing.assert_array_equal(out,rows(data,"VEL",npart,1)[5:55])
+        chunks=list(snap.iter_chunks("POS","dm",chunk_bytes=600))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(chunks[-1][1],npart[1])
+        np.testing.assert_array_equal(np.concatenate([c for start,stop,c in chunks]),rows(data,"POS",npart,1))
+
+
+    def test_binary_format_2(self):
+        for endian in ('<','>'):
+            data=write_binary(os.path.join(self.dir,"snap"),NPART,MASSES,fmt=2,endian=endian)
+            snap=open_snapshot(os.path.join(self.dir,"snap"))
+            self.assertIsInstance(snap,GadgetBinaryFile)
+            self.assertEqual(snap.header["Time"],0.5)
+            self.check_snapshot(snap,data)
+            snap.close()
+
+
+    def test_binary_format_1(self):
+        data=write_binary(os.path.join(self.dir,"snap"),NPART,MASSES,fmt=1)
+        snap=open_snapshot(os.path.join(self.dir,"snap"),block_order=BLOCK_ORDER_COOLING)
+        self.check_snapshot(snap,data)
+        self.assertEqual(snap.blocks(),["POS","VEL","ID","MASS","U","RHO","NE","NH","HSML"])
+        snap.close()
+
+
+    def test_binary_double_precision(self):
+        data=write_binary(os.path.join(self.dir,"snap"),NPART,MASSES,dtype='float64')
+        snap=open_snapshot(os.path.join(self.dir,"snap"))
+        self.assertEqual(snap.read("POS","gas").dtype,np.float64)
+        self.check_snapshot(snap,data)
+        snap.close()
+
+
+    def test_missing_block(self):
+        write_binary(os.path.join(self.dir,"snap"),NPART,MASSES,cooling=False)
+        snap=open_snapshot(os.path.join(self.dir,"snap"))
+        self.assertRaises(KeyError,snap.block,"NE","gas")
+        self.assertRaises(KeyError,snap.block,"U","dm")
+        snap.close()
+
+
+    @unittest.skipIf(h5py is None,"h5py is not installed")
+    def test_hdf5(self):
+        data=write_hdf5(os.path.join(self.dir,"snap.hdf5"),NPART,MASSES)
+        snap=open_snapshot(os.path.join(self.dir,"snap.hdf5"))
+        self.assertIsInstance(snap,GadgetHDF5File)
+        self.check_snapshot(snap,data)
+        self.assertEqual(snap.blocks("gas"),["HSML","ID","MASS","NE","NH","POS","RHO","U","VEL"])
+        self.assertEqual(snap.blocks("dm"),["ID","POS","VEL"])
+        np.testing.assert_array_equal(snap.read("Coordinates","gas"),data["POS"][:NPART[0]]) #HDF5 names are accepted too
+        self.assertRaises(KeyError,snap.block,"U","dm")
+        snap.close()
+
+
+    def check_split(self,write,ext):
+        data=particles(NPART,MASSES)
+        os.makedirs(os.path.join(self.dir,"snapdir_007"))
+        for i,(npart,part) in enumerate(split(data,NPART,3,MASSES)):
+            write(os.path.join(self.dir,"snapdir_007","snapshot_007."+str(i)+ext),npart,MASSES,data=part,numfiles=3)
+        files=get_snapshot_files(7,dir=self.dir,ext=ext[1:])
+        self.assertEqual(len(files),3)
+        for nthreads in (1,3):
+            snap=open_snapshot(files,nthreads=nthreads)
+            self.assertIsInstance(snap,MultiFileSnapshot)
+            self.check_snapshot(snap,data)
+            np.testing.assert_array_equal(snap.read("POS","dm",60,140),rows(data,"POS",NPART,1)[60:140]) #across the files
+            snap.close()
+
+
+    def test_binary_split(self):
+        self.check_split(write_binary,"")
+
+
+    @unittest.skipIf(h5py is None,"h5py is not installed")
+    def test_hdf5_split(self):
+        self.check_split(write_hdf5,".hdf5")
+
+
+    def test_not_a_snapshot(self):
+        with open(os.path.join(self.dir,"snap"),'wb') as f:
+            f.write(b"\x01\x02\x03\x04 not a snapshot")
+        self.assertRaises(IOError,open_snapshot,os.path.join(self.dir,"snap"))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+###NAME: test_registry.py
+###PURPOSE: derived fields of physics.registry, through evaluate, the Snapshot container and the chunked executor, against the direct computations
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from tests.synthetic import write_binary, write_hdf5, h5py
+from readers.snapfile import open_snapshot
+from readers.snapshot import Snapshot
+from physics.registry import FIELDS, evaluate
+from physics.thermodynamics import gas_temperature, thermodynamics
+from geometry.periodic import recenter
+from analysis.executor import ChunkedExecutor
+
+NPART = [1000,500,0,0,0,0]
+
+
+
+class ThermodynamicFieldsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def check_temperature(self,snap,data):
+        ne=data.get("NE")
+        expected=gas_temperature(data["U"],ne)
+        np.testing.assert_allclose(evaluate(snap,"gas",["T"],chunk_rows=300)["T"],expected,rtol=1e-6)
+        np.testing.assert_allclose(Snapshot(snap).field("temperature","gas"),expected,rtol=1e-6)
+        executor=ChunkedExecutor(snap,"gas",["T"],chunk_bytes=1000)
+        np.testing.assert_allclose(np.concatenate([c["T"] for c in executor.chunks()]),expected,rtol=1e-6)
+
+
+    @unittest.skipIf(h5py is None,"h5py is not installed")
+    def test_hdf5_with_electron_abundance(self):
+        data=write_hdf5(os.path.join(self.dir,"snap.hdf5"),NPART,cooling=True)
+        snap=open_snapshot(os.path.join(self.dir,"snap.hdf5"))
+        self.assertIn("NE",snap.blocks())
+        self.assertIn("NE",FIELDS.plan(["T"],snap.blocks()).blocks)
+        self.check_temperature(snap,data)
+
+
+    @unittest.skipIf(h5py is None,"h5py is not installed")
+    def test_hdf5_without_cooling(self):
+        data=write_hdf5(os.path.join(self.dir,"snap.hdf5"),NPART,cooling=False)
+        self.check_temperature(open_snapshot(os.path.join(self.dir,"snap.hdf5")),data)
+
+
+    def test_binary(self):
+        for cooling in (True,False):
+            data=write_binary(os.path.join(self.dir,"snap"),NPART,cooling=cooling)
+            self.check_temperature(open_snapshot(os.path.join(self.dir,"snap")),data)
+
+
+    def test_all_fields(self):
+        data=write_binary(os.path.join(self.dir,"snap"),NPART,cooling=True)
+        names=["mu","temperature","pressure","entropy","number_density"]
+        result=evaluate(open_snapshot(os.path.join(self.dir,"snap")),"gas",names,chunk_rows=256)
+        expected=thermodynamics(data["U"],data["NE"],data["RHO"],fields=names)
+        for name in names:
+            np.testing.assert_allclose(result[name],expected[name],rtol=1e-6)
+
+
+    def test_alias_shares_the_cache(self):
+        write_binary(os.path.join(self.dir,"snap"),NPART,cooling=False)
+        snap=Snapshot(os.path.join(self.dir,"snap"))
+        self.assertIs(snap.field("T","gas"),snap.field("temperature","gas"))
+
+
+
+class GeometricFieldsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+        self.data=write_binary(os.path.join(self.dir,"snap"),[0,2000,0,0,0,0],boxsize=10.)
+        self.snap=open_snapshot(os.path.join(self.dir,"snap"))
+
+
+    def tearDown(self):
+        self.snap.close()
+        shutil.rmtree(self.dir)
+
+
+    def test_against_direct(self):
+        center=np.array([1.,9.,5.])
+        result=evaluate(self.snap,"dm",["r","v_r","j_z","v_phi"],chunk_rows=300,center=center,boxsize=10.)
+        pos=recenter(self.data["POS"].astype('float64'),center,10.)
+        vel=self.data["VEL"].astype('float64')
+        r=np.sqrt((pos**2).sum(axis=1))
+        R=np.hypot(pos[:,0],pos[:,1])
+        np.testing.assert_allclose(result["r"],r,rtol=1e-5)
+        np.testing.assert_allclose(result["v_r"],(pos*vel).sum(axis=1)/r,rtol=1e-4,atol=1e-6)
+        np.testing.assert_allclose(result["j_z"],pos[:,0]*vel[:,1]-pos[:,1]*vel[:,0],rtol=1e-4,atol=1e-6)
+        np.testing.assert_allclose(result["v_phi"],(pos[:,0]*vel[:,1]-pos[:,1]*vel[:,0])/R,rtol=1e-4,atol=1e-6)
+
+
+    def test_plan_reads_each_block_once(self):
+        plan=FIELDS.plan(["r","v_r","j_z","v_phi"])
+        self.assertEqual(plan.blocks,["POS","VEL"])
+        self.assertEqual(plan.steps.count("pos"),1)
+
+
+    def test_cycle(self):
+        from physics.registry import FieldRegistry
+        registry=FieldRegistry()
+        registry.register("a",lambda b: b,["b"])
+        registry.register("b",lambda a: a,["a"])
+        self.assertRaises(ValueError,registry.plan,["a"])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
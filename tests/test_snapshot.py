@@ -0,0 +1,101 @@
+###NAME: test_snapshot.py
+###PURPOSE: Snapshot container (readers.snapshot) : derived fields against direct computations, memory budget of the cache
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from tests.synthetic import write_binary, rows
+from readers.snapshot import Snapshot
+from internals.cache import LRUCache
+from geometry.coordinates import change_coordinates, radius
+
+NPART = [1000,2000,0,0,0,0]
+
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+        self.filename=os.path.join(self.dir,"snap")
+        self.data=write_binary(self.filename,NPART)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def test_fields(self):
+        snap=Snapshot(self.filename,center=[5,5,5])
+        pos=rows(self.data,"POS",NPART,1)
+        r=snap.field("r","dm")
+        self.assertIs(snap.field("r","dm"),r)
+        np.testing.assert_allclose(r,radius(pos,[5,5,5]),rtol=1e-6)
+        np.testing.assert_allclose(snap.field("pos","dm",coordinates="sph"),
+                                   change_coordinates(pos-5.,"pos","cart","sph"),rtol=1e-5,atol=1e-5)
+        np.testing.assert_array_equal(snap["dm","VEL"],rows(self.data,"VEL",NPART,1))
+        self.assertIs(snap.field("vel","dm"),snap.column("VEL","dm"))
+        snap.close()
+
+
+    def test_memory_budget(self):
+        budget=60000
+        snap=Snapshot(self.filename,cache_bytes=budget)
+        for ptype in ("gas","dm"):
+            for name in ("POS","VEL","ID","MASS"):
+                np.testing.assert_array_equal(snap.column(name,ptype),rows(self.data,name,NPART,{"gas":0,"dm":1}[ptype]))
+                self.assertTrue(snap.nbytes <= budget)
+        for name in ("U","RHO","NE","HSML"):
+            snap.column(name,"gas")
+            snap.field("r","gas")
+            self.assertTrue(snap.nbytes <= budget)
+        np.testing.assert_array_equal(snap.column("POS","gas"),rows(self.data,"POS",NPART,0)) #evicted, read again
+        snap.close()
+
+
+    def test_release(self):
+        snap=Snapshot(self.filename)
+        flag=np.arange(NPART[0]) % 2 == 0
+        snap.add_column("flag","gas",flag)
+        snap.field("r","gas")
+        snap.release("gas",columns=False)
+        self.assertEqual([key[0] for key in snap.cache.keys()],["POS"])
+        self.assertIs(snap.field("flag","gas"),flag)
+        snap.release("gas")
+        self.assertEqual(len(snap.cache),0)
+        self.assertEqual(snap.nbytes,0)
+        snap.close()
+
+
+    def test_unicode_path(self):
+        snap=Snapshot(u""+self.filename)
+        self.assertEqual(snap.npart("dm"),NPART[1])
+        snap.close()
+
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_eviction(self):
+        cache=LRUCache(1000)
+        cache.put("a",np.zeros(50))
+        cache.put("b",np.zeros(50))
+        cache.get("a")
+        cache.put("c",np.zeros(50))
+        self.assertEqual(cache.keys(),["a","c"])
+        self.assertEqual(cache.nbytes,800)
+        self.assertFalse(cache.put("big",np.zeros(200)))
+        self.assertEqual(cache.nbytes,800)
+
+
+    def test_views_take_no_memory(self):
+        cache=LRUCache(1000)
+        cache.put("mass",np.broadcast_to(np.float32(1.),(10**6,)))
+        self.assertEqual(cache.nbytes,0)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+###NAME: test_spatial.py
+###PURPOSE: spatial selections (filter.index, filter.spatial) against brute force selections on all the particles
+
+import unittest
+import numpy as np
+from filter.index import SpatialIndex
+from filter import spatial
+from geometry.coordinates import radius
+from geometry.periodic import wrap, minimum_image, recenter
+
+
+
+def _distance(pos,center):
+    return np.sqrt(np.sum((pos-np.asarray(center))**2,axis=1))
+
+
+
+class SpatialIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        rng=np.random.RandomState(3)
+        self.pos=rng.rand(20000,3)*100.
+        self.pos[:5000]=rng.randn(5000,3)*3.+50. #a clump, so that the cells are not evenly filled
+        self.index=SpatialIndex(self.pos)
+
+
+    def assertSelection(self,ind,expected):
+        np.testing.assert_array_equal(ind,np.flatnonzero(expected))
+
+
+    def test_sphere(self):
+        for center,r in (([50.,50.,50.],5.),([10.,90.,30.],12.),([0.,0.,0.],20.),([300.,0.,0.],10.),([50.,50.,50.],0.)):
+            self.assertSelection(self.index.sphere(center,r),_distance(self.pos,center) <= r)
+
+
+    def test_spherical_shell(self):
+        d=_distance(self.pos,[45.,55.,50.])
+        self.assertSelection(self.index.spherical_shell([45.,55.,50.],3.,15.),(d >= 3.) & (d <= 15.))
+
+
+    def test_box(self):
+        lower=np.array([20.,-5.,40.])
+        upper=np.array([35.,30.,60.])
+        expected=np.all((self.pos >= lower) & (self.pos <= upper),axis=1)
+        self.assertSelection(self.index.box(lower,upper),expected)
+
+
+    def test_cylinder(self):
+        center=np.array([50.,40.,60.])
+        for axis in range(3):
+            others=[i for i in range(3) if i != axis]
+            rho=_distance(self.pos[:,others],center[others])
+            expected=(rho <= 8.) & (np.abs(self.pos[:,axis]-center[axis]) <= 20.)
+            self.assertSelection(self.index.cylinder(center,8.,20.,axis=axis),expected)
+
+
+    def test_filters_with_and_without_index(self):
+        center=[52.,48.,50.]
+        for name,args in (("sphere",(6.,center)),("spherical_shell",(2.,6.,center)),("box",([40.,40.,40.],[55.,60.,52.])),
+                          ("cylinder",(4.,10.,center))):
+            function=getattr(spatial,name)
+            np.testing.assert_array_equal(function(self.pos,*args,index=self.index),function(self.pos,*args),err_msg=name)
+
+
+    def test_number_of_cells(self):
+        for ncells in (1,2,17):
+            index=SpatialIndex(self.pos,ncells=ncells)
+            self.assertSelection(index.sphere([30.,60.,50.],25.),_distance(self.pos,[30.,60.,50.]) <= 25.)
+
+
+    def test_empty(self):
+        index=SpatialIndex(np.zeros((0,3)))
+        self.assertEqual(len(index.sphere([0.,0.,0.],1.)),0)
+
+
+
+class SpheresTest(unittest.TestCase):
+
+    def setUp(self):
+        rng=np.random.RandomState(4)
+        self.pos=rng.rand(20000,3)*100.
+        self.centers=rng.rand(600,3)*110.-5. #more than one batch of centers, some near or outside the edges
+        self.radii=rng.rand(600)*8.
+        self.radii[:10]=0.
+
+
+    def _check(self,offsets,indices,centers,distance):
+        self.assertEqual(len(offsets),len(centers)+1)
+        self.assertEqual(offsets[-1],len(indices))
+        for i,(center,r) in enumerate(zip(centers,self.radii)):
+            np.testing.assert_array_equal(indices[offsets[i]:offsets[i+1]],np.flatnonzero(distance(self.pos,center) <= r))
+
+
+    def test_against_single_spheres(self):
+        index=SpatialIndex(self.pos)
+        for nthreads in (1,4):
+            offsets,indices=index.spheres(self.centers,self.radii,nthreads=nthreads)
+            self._check(offsets,indices,self.centers,_distance)
+
+
+    def test_filter(self):
+        offsets,indices=spatial.spheres(self.pos,self.centers,5.,nthreads=2)
+        expected=[np.flatnonzero(_distance(self.pos,c) <= 5.) for c in self.centers]
+        np.testing.assert_array_equal(np.diff(offsets),[len(e) for e in expected])
+        np.testing.assert_array_equal(indices,np.concatenate(expected))
+
+
+    def test_no_center(self):
+        offsets,indices=spatial.spheres(self.pos,np.zeros((0,3)),1.)
+        np.testing.assert_array_equal(offsets,[0])
+        self.assertEqual(len(indices),0)
+
+
+    def test_periodic(self):
+        boxsize=100.
+        centers=self.centers % boxsize
+        offsets,indices=SpatialIndex(self.pos,boxsize=boxsize).spheres(centers,self.radii,nthreads=2)
+        self._check(offsets,indices,centers,lambda pos,center: _periodic_distance(pos,center,boxsize))
+
+
+
+def _periodic_distance(pos,center,boxsize):
+    """Distance to the nearest periodic image of center : along each axis, the separation is the shortest way around the box"""
+    d=np.abs(pos-np.asarray(center)) % boxsize
+    d=np.minimum(d,boxsize-d)
+    return np.sqrt(np.sum(d**2,axis=1))
+
+
+
+class PeriodicTest(unittest.TestCase):
+
+    def setUp(self):
+        rng=np.random.RandomState(5)
+        self.boxsize=50.
+        self.pos=rng.rand(10000,3)*self.boxsize
+        self.index=SpatialIndex(self.pos,boxsize=self.boxsize)
+        self.corner=[1.,49.,2.] #the regions around it cross the boundaries of the box
+
+
+    def test_minimum_image_and_wrap(self):
+        dx=np.array([-49.,-26.,-24.,0.,24.,26.,49.,101.])
+        np.testing.assert_allclose(minimum_image(dx,self.boxsize),[1.,24.,-24.,0.,24.,-24.,-1.,1.])
+        np.testing.assert_allclose(wrap(np.array([-1.,0.,51.,149.]),self.boxsize),[49.,0.,1.,49.])
+
+
+    def test_radius_and_recenter(self):
+        expected=_periodic_distance(self.pos,self.corner,self.boxsize)
+        np.testing.assert_allclose(radius(self.pos,self.corner,boxsize=self.boxsize),expected)
+        relative=recenter(self.pos,self.corner,self.boxsize)
+        self.assertTrue(np.all(np.abs(relative) <= self.boxsize/2.))
+        np.testing.assert_allclose(np.sqrt(np.sum(relative**2,axis=1)),expected)
+
+
+    def test_sphere(self):
+        expected=_periodic_distance(self.pos,self.corner,self.boxsize) <= 8.
+        self.assertTrue(np.sum(expected) > np.sum(_distance(self.pos,self.corner) <= 8.)) #the images matter
+        np.testing.assert_array_equal(self.index.sphere(self.corner,8.),np.flatnonzero(expected))
+        np.testing.assert_array_equal(spatial.sphere(self.pos,8.,self.corner,boxsize=self.boxsize),expected)
+        np.testing.assert_array_equal(spatial.sphere(self.pos,8.,self.corner,index=self.index),expected)
+
+
+    def test_large_sphere(self):
+        ##a sphere larger than half the box : each particle is selected once, with its nearest image
+        expected=_periodic_distance(self.pos,self.corner,self.boxsize) <= 30.
+        np.testing.assert_array_equal(self.index.sphere(self.corner,30.),np.flatnonzero(expected))
+
+
+    def test_shell_box_cylinder(self):
+        d=_periodic_distance(self.pos,self.corner,self.boxsize)
+        expected=(d >= 3.) & (d <= 9.)
+        np.testing.assert_array_equal(self.index.spherical_shell(self.corner,3.,9.),np.flatnonzero(expected))
+        np.testing.assert_array_equal(spatial.spherical_shell(self.pos,3.,9.,self.corner,boxsize=self.boxsize),expected)
+
+        lower=np.array([-4.,45.,-2.])
+        upper=np.array([6.,53.,5.])
+        shifted=(self.pos-lower) % self.boxsize #position from the lower corner, in [0,boxsize)
+        expected=np.all(shifted <= upper-lower,axis=1)
+        np.testing.assert_array_equal(self.index.box(lower,upper),np.flatnonzero(expected))
+        np.testing.assert_array_equal(spatial.box(self.pos,lower,upper,boxsize=self.boxsize),expected)
+
+        separation=minimum_image(self.pos-self.corner,self.boxsize)
+        expected=(np.hypot(separation[:,0],separation[:,1]) <= 5.) & (np.abs(separation[:,2]) <= 12.)
+        np.testing.assert_array_equal(self.index.cylinder(self.corner,5.,12.),np.flatnonzero(expected))
+        np.testing.assert_array_equal(spatial.cylinder(self.pos,5.,12.,self.corner,boxsize=self.boxsize),expected)
+
+
+    def test_extract_sphere(self):
+        expected=np.flatnonzero(_periodic_distance(self.pos,self.corner,self.boxsize) <= 8.)
+        for index in (None,self.index):
+            ind,relative=spatial.extract_sphere(self.pos,8.,self.corner,index=index,boxsize=self.boxsize)
+            np.testing.assert_array_equal(ind,expected)
+            self.assertTrue(np.all(np.sqrt(np.sum(relative**2,axis=1)) <= 8.))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+###NAME: test_timeseries.py
+###PURPOSE: profiles of a series of snapshots (analysis.timeseries) against the profiles of each snapshot, resume and failure
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from tests.synthetic import write_binary, rows
+import analysis.profile as profile
+from analysis.timeseries import profile_time_series, ProfileSpec
+from geometry.coordinates import radius
+
+NPART = [200,300,0,0,0,0]
+BINS = np.linspace(1.,9.,8)
+
+
+
+class TimeSeriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+        self.data=[write_binary(os.path.join(self.dir,"snapshot_%03d" % i),NPART,seed=i) for i in range(4)]
+        self.specs=[ProfileSpec("rho",profile.mean,"gas","RHO",BINS,center=[5,5,5]),
+                    ProfileSpec("mass",profile.mass_per_shell,"dm","MASS",BINS,center=[5,5,5])]
+        self.output=os.path.join(self.dir,"profiles")
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def test_against_each_snapshot(self):
+        result=profile_time_series(range(4),self.specs,self.output,dir=self.dir,nprocs=2)
+        self.assertEqual(result["rho"].shape,(4,len(BINS)))
+        for i,data in enumerate(self.data):
+            r=radius(rows(data,"POS",NPART,0),[5,5,5])
+            np.testing.assert_allclose(result["rho"][i],profile.mean(r,data["RHO"],BINS),rtol=1e-6)
+            r=radius(rows(data,"POS",NPART,1),[5,5,5])
+            np.testing.assert_allclose(result["mass"][i],profile.mass_per_shell(r,rows(data,"MASS",NPART,1),BINS),rtol=1e-6)
+        self.assertTrue(np.all(np.load(os.path.join(self.output,"done.npy"))))
+
+
+    def test_resume(self):
+        profile_time_series(range(4),self.specs,self.output,dir=self.dir,nprocs=2)
+        done=np.load(os.path.join(self.output,"done.npy"))
+        done[2]=False
+        np.save(os.path.join(self.output,"done.npy"),done)
+        before=np.load(os.path.join(self.output,"rho.npy"))
+        result=profile_time_series(range(4),self.specs,self.output,dir=self.dir,nprocs=2)
+        np.testing.assert_array_equal(result["rho"],before)
+
+
+    def test_failure(self):
+        with open(os.path.join(self.dir,"snapshot_004"),'wb') as f:
+            f.write(b"not a snapshot")
+        self.assertRaises(IOError,profile_time_series,[4,0,1],self.specs,self.output,dir=self.dir,nprocs=1)
+
+
+
+if __name__ == "__main__":
+    unittest.main()